@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cart, CartItem, Order, OrderItem, Payment
+from .models import Cart, CartItem, Order, OrderItem, OutboxEvent, Payment
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -14,6 +14,10 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ('total_price', 'total_items')
     inlines = [CartItemInline]
 
+    def get_queryset(self, request):
+        # total_items/total_price in list_display iterate the items of every row
+        return super().get_queryset(request).select_related('user').with_items()
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
@@ -60,7 +64,14 @@ class PaymentAdmin(admin.ModelAdmin):
     search_fields = ('order__order_number', 'transaction_id')
     readonly_fields = ('created_at', 'updated_at')
 
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'aggregate_type', 'aggregate_id', 'created_at', 'published_at', 'attempts')
+    list_filter = ('event_type', 'aggregate_type')
+    search_fields = ('aggregate_id',)
+    readonly_fields = ('created_at',)
+
 # Register models
 admin.site.register(Cart, CartAdmin)
 admin.site.register(Order, OrderAdmin)
-admin.site.register(Payment, PaymentAdmin)
\ No newline at end of file
+admin.site.register(Payment, PaymentAdmin)
+admin.site.register(OutboxEvent, OutboxEventAdmin)
\ No newline at end of file
@@ -0,0 +1,364 @@
+"""
+Cart storage helpers.
+
+Guests get a cart kept in the cache (Redis) rather than in Postgres,
+identified by an opaque token the client sends back in the ``X-Cart-Token``
+header, so anonymous cart traffic never writes to the database. When the
+shopper signs in, `merge_guest_cart()` folds it into their database cart
+with a single upsert.
+"""
+import secrets
+from datetime import timedelta
+from functools import partial, reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, FilteredRelation, OuterRef, Prefetch, Q, prefetch_related_objects
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from apps.products.models import Product, ProductImage, ProductVariant, VariantAttributeValue
+from rest_framework import serializers
+from .models import Cart, CartItem
+
+CART_TOKEN_HEADER = 'X-Cart-Token'
+# Seconds a guest cart stays claimed by a merge that never committed
+MERGE_CLAIM_TIMEOUT = 60
+
+
+def upsert_cart_items(cart, lines, add=True):
+    """
+    Write `lines` ({(product_id, variant_id): quantity}) to `cart` in one
+    ``INSERT ... ON CONFLICT`` on the (cart, product, variant) key. Existing
+    lines get the quantity added (add=True) or replaced (add=False).
+    Returns {(product_id, variant_id): resulting quantity}.
+    """
+    if not lines:
+        return {}
+    quote = connection.ops.quote_name
+    table = quote(CartItem._meta.db_table)
+    columns = ['cart_id', 'product_id', 'variant_id', 'quantity', 'created_at', 'updated_at']
+    now = timezone.now()
+    params = []
+    for (product_id, variant_id), quantity in lines.items():
+        params += [cart.pk, product_id, variant_id, quantity, now, now]
+    quantity = f"{table}.quantity + EXCLUDED.quantity" if add else "EXCLUDED.quantity"
+    row = f"({', '.join(['%s'] * len(columns))})"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(map(quote, columns))}) "
+            f"VALUES {', '.join([row] * len(lines))} "
+            f"ON CONFLICT (cart_id, product_id, variant_id) "
+            f"DO UPDATE SET quantity = {quantity}, updated_at = EXCLUDED.updated_at "
+            f"RETURNING product_id, variant_id, quantity",
+            params
+        )
+        return {(product_id, variant_id): quantity for product_id, variant_id, quantity in cursor.fetchall()}
+
+
+def get_user_cart(user):
+    """
+    The user's cart, created on first use. Two first requests racing each
+    other both end up with the same cart: the loser's INSERT fails on the
+    cart_one_per_user constraint and get_or_create() reads the winner's row.
+    """
+    cart, _ = Cart.objects.get_or_create(user=user)
+    return cart
+
+
+def _cache_key(token):
+    return f"orders:guest-cart:{token}"
+
+
+class GuestCart:
+    """
+    An anonymous shopper's cart. Lines are kept as
+    {line id: {'product': id, 'variant': id or None, 'quantity': n}} and the
+    whole cart expires GUEST_CART_TIMEOUT seconds after its last change.
+    """
+
+    def __init__(self, token=None):
+        data = cache.get(_cache_key(token)) if token else None
+        if data is None:
+            token = secrets.token_urlsafe(24)
+            now = timezone.now().isoformat()
+            data = {'lines': {}, 'next_id': 1, 'created_at': now, 'updated_at': now}
+        self.token = token
+        self.data = data
+
+    @property
+    def lines(self):
+        return self.data['lines']
+
+    def find(self, product_id, variant_id):
+        for line_id, line in self.lines.items():
+            if line['product'] == product_id and line['variant'] == variant_id:
+                return line_id
+        return None
+
+    def add(self, product_id, variant_id, quantity):
+        """Add to a line, like `CartViewSet.add_item`. Returns False if the cart is full."""
+        line_id = self.find(product_id, variant_id)
+        if line_id is not None:
+            self.lines[line_id]['quantity'] += quantity
+            return True
+        if len(self.lines) >= settings.GUEST_CART_MAX_LINES:
+            return False
+        self.lines[str(self.data['next_id'])] = {'product': product_id, 'variant': variant_id, 'quantity': quantity}
+        self.data['next_id'] += 1
+        return True
+
+    def set_quantity(self, line_id, quantity):
+        """Returns False if there is no such line"""
+        line = self.lines.get(str(line_id))
+        if line is None:
+            return False
+        if quantity <= 0:
+            del self.lines[str(line_id)]
+        else:
+            line['quantity'] = quantity
+        return True
+
+    def remove(self, line_id):
+        return self.lines.pop(str(line_id), None) is not None
+
+    def clear(self):
+        self.lines.clear()
+
+    def apply(self, changes):
+        """Apply `net_changes()` output. Returns False if the cart would be too full."""
+        for (product_id, variant_id), change in changes.items():
+            line_id = self.find(product_id, variant_id)
+            if change['quantity'] is not None and line_id is not None:
+                self.set_quantity(line_id, change['quantity'] + change['add'])
+            elif change['add'] or change['quantity']:
+                if not self.add(product_id, variant_id, (change['quantity'] or 0) + change['add']):
+                    return False
+        return True
+
+    def quantities(self):
+        return {(line['product'], line['variant']): line['quantity'] for line in self.lines.values()}
+
+    def save(self):
+        self.data['updated_at'] = timezone.now().isoformat()
+        cache.set(_cache_key(self.token), self.data, timeout=settings.GUEST_CART_TIMEOUT)
+
+    def load_items(self):
+        """
+        Unsaved CartItems for the lines, with the same related objects
+        `Cart.load_items()` provides, so `CartSerializer` can render this cart.
+        Lines whose product has since been deleted are left out.
+        """
+        items = [
+            CartItem(id=int(line_id), product_id=line['product'], variant_id=line['variant'], quantity=line['quantity'])
+            for line_id, line in self.lines.items()
+        ]
+        prefetch_related_objects(
+            items,
+            'product',
+            Prefetch('product__images', queryset=ProductImage.objects.filter(is_primary=True), to_attr='primary_images'),
+            'variant__product',
+            Prefetch(
+                'variant__attribute_values',
+                queryset=VariantAttributeValue.objects.select_related('attribute_value__attribute')
+            ),
+        )
+        self.items = [item for item in items if item.product is not None]
+        return self
+
+    @property
+    def id(self):
+        return None
+
+    @property
+    def created_at(self):
+        return parse_datetime(self.data['created_at'])
+
+    @property
+    def updated_at(self):
+        return parse_datetime(self.data['updated_at'])
+
+    @property
+    def total_price(self):
+        return sum(item.total_price for item in self.items)
+
+    @property
+    def total_items(self):
+        return sum(item.quantity for item in self.items)
+
+
+def merge_guest_cart(cart, token):
+    """
+    Move the guest cart `token` into the database `cart`, adding quantities
+    to lines both have. The guest cart is deleted once the merge commits, so
+    it survives a failed one; until then a short-lived claim stops another
+    request sending the same token from merging it a second time.
+    """
+    if not token:
+        return False
+    key = _cache_key(token)
+    claim = f"{key}:merging"
+    if not cache.add(claim, 1, timeout=MERGE_CLAIM_TIMEOUT):
+        return False
+    try:
+        data = cache.get(key)
+        if not data:
+            cache.delete(claim)
+            return False
+        lines = {(line['product'], line['variant']): line['quantity'] for line in data['lines'].values()}
+        # Skip whatever was deleted from the catalog in the meantime
+        products = set(Product.objects.filter(id__in={product for product, _ in lines}).values_list('id', flat=True))
+        variants = {variant for _, variant in lines if variant}
+        if variants:
+            variants = set(ProductVariant.objects.filter(id__in=variants).values_list('id', flat=True))
+        with transaction.atomic():
+            upsert_cart_items(cart, {
+                (product, variant): quantity for (product, variant), quantity in lines.items()
+                if product in products and (variant is None or variant in variants)
+            })
+            transaction.on_commit(partial(cache.delete_many, [key, claim]))
+    except Exception:
+        cache.delete(claim)
+        raise
+    return True
+
+
+def net_changes(operations):
+    """
+    Fold a batch of cart operations into one change per line:
+    {(product_id, variant_id): {'quantity': absolute quantity or None to
+    keep the current one, 'add': amount added on top, 'index': last
+    operation touching the line}}.
+    """
+    changes = {}
+    for index, operation in enumerate(operations):
+        key = (operation['product_id'], operation.get('variant_id'))
+        change = changes.setdefault(key, {'quantity': None, 'add': 0})
+        change['index'] = index
+        if operation['op'] == 'add':
+            change['add'] += operation['quantity']
+        elif operation['op'] == 'set':
+            change.update(quantity=operation['quantity'], add=0)
+        else:
+            change.update(quantity=0, add=0)
+    return changes
+
+
+def load_stock(keys):
+    """
+    Availability and inventory for every (product_id, variant_id) in `keys`
+    that exists, in one query: {key: (is_available, inventory)}.
+    """
+    product_ids = {product_id for product_id, _ in keys}
+    variant_ids = {variant_id for _, variant_id in keys if variant_id}
+    products = Product.objects.filter(id__in=product_ids)
+    fields = ['id', 'is_available', 'inventory']
+    if variant_ids:
+        products = products.annotate(
+            line_variant=FilteredRelation('variants', condition=Q(variants__id__in=variant_ids))
+        )
+        fields += ['line_variant__id', 'line_variant__is_available', 'line_variant__inventory']
+    stock = {}
+    for row in products.values(*fields):
+        stock[(row['id'], None)] = (row['is_available'], row['inventory'])
+        if row.get('line_variant__id'):
+            stock[(row['id'], row['line_variant__id'])] = (
+                row['is_available'] and row['line_variant__is_available'], row['line_variant__inventory']
+            )
+    return stock
+
+
+def stock_error(key, quantity, stock):
+    """Why `quantity` of line `key` can't be in a cart, if it can't; messages match CartItemSerializer"""
+    if key not in stock:
+        return "This variant does not belong to the selected product." if key[1] else "Product not found."
+    is_available, inventory = stock[key]
+    if not is_available:
+        return "This product is not available."
+    if quantity > inventory:
+        return f"Only {inventory} items available in stock."
+    return None
+
+
+def check_stock(changes, quantities, stock):
+    """Raise a ValidationError naming the operation behind each line in `quantities` that can't be had"""
+    errors = {}
+    for key, quantity in quantities.items():
+        error = stock_error(key, quantity, stock)
+        if error:
+            errors[changes[key]['index']] = [error]
+    if errors:
+        raise serializers.ValidationError({'operations': errors})
+
+
+def apply_cart_batch(cart, operations):
+    """
+    Apply validated batch operations to a database cart in one transaction:
+    one DELETE for removed lines and one upsert each for added and set lines.
+    Stock is read in one query up front and checked against the quantities
+    the upserts return; a shortfall anywhere raises and rolls everything back.
+    Removed lines are never checked, so they go even if the product is gone.
+    """
+    changes = net_changes(operations)
+    removed = [key for key, change in changes.items() if change['quantity'] == 0 and not change['add']]
+    stock = load_stock(changes)
+    check_stock(changes, {key: 0 for key in changes if key not in removed}, stock)
+
+    added = {key: change['add'] for key, change in changes.items() if change['quantity'] is None}
+    replaced = {
+        key: change['quantity'] + change['add'] for key, change in changes.items()
+        if change['quantity'] is not None and key not in removed
+    }
+    with transaction.atomic():
+        if removed:
+            CartItem.objects.filter(cart=cart).filter(reduce(or_, (
+                Q(product_id=product_id, variant_id=variant_id) for product_id, variant_id in removed
+            ))).delete()
+        quantities = {**upsert_cart_items(cart, added), **upsert_cart_items(cart, replaced, add=False)}
+        check_stock(changes, quantities, stock)
+
+
+def apply_guest_cart_batch(guest_cart, operations):
+    """`apply_cart_batch()` for a guest cart; the caller saves it"""
+    changes = net_changes(operations)
+    stock = load_stock(changes)
+    if not guest_cart.apply(changes):
+        raise serializers.ValidationError({'operations': ["Cart is full."]})
+    quantities = guest_cart.quantities()
+    check_stock(changes, {key: quantities[key] for key in changes if key in quantities}, stock)
+
+
+def abandoned_carts(cutoff):
+    """Carts neither changed themselves nor had a line changed since `cutoff`"""
+    return Cart.objects.filter(updated_at__lt=cutoff).exclude(
+        Exists(CartItem.objects.filter(cart=OuterRef('pk'), updated_at__gte=cutoff))
+    )
+
+
+def sweep_abandoned_carts(days=None, batch_size=None):
+    """
+    Delete carts abandoned for `days` (ABANDONED_CART_DAYS), and their lines,
+    walking the table in primary key order `batch_size` (CART_SWEEP_BATCH_SIZE)
+    carts at a time. Each batch is its own short transaction and skips carts
+    another transaction has locked, e.g. one adding a line right now.
+    Returns {'carts': deleted, 'items': deleted}.
+    """
+    cutoff = timezone.now() - timedelta(days=days or settings.ABANDONED_CART_DAYS)
+    batch_size = batch_size or settings.CART_SWEEP_BATCH_SIZE
+    deleted = {'carts': 0, 'items': 0}
+    last_id = 0
+    while True:
+        ids = list(
+            abandoned_carts(cutoff).filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        last_id = ids[-1]
+        with transaction.atomic():
+            # Checked again under the lock, in case a cart was used since it was read
+            locked = list(
+                abandoned_carts(cutoff).filter(id__in=ids).select_for_update(skip_locked=True).values_list('id', flat=True)
+            )
+            deleted['items'] += CartItem.objects.filter(cart_id__in=locked).delete()[0]
+            deleted['carts'] += Cart.objects.filter(id__in=locked).delete()[0]
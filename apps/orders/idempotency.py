@@ -0,0 +1,91 @@
+"""
+``Idempotency-Key`` support for create endpoints.
+
+The first request with a key claims it by inserting an IdempotencyKey row in
+the transaction that does the work, and stores its response there once it
+succeeds. A retry with the same key (and the same body) gets that response
+back without redoing anything; one that arrives while the first is still
+running waits on the row's unique index and then replays it. Responses other
+than 2xx are not kept, so a corrected request can reuse the key.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.request_fingerprint != fingerprint:
+        return Response(
+            {"detail": "Idempotency-Key was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(record.response_body, status=record.response_status)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """Make a view's create method honour the Idempotency-Key header"""
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key is None:
+                return view_method(self, request, *args, **kwargs)
+            if not 0 < len(key) <= 255:
+                return Response(
+                    {"detail": "Idempotency-Key must be between 1 and 255 characters."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request)
+            lookup = {'user': request.user, 'scope': scope, 'key': key}
+            expires_after = timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+            # Plain retries are served by this one query
+            record = IdempotencyKey.objects.filter(**lookup).first()
+            if record is not None and record.created_at > timezone.now() - expires_after:
+                return replay(record, fingerprint)
+
+            with transaction.atomic():
+                if record is not None:
+                    record.delete()
+                try:
+                    # Blocks while another request holding this key is running
+                    with transaction.atomic():
+                        record = IdempotencyKey.objects.create(**lookup, request_fingerprint=fingerprint)
+                except IntegrityError:
+                    return replay(IdempotencyKey.objects.get(**lookup), fingerprint)
+
+                response = view_method(self, request, *args, **kwargs)
+                if status.is_success(response.status_code):
+                    record.response_status = response.status_code
+                    record.response_body = response.data
+                    record.save(update_fields=['response_status', 'response_body'])
+                else:
+                    record.delete()
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys():
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+from apps.orders.models import Order
+
+DEFAULT_GENERATORS = [
+    'apps.orders.numbering.RandomOrderNumberGenerator',
+    'apps.orders.numbering.TimeOrderedOrderNumberGenerator',
+]
+
+ORDER_FIELDS = {
+    'first_name': 'Bench',
+    'last_name': 'Mark',
+    'email': 'bench@example.com',
+    'phone': '0',
+    'address': '-',
+    'city': '-',
+    'state': '-',
+    'postal_code': '-',
+    'country': '-',
+    'subtotal': 0,
+    'total': 0,
+}
+
+INDEX_SIZE_SQL = """
+    SELECT COALESCE(SUM(pg_relation_size(i.indexrelid)), 0)
+    FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+    WHERE i.indrelid = %s::regclass AND a.attname = 'order_number'
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare order insert throughput, collisions and order_number index size "
+        "across order number generators. All inserts are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50000, help="Orders to insert per generator")
+        parser.add_argument('--batch-size', type=int, default=100, help="Orders per INSERT statement")
+        parser.add_argument('--generator', action='append', dest='generators', default=[],
+                            help="Dotted path of a generator class (may be repeated)")
+
+    def handle(self, *args, **options):
+        for path in options['generators'] or DEFAULT_GENERATORS:
+            generator = import_string(path)()
+            numbers = [generator() for _ in range(options['orders'])]
+            unique_numbers = list(dict.fromkeys(numbers))
+
+            with transaction.atomic():
+                size_before = self.index_size()
+                started = time.perf_counter()
+                for start in range(0, len(unique_numbers), options['batch_size']):
+                    batch = unique_numbers[start:start + options['batch_size']]
+                    Order.objects.bulk_create([Order(order_number=number, **ORDER_FIELDS) for number in batch])
+                elapsed = time.perf_counter() - started
+                index_growth = self.index_size() - size_before
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{path}: {len(unique_numbers)} inserts in {elapsed:.2f}s "
+                f"({len(unique_numbers) / elapsed:.0f}/s), "
+                f"{len(numbers) - len(unique_numbers)} collisions, "
+                f"order_number indexes grew {index_growth / 1024:.0f} KiB"
+            )
+
+    def index_size(self):
+        with connection.cursor() as cursor:
+            cursor.execute(INDEX_SIZE_SQL, [Order._meta.db_table])
+            return cursor.fetchone()[0]
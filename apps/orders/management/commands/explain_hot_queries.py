@@ -0,0 +1,86 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.orders.models import Cart, Order, Payment
+from apps.products.models import Product, ProductImage, ProductReview
+
+LOW_STOCK_THRESHOLD = 5
+
+
+def hot_queries():
+    """(name, queryset) for the queries behind the busiest endpoints, with representative parameters"""
+    week_ago = timezone.now() - timedelta(days=7)
+    return [
+        ('product list', Product.objects.order_by('-created_at', '-id')[:20]),
+        ('product list by price', Product.objects.order_by('price', 'id')[:20]),
+        ('product detail', Product.objects.filter(slug='example')),
+        ('primary images', ProductImage.objects.filter(product__in=[1, 2, 3], is_primary=True)),
+        ('review feed', ProductReview.objects.filter(product=1, is_approved=True).order_by('-created_at', '-id')[:10]),
+        ('low stock', Product.objects.filter(is_available=True, inventory__lte=LOW_STOCK_THRESHOLD)),
+        ('order history', Order.objects.filter(user=1).order_by('-created_at')[:20]),
+        ('admin order list', Order.objects.order_by('-created_at')[:20]),
+        ('orders in date range', Order.objects.filter(created_at__gte=week_ago)),
+        ('order paid check', Payment.objects.filter(order=1, status='completed')),
+        ('user cart', Cart.objects.filter(user=1)),
+        ('session cart', Cart.objects.filter(session_id='example')),
+    ]
+
+
+def seq_scans(plan):
+    """Names of the relations read by sequential scans anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found += seq_scans(child)
+    return found
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the queries behind the hot endpoints and flag sequential scans. "
+        "Sequential scans are disabled for the planner unless --planner-default is "
+        "given, so on a small database a remaining one means no index can serve the query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help="Run EXPLAIN ANALYZE (executes the queries)")
+        parser.add_argument('--planner-default', action='store_true',
+                            help="Keep enable_seqscan on, to see the plans the current data gets")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan in full")
+        parser.add_argument('--fail-on-seq-scan', action='store_true', help="Exit with an error if any query seq scans")
+
+    def handle(self, *args, **options):
+        flagged = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if not options['planner_default']:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                for name, queryset in hot_queries():
+                    sql, params = queryset.query.sql_with_params()
+                    prefix = "EXPLAIN (ANALYZE, FORMAT JSON)" if options['analyze'] else "EXPLAIN (FORMAT JSON)"
+                    cursor.execute(f"{prefix} {sql}", params)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    plan = plan[0]['Plan']
+
+                    tables = seq_scans(plan)
+                    summary = f"{name}: {plan['Node Type']}, cost {plan['Total Cost']}"
+                    if options['analyze']:
+                        summary += f", {plan['Actual Total Time']:.2f} ms"
+                    if tables:
+                        flagged.append(name)
+                        self.stdout.write(self.style.WARNING(f"{summary} - SEQ SCAN on {', '.join(tables)}"))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(summary))
+                    if options['verbose_plans']:
+                        self.stdout.write(json.dumps(plan, indent=2))
+            # Nothing here should persist, EXPLAIN ANALYZE included
+            transaction.set_rollback(True)
+
+        if flagged and options['fail_on_seq_scan']:
+            raise CommandError(f"Sequential scans in: {', '.join(flagged)}")
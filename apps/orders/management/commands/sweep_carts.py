@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.orders.carts import sweep_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete carts nobody has touched for a while, in small batches. Celery beat "
+        "runs the same sweep every six hours; use this for a one-off or a different age."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ABANDONED_CART_DAYS,
+            help=f"Delete carts untouched for this many days (default {settings.ABANDONED_CART_DAYS})"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.CART_SWEEP_BATCH_SIZE,
+            help=f"Carts deleted per transaction (default {settings.CART_SWEEP_BATCH_SIZE})"
+        )
+
+    def handle(self, *args, **options):
+        deleted = sweep_abandoned_carts(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted['carts']} carts and {deleted['items']} cart items untouched for {options['days']} days"
+        ))
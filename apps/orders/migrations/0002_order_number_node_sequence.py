@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0001_initial"),
+    ]
+
+    operations = [
+        # Hands out node ids to TimeOrderedOrderNumberGenerator, see
+        # apps/orders/numbering.py
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS orders_order_number_node_seq",
+            "DROP SEQUENCE IF EXISTS orders_order_number_node_seq",
+        ),
+    ]
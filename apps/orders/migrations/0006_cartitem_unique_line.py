@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:02
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Lines without a variant could be duplicated under the old constraint; fold them together"""
+    CartItem = apps.get_model("orders", "CartItem")
+    duplicates = (
+        CartItem.objects.filter(variant__isnull=True)
+        .values("cart", "product")
+        .annotate(lines=Count("id"), quantity=Sum("quantity"))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        items = CartItem.objects.filter(
+            cart=duplicate["cart"], product=duplicate["product"], variant__isnull=True
+        ).order_by("id")
+        keep = items.first()
+        items.exclude(pk=keep.pk).delete()
+        CartItem.objects.filter(pk=keep.pk).update(quantity=duplicate["quantity"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0005_payment_idempotency"),
+        ("products", "0006_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="cartitem",
+            unique_together=set(),
+        ),
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                fields=("cart", "product", "variant"),
+                name="cartitem_unique_line",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
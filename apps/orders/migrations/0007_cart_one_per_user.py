@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """Fold every user's extra carts into their oldest one, adding up quantities of shared lines"""
+    Cart = apps.get_model("orders", "Cart")
+    CartItem = apps.get_model("orders", "CartItem")
+    duplicated = (
+        Cart.objects.filter(user__isnull=False)
+        .values("user")
+        .annotate(carts=Count("id"))
+        .filter(carts__gt=1)
+    )
+    for row in duplicated:
+        keep, *duplicates = Cart.objects.filter(user=row["user"]).order_by("id")
+        lines = {
+            (item.product_id, item.variant_id): item
+            for item in CartItem.objects.filter(cart=keep)
+        }
+        for item in CartItem.objects.filter(cart__in=duplicates).order_by("id"):
+            line = lines.get((item.product_id, item.variant_id))
+            if line is None:
+                item.cart = keep
+                item.save(update_fields=["cart"])
+                lines[(item.product_id, item.variant_id)] = item
+            else:
+                line.quantity += item.quantity
+                line.save(update_fields=["quantity"])
+        Cart.objects.filter(id__in=[cart.id for cart in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+    # The merge commits on its own: Postgres won't add the constraint's index
+    # in a transaction with pending deferred foreign key checks
+    atomic = False
+
+    dependencies = [
+        ("orders", "0006_cartitem_unique_line"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_carts, migrations.RunPython.noop, atomic=True
+        ),
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("user__isnull", False)),
+                fields=("user",),
+                name="cart_one_per_user",
+            ),
+        ),
+    ]
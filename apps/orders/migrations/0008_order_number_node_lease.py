@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:26
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+# 2 ** TimeOrderedOrderNumberGenerator.NODE_BITS
+NODE_COUNT = 1024
+
+
+def create_nodes(apps, schema_editor):
+    """Every node id, free to lease"""
+    OrderNumberNode = apps.get_model("orders", "OrderNumberNode")
+    expired = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    OrderNumberNode.objects.bulk_create(
+        [
+            OrderNumberNode(node_id=node_id, expires_at=expired)
+            for node_id in range(NODE_COUNT)
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0007_cart_one_per_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderNumberNode",
+            fields=[
+                (
+                    "node_id",
+                    models.PositiveSmallIntegerField(primary_key=True, serialize=False),
+                ),
+                ("holder", models.UUIDField(blank=True, null=True)),
+                ("expires_at", models.DateTimeField()),
+            ],
+            options={
+                "ordering": ("node_id",),
+            },
+        ),
+        migrations.RunPython(create_nodes, migrations.RunPython.noop),
+        # Node ids are leased now instead of taken from a sequence
+        migrations.RunSQL(
+            "DROP SEQUENCE IF EXISTS orders_order_number_node_seq",
+            "CREATE SEQUENCE IF NOT EXISTS orders_order_number_node_seq",
+        ),
+    ]
@@ -1,7 +1,36 @@
 from django.db import models
+from django.db.models import Prefetch, prefetch_related_objects
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
-import uuid
+from apps.products.models import ProductImage, VariantAttributeValue
+from .numbering import generate_order_number
+
+
+def cart_items_prefetch():
+    """
+    Everything a cart response touches: items with their product and
+    variant, each product's primary image and each variant's attributes.
+    """
+    return Prefetch(
+        'items',
+        queryset=CartItem.objects.select_related('product', 'variant__product').prefetch_related(
+            Prefetch(
+                'product__images',
+                queryset=ProductImage.objects.filter(is_primary=True),
+                to_attr='primary_images'
+            ),
+            Prefetch(
+                'variant__attribute_values',
+                queryset=VariantAttributeValue.objects.select_related('attribute_value__attribute')
+            ),
+        ).order_by('created_at', 'id')
+    )
+
+
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        return self.prefetch_related(cart_items_prefetch())
 
 
 class Cart(models.Model):
@@ -16,9 +45,28 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Guest carts are looked up by session; most carts belong to a user
+            models.Index(fields=['session_id'], condition=models.Q(session_id__isnull=False), name='cart_session_idx'),
+        ]
+        constraints = [
+            # A user's cart is created on first use (see carts.get_user_cart);
+            # this is what keeps concurrent first requests from creating two
+            models.UniqueConstraint(fields=['user'], condition=models.Q(user__isnull=False), name='cart_one_per_user'),
+        ]
+
     def __str__(self):
         return f"Cart {self.id} - {'User: ' + self.user.email if self.user else 'Session: ' + self.session_id}"
 
+    def load_items(self):
+        """(Re)load the cart's items and everything needed to render them"""
+        getattr(self, '_prefetched_objects_cache', {}).pop('items', None)
+        prefetch_related_objects([self], cart_items_prefetch())
+        return self
+
     @property
     def total_price(self):
         return sum(item.total_price for item in self.items.all())
@@ -37,7 +85,13 @@ class CartItem(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ('cart', 'product', 'variant')
+        constraints = [
+            # NULLS NOT DISTINCT: a product without a variant is one line too,
+            # which also makes this the conflict target for cart upserts
+            models.UniqueConstraint(
+                fields=['cart', 'product', 'variant'], name='cartitem_unique_line', nulls_distinct=False
+            ),
+        ]
 
     def __str__(self):
         product_name = self.product.name
@@ -47,8 +101,9 @@ class CartItem(models.Model):
 
     @property
     def unit_price(self):
+        # Same as variant.price, without going through variant.product
         if self.variant:
-            return self.variant.price
+            return self.product.price + self.variant.price_adjustment
         return self.product.price
 
     @property
@@ -90,14 +145,20 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A customer's order history, newest first
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # The admin-wide list and date-range reporting
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            # Generate a unique order number
-            self.order_number = str(uuid.uuid4()).split('-')[0].upper()
+            # Generate a unique order number, see ORDER_NUMBER_GENERATOR
+            self.order_number = generate_order_number()
         super().save(*args, **kwargs)
 
 
@@ -143,5 +204,84 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # "Has this order been paid?" checks
+            models.Index(fields=['order', 'status'], name='payment_order_status_idx'),
+        ]
+        constraints = [
+            # Concurrent submissions can both pass the "already paid?" check;
+            # the database lets only one of them complete
+            models.UniqueConstraint(
+                fields=['order'], condition=models.Q(status='completed'), name='payment_one_completed_per_order'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Payment {self.id} for Order {self.order.order_number}"
+
+
+class OutboxEvent(models.Model):
+    """
+    An order or payment domain event, written in the same transaction as the
+    change it describes and published afterwards by the outbox relay (see
+    outbox.py). Delivery is at least once, so consumers deduplicate on `id`.
+    """
+    event_type = models.CharField(max_length=50)
+    aggregate_type = models.CharField(max_length=50)
+    aggregate_id = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            # The relay's queue: unpublished events in insertion order
+            models.Index(fields=['id'], condition=models.Q(published_at__isnull=True), name='outbox_unpublished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The outcome of a create request sent with an ``Idempotency-Key`` header,
+    replayed when the client retries with the same key (see idempotency.py).
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    # Empty only while the first request is still running, which no other
+    # transaction can observe
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+
+class OrderNumberNode(models.Model):
+    """
+    One of the node ids TimeOrderedOrderNumberGenerator packs into order
+    numbers, leased to a single process until `expires_at` (see numbering.py).
+    """
+    node_id = models.PositiveSmallIntegerField(primary_key=True)
+    holder = models.UUIDField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ('node_id',)
+
     def __str__(self):
-        return f"Payment {self.id} for Order {self.order.order_number}"
\ No newline at end of file
+        return f"Node {self.node_id}"
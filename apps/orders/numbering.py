@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+CROCKFORD_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+class RandomOrderNumberGenerator:
+    """
+    The original scheme: the first 8 hex characters of a uuid4. Collisions
+    become likely after ~65k orders and inserts land all over the index.
+    Kept for comparison in the benchmark_order_numbers command.
+    """
+
+    def __call__(self):
+        return str(uuid.uuid4()).split('-')[0].upper()
+
+
+class NodeIdsExhausted(RuntimeError):
+    pass
+
+
+@contextmanager
+def _lease_cursor():
+    """
+    A cursor on a short-lived connection of its own, so lease changes commit
+    at once, whatever transaction the caller is in
+    """
+    lease_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        with lease_connection.cursor() as cursor:
+            yield cursor
+    finally:
+        lease_connection.close()
+
+
+class TimeOrderedOrderNumberGenerator:
+    """
+    Snowflake-style order numbers: milliseconds since EPOCH_MS, a node id and a
+    per-node sequence packed into 63 bits and written as 13 Crockford base32
+    characters (e.g. ``0N8Z6KQ4M1A2B``).
+
+    Numbers are unique without retries as long as no two live processes share
+    a node id. Node ids come from ORDER_NUMBER_NODE_ID, or are otherwise
+    leased from the OrderNumberNode table for ORDER_NUMBER_NODE_LEASE seconds.
+    The lease is renewed once half of it has passed, before the next number
+    is made; a process that finds its lease taken over (say after being
+    suspended) leases another node id rather than share one. With 1024 node
+    ids, at most 1024 processes can make order numbers at once; the next one
+    raises NodeIdsExhausted. Because the timestamp comes first and the width
+    is fixed, new numbers sort after existing ones and inserts go to the
+    right-hand edge of the unique index.
+    """
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+    WIDTH = 13
+
+    def __init__(self, node_id=None):
+        self._configured_node_id = node_id
+        self._lock = threading.Lock()
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Forked workers (e.g. gunicorn --preload) must claim their own node id
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._node_id = self._configured_node_id
+        self._lease_holder = None
+        self._renew_at = None
+        self._last_ms = -1
+        self._sequence = 0
+
+    @property
+    def node_id(self):
+        if self._node_id is None:
+            if settings.ORDER_NUMBER_NODE_ID is not None:
+                self._node_id = int(settings.ORDER_NUMBER_NODE_ID) % (1 << self.NODE_BITS)
+            else:
+                self._node_id = self._lease_node_id()
+        elif self._renew_at is not None and time.monotonic() >= self._renew_at:
+            self._node_id = self._renew_lease()
+        return self._node_id
+
+    def _lease_table(self):
+        from .models import OrderNumberNode
+
+        return connections[DEFAULT_DB_ALIAS].ops.quote_name(OrderNumberNode._meta.db_table)
+
+    def _leased(self):
+        self._renew_at = time.monotonic() + settings.ORDER_NUMBER_NODE_LEASE / 2
+
+    def _lease_node_id(self):
+        """Lease the node id whose last lease expired longest ago"""
+        table = self._lease_table()
+        holder = uuid.uuid4()
+        with _lease_cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET holder = %s, expires_at = now() + make_interval(secs => %s) "
+                f"WHERE node_id = (SELECT node_id FROM {table} WHERE expires_at < now() "
+                f"ORDER BY expires_at LIMIT 1 FOR UPDATE SKIP LOCKED) "
+                f"RETURNING node_id",
+                [holder, settings.ORDER_NUMBER_NODE_LEASE]
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise NodeIdsExhausted(
+                f"All {1 << self.NODE_BITS} order number node ids are leased; "
+                "set ORDER_NUMBER_NODE_ID or shorten ORDER_NUMBER_NODE_LEASE."
+            )
+        self._lease_holder = holder
+        self._leased()
+        return row[0]
+
+    def _renew_lease(self):
+        table = self._lease_table()
+        with _lease_cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET expires_at = now() + make_interval(secs => %s) "
+                f"WHERE node_id = %s AND holder = %s",
+                [settings.ORDER_NUMBER_NODE_LEASE, self._node_id, self._lease_holder]
+            )
+            renewed = cursor.rowcount == 1
+        if not renewed:
+            # Expired and leased by another process in the meantime
+            return self._lease_node_id()
+        self._leased()
+        return self._node_id
+
+    def __call__(self):
+        with self._lock:
+            node_id = self.node_id
+            now = int(time.time() * 1000)
+            # Never go backwards, even if the wall clock does
+            now = max(now, self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond: borrow the next one
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            sequence = self._sequence
+
+        value = (
+            (now - self.EPOCH_MS) << (self.NODE_BITS + self.SEQUENCE_BITS)
+            | node_id << self.SEQUENCE_BITS
+            | sequence
+        )
+        return encode_base32(value, self.WIDTH)
+
+
+def encode_base32(value, width):
+    characters = []
+    for _ in range(width):
+        value, remainder = divmod(value, 32)
+        characters.append(CROCKFORD_ALPHABET[remainder])
+    return ''.join(reversed(characters))
+
+
+@lru_cache(maxsize=None)
+def get_order_number_generator():
+    return import_string(settings.ORDER_NUMBER_GENERATOR)()
+
+
+def generate_order_number():
+    return get_order_number_generator()()
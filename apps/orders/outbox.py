@@ -0,0 +1,109 @@
+"""
+Transactional outbox for order and payment domain events.
+
+`record_event()` inserts an OutboxEvent in whatever transaction the state
+change is part of, so an event exists if and only if its change committed.
+`relay_batch()` later claims unpublished events with
+``SELECT ... FOR UPDATE SKIP LOCKED`` (so several relays can run at once),
+hands them to the OUTBOX_PUBLISHER and marks them published in the same
+transaction. A crash between publishing and commit publishes the batch
+again, hence at-least-once delivery.
+"""
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OutboxEvent
+
+KICK_KEY = 'orders:outbox:kick'
+
+
+def record_event(event_type, instance, payload):
+    """Record `event_type` for `instance` (an Order or Payment) in the current transaction"""
+    event = OutboxEvent.objects.create(
+        event_type=event_type,
+        aggregate_type=instance._meta.model_name,
+        aggregate_id=str(instance.pk),
+        payload=payload,
+    )
+    transaction.on_commit(kick_relay, robust=True)
+    return event
+
+
+def kick_relay():
+    """Ask a worker to relay soon; several commits in quick succession share one kick"""
+    from .tasks import relay_outbox
+
+    if cache.add(KICK_KEY, 1, timeout=1):
+        relay_outbox.delay()
+
+
+def get_publisher():
+    return import_string(settings.OUTBOX_PUBLISHER)()
+
+
+def relay_batch(publisher=None, batch_size=None):
+    """Publish the oldest unpublished events not claimed by another relay. Returns how many were published."""
+    publisher = publisher or get_publisher()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.filter(published_at__isnull=True).order_by('id').select_for_update(
+                skip_locked=True
+            )[:batch_size or settings.OUTBOX_BATCH_SIZE]
+        )
+        if not events:
+            return 0
+        ids = [event.id for event in events]
+        try:
+            publisher.publish(events)
+        except Exception as exc:
+            # Recorded in this transaction, so re-raised only after it commits
+            error = exc
+            OutboxEvent.objects.filter(id__in=ids).update(attempts=F('attempts') + 1, last_error=repr(exc))
+        else:
+            error = None
+            OutboxEvent.objects.filter(id__in=ids).update(published_at=timezone.now(), attempts=F('attempts') + 1)
+    if error is not None:
+        raise error
+    return len(events)
+
+
+def purge_published(older_than=None):
+    """Delete events published more than OUTBOX_RETENTION_DAYS ago"""
+    cutoff = timezone.now() - (older_than or timedelta(days=settings.OUTBOX_RETENTION_DAYS))
+    deleted, _ = OutboxEvent.objects.filter(published_at__lt=cutoff).delete()
+    return deleted
+
+
+def event_message(event):
+    return {
+        'id': event.id,
+        'type': event.event_type,
+        'aggregate_type': event.aggregate_type,
+        'aggregate_id': event.aggregate_id,
+        'created_at': event.created_at.isoformat(),
+        'payload': event.payload,
+    }
+
+
+class RedisStreamPublisher:
+    """Append events to the OUTBOX_STREAM Redis stream, trimmed to roughly OUTBOX_STREAM_MAXLEN entries"""
+
+    def publish(self, events):
+        from django_redis import get_redis_connection
+
+        pipeline = get_redis_connection('default').pipeline(transaction=False)
+        for event in events:
+            pipeline.xadd(
+                settings.OUTBOX_STREAM,
+                {'event': json.dumps(event_message(event), cls=DjangoJSONEncoder)},
+                maxlen=settings.OUTBOX_STREAM_MAXLEN,
+                approximate=True,
+            )
+        pipeline.execute()
@@ -1,11 +1,14 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from .models import Cart, CartItem, Order, OrderItem, Payment
+from apps.products.cache import bump_catalog_version
 from apps.products.models import Product, ProductVariant
-from apps.products.serializers import ProductSerializer, ProductVariantSerializer
+from apps.products.serializers import ProductSummarySerializer, ProductVariantSerializer
 
 
 class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    product = ProductSummarySerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(),
         source='product',
@@ -32,7 +35,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         quantity = data.get('quantity', 1)
 
         # Check if variant belongs to product
-        if variant and variant.product.id != product.id:
+        if variant and variant.product_id != product.id:
             raise serializers.ValidationError("This variant does not belong to the selected product.")
 
         # Check if product or variant is available
@@ -50,7 +53,28 @@ class CartItemSerializer(serializers.ModelSerializer):
         return data
 
 
+class CartBatchOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    variant_id = serializers.IntegerField(required=False, allow_null=True, default=None)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, data):
+        if data['op'] == 'add' and data['quantity'] < 1:
+            raise serializers.ValidationError("Quantity must be at least 1.")
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """Cart changes applied together by `CartViewSet.batch`, in order"""
+    operations = CartBatchOperationSerializer(many=True, allow_empty=False, max_length=settings.CART_BATCH_MAX_OPERATIONS)
+
+
 class CartSerializer(serializers.ModelSerializer):
+    """
+    Expects a cart loaded with `Cart.load_items()` / `Cart.objects.with_items()`
+    so the items and the totals are all served from the same prefetched rows.
+    """
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
@@ -82,13 +106,14 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'order_number', 'status', 'user', 'subtotal', 'total', 'created_at']
 
     def create(self, validated_data):
-        # Get cart from context
+        # Get cart from context and read its lines exactly once
         cart = self.context.get('cart')
-        if not cart or not cart.items.exists():
+        cart_items = list(cart.items.select_related('product', 'variant')) if cart else []
+        if not cart_items:
             raise serializers.ValidationError("Cannot create order from empty cart.")
 
         # Calculate totals
-        validated_data['subtotal'] = cart.total_price
+        validated_data['subtotal'] = sum(item.total_price for item in cart_items)
         validated_data['total'] = validated_data['subtotal'] + validated_data.get('shipping_price',
                                                                                   0) + validated_data.get('tax', 0)
 
@@ -97,32 +122,88 @@ class OrderSerializer(serializers.ModelSerializer):
         if user.is_authenticated:
             validated_data['user'] = user
 
-        # Create order
-        order = Order.objects.create(**validated_data)
-
-        # Create order items from cart items
-        for cart_item in cart.items.all():
-            product = cart_item.product
-            variant = cart_item.variant
-
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                product_name=product.name,
-                variant=variant,
-                variant_name=variant.name if variant else '',
-                sku=variant.sku if variant else product.sku,
-                unit_price=cart_item.unit_price,
-                quantity=cart_item.quantity,
-                total_price=cart_item.total_price
-            )
-
-        # Clear the cart
-        cart.items.all().delete()
+        with transaction.atomic():
+            # Create order
+            order = Order.objects.create(**validated_data)
+
+            reserve_inventory(cart_items)
+
+            # Create order items from cart items in one INSERT; OrderItem.save()
+            # is bypassed, so total_price is filled in here
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=cart_item.product,
+                    product_name=cart_item.product.name,
+                    variant=cart_item.variant,
+                    variant_name=cart_item.variant.name if cart_item.variant else '',
+                    sku=cart_item.variant.sku if cart_item.variant else cart_item.product.sku,
+                    unit_price=cart_item.unit_price,
+                    quantity=cart_item.quantity,
+                    total_price=cart_item.total_price
+                )
+                for cart_item in cart_items
+            ])
+
+            # Clear the cart
+            CartItem.objects.filter(cart=cart).delete()
 
         return order
 
 
+def reserve_inventory(cart_items):
+    """
+    Take every cart line out of stock with one locking read and one UPDATE
+    per table. Rows are locked in primary key order so concurrent checkouts
+    queue up behind each other instead of deadlocking or overselling, and a
+    shortfall on any line fails the whole checkout.
+    """
+    product_ids = {item.product_id for item in cart_items}
+    variant_ids = {item.variant_id for item in cart_items if item.variant_id}
+
+    products = {
+        product.id: product
+        for product in Product.objects.filter(id__in=product_ids).order_by('id').select_for_update().only(
+            'id', 'name', 'inventory', 'is_available'
+        )
+    }
+    variants = {}
+    if variant_ids:
+        variants = {
+            variant.id: variant
+            for variant in ProductVariant.objects.filter(id__in=variant_ids).order_by('id').select_for_update().only(
+                'id', 'inventory'
+            )
+        }
+
+    # Plain product lines must be covered by product stock. Variant lines must be
+    # covered by variant stock and also come off the product count when it can
+    # cover them; they are applied last so they never starve a plain line.
+    for cart_item in sorted(cart_items, key=lambda item: item.variant_id is not None):
+        product = products[cart_item.product_id]
+        stock = variants[cart_item.variant_id] if cart_item.variant_id else product
+        if stock.inventory < cart_item.quantity:
+            raise serializers.ValidationError(
+                f"Only {stock.inventory} of {product.name} available in stock."
+            )
+        stock.inventory -= cart_item.quantity
+        if cart_item.variant_id and product.inventory >= cart_item.quantity:
+            product.inventory -= cart_item.quantity
+
+    sold_out = False
+    for product in products.values():
+        # Products whose stock just ran out stop being sold
+        if product.inventory == 0 and product.is_available:
+            product.is_available = False
+            sold_out = True
+    if sold_out:
+        # Other stock changes are left to the catalog cache timeout
+        transaction.on_commit(bump_catalog_version)
+    Product.objects.bulk_update(products.values(), ['inventory', 'is_available'])
+    if variants:
+        ProductVariant.objects.bulk_update(variants.values(), ['inventory'])
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
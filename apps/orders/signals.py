@@ -1,33 +1,62 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
-from .models import OrderItem, Order, Payment
-from apps.products.models import Product, ProductVariant
+from .models import Order, Payment
+from .outbox import record_event
+from .tasks import queue_order_confirmation, queue_status_notification
 
+# Columns of the saved row remembered before each save, as `instance._previous`
+# (None for new rows), for the post_save handlers here and in apps.reports
+ORDER_SNAPSHOT_FIELDS = ('created_at', 'total', 'status')
+PAYMENT_SNAPSHOT_FIELDS = ('created_at', 'amount', 'status')
 
-@receiver(post_save, sender=OrderItem)
-def update_inventory(sender, instance, created, **kwargs):
-    """
-    Update product or variant inventory when an order item is created
-    """
+
+def remember_previous(instance, fields):
+    instance._previous = None
+    if instance.pk:
+        instance._previous = type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+    instance._previous_status = instance._previous['status'] if instance._previous else None
+
+
+def order_payload(order, previous_status=None):
+    payload = {
+        'order_number': order.order_number,
+        'user_id': order.user_id,
+        'status': order.status,
+        'total': order.total,
+    }
+    if previous_status is not None:
+        payload['previous_status'] = previous_status
+    return payload
+
+
+def payment_payload(payment, previous_status=None):
+    payload = {
+        'order_id': payment.order_id,
+        'payment_method': payment.payment_method,
+        'amount': payment.amount,
+        'status': payment.status,
+    }
+    if previous_status is not None:
+        payload['previous_status'] = previous_status
+    return payload
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_status(sender, instance, **kwargs):
+    remember_previous(instance, PAYMENT_SNAPSHOT_FIELDS)
+
+
+# Connected before update_order_status so a payment's event precedes the
+# order status change it causes
+@receiver(post_save, sender=Payment)
+def record_payment_event(sender, instance, created, **kwargs):
+    """Write payment.created / payment.status_changed to the outbox, in the saving transaction"""
+    previous_status = getattr(instance, '_previous_status', instance.status)
     if created:
-        if instance.variant:
-            # Update variant inventory
-            variant = instance.variant
-            if variant.inventory >= instance.quantity:
-                variant.inventory -= instance.quantity
-                variant.save(update_fields=['inventory'])
-
-                # Also update product inventory if needed
-                product = variant.product
-                if product.inventory >= instance.quantity:
-                    product.inventory -= instance.quantity
-                    product.save(update_fields=['inventory'])
-        else:
-            # Update product inventory
-            product = instance.product
-            if product and product.inventory >= instance.quantity:
-                product.inventory -= instance.quantity
-                product.save(update_fields=['inventory'])
+        record_event('payment.created', instance, payment_payload(instance))
+    elif previous_status is not None and instance.status != previous_status:
+        record_event('payment.status_changed', instance, payment_payload(instance, previous_status))
 
 
 @receiver(post_save, sender=Payment)
@@ -42,17 +71,31 @@ def update_order_status(sender, instance, created, **kwargs):
             order.save(update_fields=['status'])
 
 
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    remember_previous(instance, ORDER_SNAPSHOT_FIELDS)
+
+
+@receiver(post_save, sender=Order)
+def record_order_event(sender, instance, created, **kwargs):
+    """Write order.created / order.status_changed to the outbox, in the saving transaction"""
+    previous_status = getattr(instance, '_previous_status', instance.status)
+    if created:
+        record_event('order.created', instance, order_payload(instance))
+    elif previous_status is not None and instance.status != previous_status:
+        record_event('order.status_changed', instance, order_payload(instance, previous_status))
+
+
 @receiver(post_save, sender=Order)
 def send_order_notifications(sender, instance, created, **kwargs):
     """
-    Send notifications when an order is created or its status changes
-    This would connect to an email service or notification system
+    Notify the customer when an order is created or its status changes.
+    Only enqueues, after commit; the emails are sent by Celery (see tasks.py).
     """
+    # Lambdas rather than partials: a robust callback that raises is logged by
+    # its __qualname__, which partial objects don't have
+    order_id = instance.pk
     if created:
-        # Send order confirmation to customer
-        # This is a placeholder for actual email sending logic
-        print(f"New order {instance.order_number} created for {instance.email}")
-    else:
-        # Send order status update to customer
-        # This is a placeholder for actual email sending logic
-        print(f"Order {instance.order_number} status updated to {instance.status}")
\ No newline at end of file
+        transaction.on_commit(lambda: queue_order_confirmation(order_id), robust=True)
+    elif instance.status != getattr(instance, '_previous_status', instance.status):
+        transaction.on_commit(lambda: queue_status_notification(order_id), robust=True)
@@ -0,0 +1,123 @@
+"""
+Order notifications, sent by Celery workers so that checkout and status
+updates never wait on the mail server.
+
+Signals only enqueue, and only once the transaction has committed (see
+`orders.signals`). Status changes are coalesced: the first change schedules
+a message ORDER_NOTIFICATION_COALESCE_SECONDS ahead, later changes within
+that window just ride along, and the message reports the status the order
+has when it is sent.
+
+The outbox relay (see `orders.outbox`) and the periodic clean-up jobs run
+here too.
+"""
+from smtplib import SMTPException
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import send_mail
+from . import carts
+from .idempotency import purge_expired_keys
+from .models import Order
+from .outbox import purge_published, relay_batch
+
+RETRY_OPTIONS = {
+    'autoretry_for': (SMTPException, OSError),
+    'retry_backoff': 30,
+    'retry_backoff_max': 30 * 60,
+    'retry_jitter': True,
+    'max_retries': 8,
+}
+
+# How long the last notified status of an order is remembered
+NOTIFIED_STATUS_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def _pending_key(order_id):
+    return f"orders:notification:pending:{order_id}"
+
+
+def _notified_status_key(order_id):
+    return f"orders:notification:status:{order_id}"
+
+
+def queue_order_confirmation(order_id):
+    send_order_confirmation.delay(order_id)
+
+
+def queue_status_notification(order_id):
+    """Schedule a status notification unless one is already scheduled for this order"""
+    delay = settings.ORDER_NOTIFICATION_COALESCE_SECONDS
+    # The flag outlives the countdown a little in case the worker is busy
+    if cache.add(_pending_key(order_id), 1, timeout=delay * 2 + 60):
+        try:
+            send_order_status_notification.apply_async((order_id,), countdown=delay)
+        except Exception:
+            # Nothing is scheduled (e.g. the broker is down), so the next change must try again
+            cache.delete(_pending_key(order_id))
+            raise
+
+
+@shared_task(**RETRY_OPTIONS)
+def send_order_confirmation(order_id):
+    order = Order.objects.filter(pk=order_id).first()
+    if order is None:
+        return
+    send_mail(
+        f"Order {order.order_number} confirmed",
+        f"Hi {order.first_name},\n\nThanks for your order {order.order_number} "
+        f"totalling {order.total}. We'll let you know when it ships.",
+        settings.DEFAULT_FROM_EMAIL,
+        [order.email],
+    )
+    cache.set(_notified_status_key(order_id), order.status, timeout=NOTIFIED_STATUS_TIMEOUT)
+
+
+@shared_task(**RETRY_OPTIONS)
+def send_order_status_notification(order_id):
+    # Changes made from here on schedule a new message
+    cache.delete(_pending_key(order_id))
+    order = Order.objects.filter(pk=order_id).first()
+    if order is None or cache.get(_notified_status_key(order_id)) == order.status:
+        # e.g. pending -> processing -> pending within the window
+        return
+    send_mail(
+        f"Order {order.order_number} is now {order.get_status_display().lower()}",
+        f"Hi {order.first_name},\n\nYour order {order.order_number} is now "
+        f"{order.get_status_display().lower()}."
+        + (f"\nTracking number: {order.tracking_number}" if order.tracking_number else ""),
+        settings.DEFAULT_FROM_EMAIL,
+        [order.email],
+    )
+    cache.set(_notified_status_key(order_id), order.status, timeout=NOTIFIED_STATUS_TIMEOUT)
+
+
+@shared_task
+def relay_outbox():
+    """
+    Publish outbox events until none are left. Triggered after every commit
+    that records events and every OUTBOX_RELAY_INTERVAL seconds by beat;
+    a failed batch stays in the outbox for the next run.
+    """
+    published = 0
+    while True:
+        count = relay_batch()
+        published += count
+        if count < settings.OUTBOX_BATCH_SIZE:
+            return published
+
+
+@shared_task
+def purge_outbox():
+    return purge_published()
+
+
+@shared_task
+def purge_idempotency_keys():
+    return purge_expired_keys()
+
+
+@shared_task
+def sweep_abandoned_carts():
+    return carts.sweep_abandoned_carts()
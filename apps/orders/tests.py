@@ -1,3 +1,878 @@
-from django.test import TestCase
+import threading
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
 
-# Create your tests here.
+from apps.products.models import Category, Product, ProductImage, ProductVariant
+from .carts import merge_guest_cart, sweep_abandoned_carts
+from .models import Cart, CartItem, IdempotencyKey, Order, OrderItem, OutboxEvent, Payment
+from .numbering import NodeIdsExhausted, TimeOrderedOrderNumberGenerator, _lease_cursor, generate_order_number
+from .outbox import relay_batch
+from .tasks import relay_outbox, send_order_confirmation, send_order_status_notification
+
+User = get_user_model()
+
+
+def create_product(index, price=10, inventory=100, variants=0):
+    product = Product.objects.create(
+        name=f"Product {index}",
+        sku=f"SKU-{index}",
+        description="Description",
+        price=price,
+        inventory=inventory,
+    )
+    ProductImage.objects.create(product=product, image=f"products/{index}.jpg", is_primary=True)
+    ProductImage.objects.create(product=product, image=f"products/{index}-b.jpg")
+    for variant_index in range(variants):
+        ProductVariant.objects.create(
+            product=product,
+            name=f"Variant {variant_index}",
+            sku=f"SKU-{index}-{variant_index}",
+            price_adjustment=variant_index,
+            inventory=inventory,
+        )
+    return product
+
+
+class CartReadPathTests(APITestCase):
+    CART_QUERIES = 4  # cart, items + products + variants, primary images, variant attributes
+
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(name="Misc")
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill_cart(self, start, stop):
+        for index in range(start, stop):
+            product = create_product(index, variants=1)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+            CartItem.objects.create(cart=self.cart, product=product, variant=product.variants.get(), quantity=1)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/v1/orders/cart/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_cart_query_count_is_constant(self):
+        self.fill_cart(0, 2)
+        small, _ = self.count_queries()
+        self.fill_cart(2, 12)
+        large, response = self.count_queries()
+
+        self.assertEqual(len(response.data['items']), 24)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.CART_QUERIES)
+
+    def test_cart_totals_and_item_representation(self):
+        self.fill_cart(0, 2)
+        _, response = self.count_queries()
+
+        # Each product: 2 x 10.00 plain + 1 x (10.00 + 0) variant
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('60.00'))
+        self.assertEqual(response.data['total_items'], 6)
+        product = response.data['items'][0]['product']
+        self.assertNotIn('images', product)
+        self.assertTrue(product['primary_image']['is_primary'])
+
+
+CHECKOUT_DATA = {
+    'first_name': 'Jane',
+    'last_name': 'Doe',
+    'email': 'jane@example.com',
+    'phone': '555-0100',
+    'address': '1 Main St',
+    'city': 'Springfield',
+    'state': 'IL',
+    'postal_code': '62701',
+    'country': 'US',
+}
+
+
+class CheckoutInventoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def checkout(self):
+        return self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json')
+
+    def test_checkout_reserves_stock(self):
+        product = create_product(1, inventory=5, variants=1)
+        variant = product.variants.get()
+        CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=product, variant=variant, quantity=3)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 201)
+        product.refresh_from_db()
+        variant.refresh_from_db()
+        self.assertEqual(variant.inventory, 2)
+        self.assertEqual(product.inventory, 0)
+        self.assertFalse(product.is_available)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_shortfall_fails_cleanly(self):
+        plenty = create_product(1, inventory=10)
+        scarce = create_product(2, inventory=1)
+        CartItem.objects.create(cart=self.cart, product=plenty, quantity=3)
+        CartItem.objects.create(cart=self.cart, product=scarce, quantity=2)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.inventory, 10)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_checkout_query_count_is_constant(self):
+        def checkout_queries(lines):
+            for index in range(lines):
+                product = create_product(f"{lines}-{index}", variants=1)
+                CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+                CartItem.objects.create(cart=self.cart, product=product, variant=product.variants.get(), quantity=1)
+            with CaptureQueriesContext(connection) as context:
+                response = self.checkout()
+            self.assertEqual(response.status_code, 201)
+            return len(context.captured_queries)
+
+        generate_order_number()  # the process claims its node id once, up front
+        small = checkout_queries(2)
+        large = checkout_queries(25)
+
+        self.assertEqual(small, large)
+        self.assertEqual(OrderItem.objects.count(), 54)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """Many buyers racing for the same SKU must never oversell it."""
+    BUYERS = 20
+    STOCK = 7
+
+    def setUp(self):
+        cache.clear()
+        self.product = create_product(1, inventory=self.STOCK)
+        self.users = []
+        for index in range(self.BUYERS):
+            user = User.objects.create_user(email=f"racer{index}@example.com", username=f"racer{index}")
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.users.append(user)
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        barrier = threading.Barrier(self.BUYERS)
+        statuses = []
+
+        def buy(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                statuses.append(client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        self.assertEqual(statuses.count(201), self.STOCK)
+        self.assertEqual(statuses.count(400), self.BUYERS - self.STOCK)
+        self.assertEqual(self.product.inventory, 0)
+        self.assertEqual(OrderItem.objects.filter(product=self.product).count(), self.STOCK)
+
+
+class OrderNumberTests(APITestCase):
+    def test_numbers_are_unique_fixed_width_and_ordered(self):
+        generator = TimeOrderedOrderNumberGenerator(node_id=7)
+        numbers = [generator() for _ in range(20000)]
+
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertEqual({len(number) for number in numbers}, {13})
+
+    def test_unique_across_threads(self):
+        generator = TimeOrderedOrderNumberGenerator(node_id=1)
+        numbers = []
+
+        def generate():
+            numbers.extend(generator() for _ in range(2000))
+
+        threads = [threading.Thread(target=generate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(numbers)), 16000)
+
+    def test_node_ids_are_leased(self):
+        first = TimeOrderedOrderNumberGenerator()
+        second = TimeOrderedOrderNumberGenerator()
+
+        self.assertNotEqual(first.node_id, second.node_id)
+
+    def test_lease_taken_over_leases_another_node_id(self):
+        generator = TimeOrderedOrderNumberGenerator()
+        node_id = generator.node_id
+        with _lease_cursor() as cursor:
+            cursor.execute(
+                "UPDATE orders_ordernumbernode SET holder = %s WHERE node_id = %s", [uuid.uuid4(), node_id]
+            )
+        generator._renew_at = 0
+
+        generator()
+        self.assertNotEqual(generator.node_id, node_id)
+
+    def test_fails_when_every_node_id_is_leased(self):
+        with _lease_cursor() as cursor:
+            cursor.execute("SELECT node_id, holder, expires_at FROM orders_ordernumbernode")
+            leases = cursor.fetchall()
+            cursor.execute("UPDATE orders_ordernumbernode SET expires_at = now() + interval '1 hour'")
+
+        def restore():
+            with _lease_cursor() as cursor:
+                cursor.executemany(
+                    "UPDATE orders_ordernumbernode SET holder = %s, expires_at = %s WHERE node_id = %s",
+                    [(holder, expires_at, node_id) for node_id, holder, expires_at in leases]
+                )
+        self.addCleanup(restore)
+
+        with self.assertRaises(NodeIdsExhausted):
+            TimeOrderedOrderNumberGenerator()()
+
+    def test_order_gets_number(self):
+        order = Order.objects.create(subtotal=0, total=0, **CHECKOUT_DATA)
+        self.assertEqual(len(order.order_number), 13)
+
+
+class OrderListPaginationTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(email="admin@example.com", username="admin", is_admin=True)
+        self.client.force_authenticate(self.admin)
+        Order.objects.bulk_create([
+            Order(order_number=generate_order_number(), subtotal=index, total=index, **CHECKOUT_DATA)
+            for index in range(45)
+        ])
+        # Identical timestamps leave the ordering entirely to the tiebreaker
+        Order.objects.update(created_at=Order.objects.first().created_at)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            for query in context.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'].upper())
+                self.assertNotIn('OFFSET', query['sql'].upper())
+            ids += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_keyset_pages_cover_every_order_once(self):
+        ids = self.walk('/api/v1/orders/orders/?pagination=keyset')
+        self.assertEqual(ids, list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_keyset_pages_follow_requested_ordering(self):
+        ids = self.walk('/api/v1/orders/orders/?pagination=keyset&ordering=total')
+        self.assertEqual(ids, list(Order.objects.order_by('total', 'id').values_list('id', flat=True)))
+
+    def test_page_numbers_remain_the_default(self):
+        response = self.client.get('/api/v1/orders/orders/', {'page': 3})
+        self.assertEqual(response.data['count'], 45)
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class HotQueryIndexTests(APITestCase):
+    def test_hot_queries_have_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', '--fail-on-seq-scan', stdout=out)
+        self.assertNotIn('SEQ SCAN', out.getvalue())
+
+
+class OrderNotificationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=create_product(1), quantity=1)
+
+    def checkout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data['id'])
+
+    def set_status(self, order, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = status
+            order.save()
+
+    def test_confirmation_is_enqueued_after_commit(self):
+        with mock.patch('apps.orders.tasks.send_order_confirmation.delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json')
+            # Nothing is sent or enqueued while the request's transaction is open
+            delay.assert_not_called()
+            self.assertEqual(mail.outbox, [])
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once_with(response.data['id'])
+
+    def test_confirmation_email(self):
+        with mock.patch('apps.orders.tasks.send_order_confirmation.delay') as delay:
+            order = self.checkout()
+        send_order_confirmation(*delay.call_args.args)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(order.order_number, mail.outbox[0].subject)
+        self.assertEqual(mail.outbox[0].to, [CHECKOUT_DATA['email']])
+
+    def test_rapid_status_changes_are_coalesced(self):
+        with mock.patch('apps.orders.tasks.send_order_confirmation.delay'):
+            order = self.checkout()
+        with mock.patch('apps.orders.tasks.send_order_status_notification.apply_async') as apply_async:
+            for status in ['processing', 'shipped', 'delivered']:
+                self.set_status(order, status)
+            apply_async.assert_called_once_with((order.id,), countdown=60)
+
+            send_order_status_notification(order.id)
+            self.assertEqual(len(mail.outbox), 1)
+            self.assertIn("delivered", mail.outbox[0].subject)
+
+            # Once sent, the next change schedules a new message
+            self.set_status(order, 'refunded')
+            self.assertEqual(apply_async.call_count, 2)
+
+    def test_failed_enqueue_does_not_block_the_next_change(self):
+        with mock.patch('apps.orders.tasks.send_order_confirmation.delay'):
+            order = self.checkout()
+        with mock.patch(
+            'apps.orders.tasks.send_order_status_notification.apply_async',
+            side_effect=[ConnectionError("broker down"), None]
+        ) as apply_async:
+            self.set_status(order, 'processing')
+            self.set_status(order, 'shipped')
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_status_changed_back_sends_nothing(self):
+        with mock.patch('apps.orders.tasks.send_order_confirmation.delay') as delay:
+            order = self.checkout()
+        send_order_confirmation(order.id)
+        with mock.patch('apps.orders.tasks.send_order_status_notification.apply_async'):
+            self.set_status(order, 'processing')
+            self.set_status(order, 'pending')
+        send_order_status_notification(order.id)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_sends_are_retried(self):
+        with mock.patch('apps.orders.tasks.send_order_confirmation.delay'):
+            order = self.checkout()
+        with mock.patch('apps.orders.tasks.send_mail', side_effect=[SMTPException("busy"), 1]) as send:
+            result = send_order_confirmation.apply(args=(order.id,))
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertEqual(send.call_count, 2)
+
+
+class RecordingPublisher:
+    published = []
+
+    def publish(self, events):
+        self.published.extend((event.event_type, event.aggregate_id) for event in events)
+
+
+class FailingPublisher:
+    def publish(self, events):
+        raise ConnectionError("stream unavailable")
+
+
+@override_settings(OUTBOX_PUBLISHER='apps.orders.tests.RecordingPublisher', OUTBOX_BATCH_SIZE=2)
+class OutboxTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        RecordingPublisher.published = []
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=create_product(1), quantity=1)
+
+    def checkout(self):
+        # On-commit callbacks (notifications, relay kicks) don't run in these tests
+        response = self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data['id'])
+
+    def events(self):
+        return list(OutboxEvent.objects.values_list('event_type', 'aggregate_id'))
+
+    def test_events_are_written_with_the_change(self):
+        order = self.checkout()
+        response = self.client.post(
+            '/api/v1/orders/payments/',
+            {'order': order.id, 'payment_method': 'paypal', 'amount': str(order.total)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        payment_id = str(response.data['id'])
+        self.assertEqual(self.events(), [
+            ('order.created', str(order.id)),
+            ('payment.created', payment_id),
+            ('order.status_changed', str(order.id)),
+        ])
+        status_changed = OutboxEvent.objects.get(event_type='order.status_changed')
+        self.assertEqual(status_changed.payload['previous_status'], 'pending')
+        self.assertEqual(status_changed.payload['status'], 'processing')
+
+        # A change that rolls back leaves no event behind
+        with transaction.atomic():
+            order.status = 'shipped'
+            order.save()
+            transaction.set_rollback(True)
+        self.assertEqual(len(self.events()), 3)
+
+    def test_relay_publishes_in_order_and_marks_published(self):
+        order = self.checkout()
+        for status in ['processing', 'shipped']:
+            order.status = status
+            order.save()
+
+        self.assertEqual(relay_outbox.apply().get(), 3)
+        self.assertEqual([event_type for event_type, _ in RecordingPublisher.published], [
+            'order.created', 'order.status_changed', 'order.status_changed',
+        ])
+        self.assertFalse(OutboxEvent.objects.filter(published_at__isnull=True).exists())
+        self.assertEqual(relay_batch(), 0)
+
+    def test_commits_trigger_one_relay(self):
+        with mock.patch('apps.orders.tasks.relay_outbox.delay') as delay, \
+                mock.patch('apps.orders.tasks.send_order_confirmation.delay'):
+            with self.captureOnCommitCallbacks(execute=True):
+                order = self.checkout()
+                order.status = 'processing'
+                order.save()
+        delay.assert_called_once_with()
+
+    @override_settings(OUTBOX_PUBLISHER='apps.orders.tests.FailingPublisher')
+    def test_failed_publish_keeps_events_pending(self):
+        self.checkout()
+        with self.assertRaises(ConnectionError):
+            relay_batch()
+        event = OutboxEvent.objects.get()
+        self.assertIsNone(event.published_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("stream unavailable", event.last_error)
+
+        with override_settings(OUTBOX_PUBLISHER='apps.orders.tests.RecordingPublisher'):
+            self.assertEqual(relay_batch(), 1)
+        self.assertEqual(RecordingPublisher.published, [('order.created', str(event.aggregate_id))])
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=create_product(1), quantity=1)
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def pay(self, order, key, **data):
+        return self.post('/api/v1/orders/payments/', {
+            'order': order.id, 'payment_method': 'paypal', 'amount': str(order.total), **data
+        }, key)
+
+    def test_order_retry_is_replayed(self):
+        first = self.post('/api/v1/orders/orders/', CHECKOUT_DATA, 'checkout-1')
+        # The cart is empty now, so only a replay can succeed
+        with self.assertNumQueries(1):
+            retry = self.post('/api/v1/orders/orders/', CHECKOUT_DATA, 'checkout-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_payment_retry_is_replayed(self):
+        order = self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').data
+        order = Order.objects.get(pk=order['id'])
+        first = self.pay(order, 'pay-1')
+        retry = self.pay(order, 'pay-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()['id']), (201, first.json()['id']))
+        self.assertEqual(Payment.objects.count(), 1)
+
+        # Without a key the duplicate is refused as before
+        self.assertEqual(self.pay(order, None).status_code, 400)
+
+    def test_key_reused_for_a_different_request(self):
+        order = Order.objects.get(pk=self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').data['id'])
+        self.assertEqual(self.pay(order, 'pay-1').status_code, 201)
+        response = self.pay(order, 'pay-1', payment_method='stripe')
+        self.assertEqual(response.status_code, 422)
+
+    def test_failed_requests_release_the_key(self):
+        order = Order.objects.get(pk=self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').data['id'])
+        self.assertEqual(self.pay(order, 'pay-1', amount='1.00').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.pay(order, 'pay-1').status_code, 201)
+
+    def test_keys_are_per_user(self):
+        self.post('/api/v1/orders/orders/', CHECKOUT_DATA, 'checkout-1')
+        other = User.objects.create_user(email="other@example.com", username="other")
+        CartItem.objects.create(cart=Cart.objects.create(user=other), product=create_product(2), quantity=1)
+        self.client.force_authenticate(other)
+        self.post('/api/v1/orders/orders/', CHECKOUT_DATA, 'checkout-1')
+        self.assertEqual(Order.objects.filter(user=other).count(), 1)
+
+    def test_one_completed_payment_per_order(self):
+        order = Order.objects.get(pk=self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').data['id'])
+        Payment.objects.create(order=order, payment_method='paypal', amount=order.total, status='failed')
+        Payment.objects.create(order=order, payment_method='paypal', amount=order.total, status='completed')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Payment.objects.create(order=order, payment_method='paypal', amount=order.total, status='completed')
+
+
+class PaymentConcurrencyTests(TransactionTestCase):
+    """Simultaneous submissions for one order must charge it once."""
+    ATTEMPTS = 8
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=create_product(1), quantity=1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.order = Order.objects.get(pk=client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').data['id'])
+
+    def race(self, keys):
+        barrier = threading.Barrier(len(keys))
+        responses = []
+
+        def pay(key):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+            try:
+                barrier.wait()
+                responses.append(client.post('/api/v1/orders/payments/', {
+                    'order': self.order.id, 'payment_method': 'paypal', 'amount': str(self.order.total)
+                }, format='json', **headers))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=pay, args=(key,)) for key in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_concurrent_payments_charge_once(self):
+        statuses = [response.status_code for response in self.race([None] * self.ATTEMPTS)]
+        self.assertEqual(statuses.count(201), 1)
+        self.assertEqual(statuses.count(400), self.ATTEMPTS - 1)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+    def test_concurrent_retries_replay_the_first_response(self):
+        responses = self.race(['pay-1'] * self.ATTEMPTS)
+        self.assertEqual([response.status_code for response in responses], [201] * self.ATTEMPTS)
+        self.assertEqual(len({response.json()['id'] for response in responses}), 1)
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), self.ATTEMPTS - 1)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+
+class GuestCartTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirt = create_product(1, variants=1)
+        self.hat = create_product(2)
+
+    def add(self, product, quantity=1, variant=None, token=None):
+        headers = {'HTTP_X_CART_TOKEN': token} if token else {}
+        return self.client.post('/api/v1/orders/cart/add_item/', {
+            'product_id': product.id, 'variant_id': variant.id if variant else None, 'quantity': quantity
+        }, format='json', **headers)
+
+    def test_guest_cart_never_writes_to_the_database(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.add(self.shirt, 2)
+            token = response['X-Cart-Token']
+            self.add(self.shirt, 1, token=token)
+            response = self.add(self.shirt, 1, variant=self.shirt.variants.get(), token=token)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([query for query in context.captured_queries if not query['sql'].startswith('SELECT')])
+        self.assertFalse(Cart.objects.exists())
+
+        self.assertEqual([item['quantity'] for item in response.data['items']], [3, 1])
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('40.00'))
+        line_id = response.data['items'][0]['id']
+
+        response = self.client.post('/api/v1/orders/cart/update_item/', {'item_id': line_id, 'quantity': 5},
+                                    format='json', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['total_items'], 6)
+        self.client.post('/api/v1/orders/cart/remove_item/', {'item_id': line_id}, format='json', HTTP_X_CART_TOKEN=token)
+        response = self.client.get('/api/v1/orders/cart/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['total_items'], 1)
+
+    def test_unknown_token_starts_a_new_cart(self):
+        response = self.client.get('/api/v1/orders/cart/', HTTP_X_CART_TOKEN='expired')
+        self.assertEqual(response.data['items'], [])
+        self.assertNotEqual(response['X-Cart-Token'], 'expired')
+
+    def test_merge_on_login(self):
+        token = self.add(self.shirt, 2)['X-Cart-Token']
+        self.add(self.hat, 1, token=token)
+
+        user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.shirt, quantity=1)
+        self.client.force_authenticate(user)
+
+        with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get('/api/v1/orders/cart/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(len([query for query in context.captured_queries if query['sql'].startswith('INSERT')]), 1)
+        self.assertEqual({item['product']['id']: item['quantity'] for item in response.data['items']}, {
+            self.shirt.id: 3, self.hat.id: 1,
+        })
+
+        # The guest cart is gone, so sending the token again changes nothing
+        response = self.client.get('/api/v1/orders/cart/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['total_items'], 4)
+
+    def test_failed_merge_keeps_the_guest_cart(self):
+        token = self.add(self.hat, 2)['X-Cart-Token']
+        user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        cart = Cart.objects.create(user=user)
+
+        with mock.patch('apps.orders.carts.upsert_cart_items', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                merge_guest_cart(cart, token)
+        self.assertFalse(cart.items.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(merge_guest_cart(cart, token))
+        self.assertEqual(cart.items.get().quantity, 2)
+        self.assertFalse(merge_guest_cart(cart, token))
+
+    def test_checkout_takes_the_guest_cart_along(self):
+        token = self.add(self.hat, 2)['X-Cart-Token']
+        user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['items'][0]['quantity'], 2)
+
+
+class CartBatchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = [create_product(index, inventory=10, variants=1) for index in range(12)]
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+
+    def batch(self, *operations, **headers):
+        return self.client.post('/api/v1/orders/cart/batch/', {'operations': list(operations)}, format='json', **headers)
+
+    def quantities(self):
+        return {
+            (item.product_id, item.variant_id): item.quantity
+            for item in CartItem.objects.filter(cart=self.cart)
+        }
+
+    def test_operations_are_applied_together(self):
+        first, second, third = self.products[:3]
+        variant = third.variants.get()
+        response = self.batch(
+            {'op': 'add', 'product_id': first.id, 'quantity': 2},
+            {'op': 'remove', 'product_id': second.id},
+            {'op': 'add', 'product_id': third.id, 'variant_id': variant.id},
+            {'op': 'set', 'product_id': third.id, 'quantity': 4},
+            {'op': 'add', 'product_id': third.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {(first.id, None): 3, (third.id, variant.id): 1, (third.id, None): 5})
+        self.assertEqual(response.data['total_items'], 9)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def count_queries(products):
+            with CaptureQueriesContext(connection) as context:
+                response = self.batch(*(
+                    {'op': op, 'product_id': product.id, 'quantity': 1}
+                    for product in products for op in ['add', 'set']
+                ))
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(self.products[2:4]), count_queries(self.products[4:12]))
+
+    def test_shortfall_rolls_back_the_whole_batch(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': self.products[2].id, 'quantity': 3},
+            {'op': 'add', 'product_id': self.products[0].id, 'quantity': 10},
+        )
+        self.assertEqual(response.status_code, 400)
+        # The cart already held one, so ten more is over the stock of ten
+        self.assertEqual(response.data['operations'], {1: ["Only 10 items available in stock."]})
+        self.assertEqual(self.quantities(), {(self.products[0].id, None): 1, (self.products[1].id, None): 1})
+
+    def test_invalid_lines(self):
+        other_variant = self.products[1].variants.get()
+        response = self.batch(
+            {'op': 'add', 'product_id': 999999},
+            {'op': 'add', 'product_id': self.products[0].id, 'variant_id': other_variant.id},
+        )
+        self.assertEqual(response.data['operations'], {
+            0: ["Product not found."],
+            1: ["This variant does not belong to the selected product."],
+        })
+        self.assertEqual(self.batch().status_code, 400)
+
+    def test_unavailable_lines_can_still_be_removed(self):
+        Product.objects.filter(pk=self.products[1].pk).update(is_available=False)
+        response = self.batch(
+            {'op': 'remove', 'product_id': self.products[1].id},
+            {'op': 'set', 'product_id': 999999, 'quantity': 0},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {(self.products[0].id, None): 1})
+
+    def test_guest_batch(self):
+        self.client.force_authenticate(None)
+        response = self.batch(
+            {'op': 'add', 'product_id': self.products[0].id, 'quantity': 2},
+            {'op': 'set', 'product_id': self.products[1].id, 'quantity': 3},
+        )
+        token = response['X-Cart-Token']
+        response = self.batch({'op': 'add', 'product_id': self.products[0].id, 'quantity': 9}, HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 400)
+        response = self.batch({'op': 'remove', 'product_id': self.products[0].id}, HTTP_X_CART_TOKEN=token)
+        self.assertEqual([item['quantity'] for item in response.data['items']], [3])
+        deleted_id = self.products[1].id
+        self.products[1].delete()
+        response = self.batch({'op': 'remove', 'product_id': deleted_id}, HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'], [])
+
+
+class CartCreationConcurrencyTests(TransactionTestCase):
+    """A user's first cart requests arriving together must share one cart."""
+    REQUESTS = 12
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.product = create_product(1)
+
+    def race(self, send):
+        barrier = threading.Barrier(self.REQUESTS)
+        statuses = []
+
+        def request():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                statuses.append(send(client).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=request) for _ in range(self.REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_parallel_first_requests_create_one_cart(self):
+        statuses = self.race(lambda client: client.get('/api/v1/orders/cart/'))
+        self.assertEqual(statuses, [200] * self.REQUESTS)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+
+    def test_parallel_first_adds_land_in_one_cart(self):
+        statuses = self.race(lambda client: client.post('/api/v1/orders/cart/batch/', {
+            'operations': [{'op': 'add', 'product_id': self.product.id}]
+        }, format='json'))
+        self.assertEqual(statuses, [200] * self.REQUESTS)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(cart.items.get().quantity, self.REQUESTS)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json').status_code, 201)
+
+    def test_one_cart_per_user_constraint(self):
+        Cart.objects.create(user=self.user)
+        with self.assertRaises(IntegrityError):
+            Cart.objects.create(user=self.user)
+        # Guest carts have no user and are not limited
+        Cart.objects.create(session_id="a")
+        Cart.objects.create(session_id="b")
+
+
+class AbandonedCartSweepTests(APITestCase):
+    def setUp(self):
+        self.product = create_product(1, variants=1)
+        self.long_ago = timezone.now() - timedelta(days=45)
+
+    def make_cart(self, index, stale=True, stale_items=True):
+        user = User.objects.create_user(email=f"shopper{index}@example.com", username=f"shopper{index}")
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        CartItem.objects.create(cart=cart, product=self.product, variant=self.product.variants.get(), quantity=1)
+        if stale:
+            Cart.objects.filter(pk=cart.pk).update(updated_at=self.long_ago)
+        if stale_items:
+            CartItem.objects.filter(cart=cart).update(updated_at=self.long_ago)
+        return cart
+
+    def test_sweep_deletes_only_abandoned_carts(self):
+        stale = [self.make_cart(index) for index in range(5)]
+        fresh = self.make_cart(5, stale=False, stale_items=False)
+        # The cart row is old but a line was changed recently
+        active = self.make_cart(6, stale_items=False)
+
+        out = StringIO()
+        call_command('sweep_carts', batch_size=2, stdout=out)
+        self.assertIn("Deleted 5 carts and 10 cart items", out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {fresh.id, active.id})
+        self.assertFalse(CartItem.objects.filter(cart_id__in=[cart.id for cart in stale]).exists())
+
+    def test_age_is_configurable(self):
+        self.make_cart(0)
+        self.assertEqual(sweep_abandoned_carts(days=60), {'carts': 0, 'items': 0})
+        self.assertEqual(sweep_abandoned_carts(days=30), {'carts': 1, 'items': 2})
+
+    def test_swept_user_gets_a_new_cart(self):
+        cart = self.make_cart(0)
+        sweep_abandoned_carts()
+        self.client.force_authenticate(cart.user)
+        response = self.client.get('/api/v1/orders/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'], [])
@@ -1,34 +1,52 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
+from .carts import (
+    CART_TOKEN_HEADER, GuestCart, apply_cart_batch, apply_guest_cart_batch, get_user_cart, merge_guest_cart
+)
+from .idempotency import idempotent
 from .models import Cart, CartItem, Order, Payment
-from .serializers import CartSerializer, CartItemSerializer, OrderSerializer, PaymentSerializer
+from .serializers import CartBatchSerializer, CartSerializer, CartItemSerializer, OrderSerializer, PaymentSerializer
 from apps.users.permissions import IsAdmin, IsOwnerOrAdmin
+from core.pagination import SelectablePaginationMixin
 
 class CartViewSet(viewsets.GenericViewSet):
+    """
+    The signed-in user's cart, or for guests a cart in the cache identified
+    by the X-Cart-Token header (see carts.py), which is merged into the
+    user's cart on their first cart request after signing in.
+    """
     serializer_class = CartSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.AllowAny]
     
     def get_queryset(self):
         return Cart.objects.filter(user=self.request.user)
     
     def get_or_create_cart(self):
-        try:
-            return Cart.objects.get(user=self.request.user)
-        except Cart.DoesNotExist:
-            return Cart.objects.create(user=self.request.user)
+        cart = get_user_cart(self.request.user)
+        merge_guest_cart(cart, self.request.headers.get(CART_TOKEN_HEADER))
+        return cart
+    
+    def get_guest_cart(self):
+        return GuestCart(self.request.headers.get(CART_TOKEN_HEADER))
+    
+    def guest_cart_response(self, guest_cart, status=status.HTTP_200_OK):
+        serializer = self.get_serializer(guest_cart.load_items())
+        return Response(serializer.data, status=status, headers={CART_TOKEN_HEADER: guest_cart.token})
     
     def list(self, request):
         """Get current user's cart"""
+        if not request.user.is_authenticated:
+            return self.guest_cart_response(self.get_guest_cart())
         cart = self.get_or_create_cart()
-        serializer = self.get_serializer(cart)
+        serializer = self.get_serializer(cart.load_items())
         return Response(serializer.data)
     
     @action(detail=False, methods=['post'])
     def add_item(self, request):
         """Add an item to the cart"""
-        cart = self.get_or_create_cart()
         serializer = CartItemSerializer(data=request.data)
         
         if serializer.is_valid():
@@ -36,6 +54,17 @@ class CartViewSet(viewsets.GenericViewSet):
             variant = serializer.validated_data.get('variant')
             quantity = serializer.validated_data.get('quantity', 1)
             
+            if not request.user.is_authenticated:
+                guest_cart = self.get_guest_cart()
+                if not guest_cart.add(product.id, variant.id if variant else None, quantity):
+                    return Response(
+                        {"detail": "Cart is full."}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                guest_cart.save()
+                return self.guest_cart_response(guest_cart, status=status.HTTP_201_CREATED)
+            
+            cart = self.get_or_create_cart()
             # Check if item already exists in cart
             try:
                 cart_item = CartItem.objects.get(
@@ -55,14 +84,13 @@ class CartViewSet(viewsets.GenericViewSet):
                     quantity=quantity
                 )
             
-            cart_serializer = self.get_serializer(cart)
+            cart_serializer = self.get_serializer(cart.load_items())
             return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['post'])
     def update_item(self, request):
         """Update item quantity in cart"""
-        cart = self.get_or_create_cart()
         item_id = request.data.get('item_id')
         quantity = request.data.get('quantity', 1)
         
@@ -72,6 +100,17 @@ class CartViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        if not request.user.is_authenticated:
+            guest_cart = self.get_guest_cart()
+            if not guest_cart.set_quantity(item_id, quantity):
+                return Response(
+                    {"detail": "Item not found in cart."}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            guest_cart.save()
+            return self.guest_cart_response(guest_cart)
+        
+        cart = self.get_or_create_cart()
         try:
             cart_item = CartItem.objects.get(cart=cart, id=item_id)
             
@@ -83,7 +122,7 @@ class CartViewSet(viewsets.GenericViewSet):
                 cart_item.quantity = quantity
                 cart_item.save()
             
-            cart_serializer = self.get_serializer(cart)
+            cart_serializer = self.get_serializer(cart.load_items())
             return Response(cart_serializer.data)
         except CartItem.DoesNotExist:
             return Response(
@@ -94,7 +133,6 @@ class CartViewSet(viewsets.GenericViewSet):
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
         """Remove item from cart"""
-        cart = self.get_or_create_cart()
         item_id = request.data.get('item_id')
         
         if not item_id:
@@ -103,11 +141,22 @@ class CartViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        if not request.user.is_authenticated:
+            guest_cart = self.get_guest_cart()
+            if not guest_cart.remove(item_id):
+                return Response(
+                    {"detail": "Item not found in cart."}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            guest_cart.save()
+            return self.guest_cart_response(guest_cart)
+        
+        cart = self.get_or_create_cart()
         try:
             cart_item = CartItem.objects.get(cart=cart, id=item_id)
             cart_item.delete()
             
-            cart_serializer = self.get_serializer(cart)
+            cart_serializer = self.get_serializer(cart.load_items())
             return Response(cart_serializer.data)
         except CartItem.DoesNotExist:
             return Response(
@@ -115,18 +164,48 @@ class CartViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
     
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply a list of add/set/remove operations to the cart at once, all or
+        nothing, and return the resulting cart
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        
+        if not request.user.is_authenticated:
+            guest_cart = self.get_guest_cart()
+            apply_guest_cart_batch(guest_cart, operations)
+            guest_cart.save()
+            return self.guest_cart_response(guest_cart)
+        
+        cart = self.get_or_create_cart()
+        apply_cart_batch(cart, operations)
+        
+        cart_serializer = self.get_serializer(cart.load_items())
+        return Response(cart_serializer.data)
+    
     @action(detail=False, methods=['post'])
     def clear(self, request):
         """Clear all items from cart"""
+        if not request.user.is_authenticated:
+            guest_cart = self.get_guest_cart()
+            guest_cart.clear()
+            guest_cart.save()
+            return self.guest_cart_response(guest_cart)
+        
         cart = self.get_or_create_cart()
         cart.items.all().delete()
         
-        cart_serializer = self.get_serializer(cart)
+        cart_serializer = self.get_serializer(cart.load_items())
         return Response(cart_serializer.data)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SelectablePaginationMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering_fields = ['created_at', 'total']
+    ordering = ['-created_at']
     
     def get_queryset(self):
         user = self.request.user
@@ -134,8 +213,13 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Order.objects.all()
         return Order.objects.filter(user=user)
     
+    @idempotent('orders.create')
     def create(self, request, *args, **kwargs):
         cart = Cart.objects.filter(user=request.user).first()
+        # Checking out straight after signing in still takes the guest cart along
+        if request.headers.get(CART_TOKEN_HEADER):
+            cart = cart or get_user_cart(request.user)
+            merge_guest_cart(cart, request.headers[CART_TOKEN_HEADER])
         if not cart or not cart.items.exists():
             return Response(
                 {"detail": "Cannot create order from empty cart."}, 
@@ -158,8 +242,10 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        order.status = 'cancelled'
-        order.save()
+        # The status change and its outbox event commit together
+        with transaction.atomic():
+            order.status = 'cancelled'
+            order.save()
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
@@ -181,8 +267,9 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        order.status = status_value
-        order.save()
+        with transaction.atomic():
+            order.status = status_value
+            order.save()
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
@@ -197,33 +284,39 @@ class PaymentViewSet(viewsets.ModelViewSet):
             return Payment.objects.all()
         return Payment.objects.filter(order__user=user)
     
+    @idempotent('payments.create')
     def create(self, request, *args, **kwargs):
-        # Get order from request data
-        order_id = request.data.get('order')
-        try:
-            order = Order.objects.get(id=order_id, user=request.user)
-        except Order.DoesNotExist:
-            return Response(
-                {"detail": "Order not found or does not belong to current user."}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        # Check if order is already paid
-        if order.payments.filter(status='completed').exists():
-            return Response(
-                {"detail": "This order has already been paid for."}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Process payment (this would normally integrate with a payment processor)
-        # For now, we'll simulate a successful payment
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        payment = serializer.save(status='completed')
-        
-        # Update order status
-        order.status = 'processing'
-        order.save()
+        with transaction.atomic():
+            # Get order from request data; the row lock queues up concurrent
+            # payments for the same order behind the "already paid" check
+            order = Order.objects.select_for_update().filter(
+                id=request.data.get('order'), user=request.user
+            ).first()
+            if order is None:
+                return Response(
+                    {"detail": "Order not found or does not belong to current user."}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            # Validation also checks whether the order is already paid
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            
+            # Process payment (this would normally integrate with a payment processor)
+            # For now, we'll simulate a successful payment
+            try:
+                with transaction.atomic():
+                    serializer.save(status='completed')
+            except IntegrityError:
+                # payment_one_completed_per_order, should the lock ever be bypassed
+                return Response(
+                    {"detail": "This order has already been paid for."}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Update order status
+            order.status = 'processing'
+            order.save()
         
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
\ No newline at end of file
@@ -1,4 +1,14 @@
-from django.contrib import admin
+import io
+
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.shortcuts import redirect, render
+from django.urls import path
+from .cache import bump_catalog_version
+from .importer import FORMATS, detect_format, import_catalog
 from .models import (
     Category, 
     Product, 
@@ -31,8 +41,24 @@ class ProductReviewInline(admin.TabularInline):
     can_delete = False
     max_num = 0
 
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or JSON Lines; products are matched on SKU.")
+    file_format = forms.ChoiceField(
+        choices=[('', "From the file extension")] + [(name, name.upper()) for name in FORMATS], required=False
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload and not cleaned_data.get('file_format'):
+            try:
+                cleaned_data['file_format'] = detect_format(upload.name)
+            except ValueError as exc:
+                raise forms.ValidationError(str(exc))
+        return cleaned_data
+
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'sku', 'price', 'category', 'inventory', 'is_available', 'is_featured')
+    list_display = ('name', 'sku', 'price', 'category', 'inventory', 'is_available', 'is_featured', 'average_rating')
     list_filter = ('is_available', 'is_featured', 'category')
     search_fields = ('name', 'description', 'sku')
     prepopulated_fields = {'slug': ('name',)}
@@ -53,7 +79,45 @@ class ProductAdmin(admin.ModelAdmin):
         ('Display Options', {
             'fields': ('is_featured',)
         }),
+        ('Ratings', {
+            'fields': ('average_rating', 'rating_count', 'rating_sum')
+        }),
     )
+    readonly_fields = ('average_rating', 'rating_count', 'rating_sum')
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_catalog_view), name='products_product_import'),
+        ] + super().get_urls()
+
+    def import_catalog_view(self, request):
+        """Upload a CSV or JSON Lines file for apps.products.importer"""
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            # Read straight from the upload (spooled to disk when large), a chunk at a time
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            importer = import_catalog(stream, form.cleaned_data['file_format'])
+            stats = importer.stats
+            self.message_user(
+                request,
+                f"Imported {stats['created'] + stats['updated']} products ({stats['created']} new, "
+                f"{stats['updated']} updated), {stats['variants']} variants and {stats['images']} images.",
+                messages.SUCCESS
+            )
+            if stats['errors']:
+                details = '; '.join(f"line {number}: {message}" for number, message in importer.errors[:10])
+                self.message_user(request, f"{stats['errors']} rows were skipped ({details}).", messages.WARNING)
+            return redirect('admin:products_product_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Import catalog",
+            'form': form,
+        }
+        return render(request, 'admin/products/product/import_catalog.html', context)
 
 class ProductAttributeAdmin(admin.ModelAdmin):
     list_display = ('name',)
@@ -81,7 +145,18 @@ class ProductReviewAdmin(admin.ModelAdmin):
     actions = ['approve_reviews']
     
     def approve_reviews(self, request, queryset):
-        queryset.update(is_approved=True)
+        # queryset.update() bypasses the ProductReview signals, so the rating
+        # aggregates of the affected products are adjusted here in bulk
+        with transaction.atomic():
+            pending_ids = list(
+                queryset.filter(is_approved=False).select_for_update().values_list('id', flat=True)
+            )
+            pending = ProductReview.objects.filter(id__in=pending_ids)
+            totals = pending.values('product').annotate(count=Count('id'), total=Sum('rating')).order_by()
+            for row in totals:
+                Product.adjust_rating(row['product'], row['count'], row['total'])
+            pending.update(is_approved=True)
+            transaction.on_commit(bump_catalog_version)
     approve_reviews.short_description = "Approve selected reviews"
 
 # Register models
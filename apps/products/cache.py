@@ -0,0 +1,246 @@
+"""
+Caching for the read-only catalog endpoints.
+
+Cached responses and objects are keyed by a global catalog version, so any
+change to the catalog only needs to bump that version (see
+`products.signals`). The old entries are never read again and simply expire.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+VERSION_KEY = 'catalog:version'
+HITS_KEY = 'catalog:stats:hits'
+MISSES_KEY = 'catalog:stats:misses'
+
+# How long one request may hold the rebuild lock for a key, and how often the
+# others check whether it has finished
+LOCK_TIMEOUT = 5
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        cache.incr(VERSION_KEY)
+
+
+def _increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def response_cache_key(view, request, kwargs, version):
+    """Key on the view, its URL kwargs and the query string with parameter order normalized away"""
+    params = sorted(
+        (name, sorted(value for value in values if value != ''))
+        for name, values in request.query_params.lists()
+    )
+    params = [(name, values) for name, values in params if values]
+    raw = repr((
+        request.scheme,
+        request.get_host(),
+        view.basename,
+        view.action,
+        sorted(kwargs.items()),
+        params,
+    ))
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f"catalog:v{version}:{view.basename}:{view.action}:{digest}"
+
+
+def _wait_for(key):
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return None
+
+
+def cache_response(view_method):
+    """
+    Serve a GET viewset action from the catalog cache.
+
+    Only one request rebuilds a missing entry; concurrent requests for the same
+    key wait for it (up to LOCK_TIMEOUT) instead of all hitting the database.
+    Set CATALOG_CACHE_TIMEOUT to 0 to disable caching.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        timeout = settings.CATALOG_CACHE_TIMEOUT
+        if not timeout or request.method != 'GET':
+            return view_method(self, request, *args, **kwargs)
+
+        version = get_catalog_version()
+        # A response is about to be built from catalog objects, so make sure
+        # the local object tier isn't behind the version it will be cached under
+        catalog_objects.observe_version(version)
+        key = response_cache_key(self, request, kwargs, version)
+        data = cache.get(key)
+        if data is not None:
+            _increment(HITS_KEY)
+            return Response(data)
+        _increment(MISSES_KEY)
+
+        lock_key = f"{key}:lock"
+        locked = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+        if not locked:
+            data = _wait_for(key)
+            if data is not None:
+                return Response(data)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout=timeout)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
+    return wrapper
+
+
+class LocalCache:
+    """A bounded, thread-safe, per-process LRU cache whose entries expire after `timeout` seconds"""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CatalogObjectCache:
+    """
+    Two-tier cache for catalog objects: a per-process LRU in front of the shared
+    cache. Every process compares its catalog version with the shared one at
+    most once per CATALOG_VERSION_CHECK_MS and drops its local tier when the
+    version has moved on, so a change is visible everywhere within that interval
+    without any process-to-process messaging.
+    """
+
+    def __init__(self):
+        self.local = LocalCache(settings.CATALOG_LOCAL_CACHE_SIZE, settings.CATALOG_LOCAL_CACHE_TIMEOUT)
+        self._version = None
+        self._checked_at = 0
+
+    def observe_version(self, version):
+        """Adopt a catalog version the caller has just read from the shared cache"""
+        if version != self._version:
+            self.local.clear()
+            self._version = version
+        self._checked_at = time.monotonic()
+
+    def _current_version(self):
+        elapsed_ms = (time.monotonic() - self._checked_at) * 1000
+        if self._version is None or elapsed_ms >= settings.CATALOG_VERSION_CHECK_MS:
+            self.observe_version(get_catalog_version())
+        return self._version
+
+    def get(self, key, loader):
+        """Return the object cached under `key`, calling `loader()` to build it on a miss in both tiers"""
+        version = self._current_version()
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        shared_key = f"catalog:v{version}:object:{key}"
+        value = cache.get(shared_key)
+        if value is None:
+            value = loader()
+            cache.set(shared_key, value, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        self.local.set(key, value)
+        return value
+
+    def clear(self):
+        self.local.clear()
+        self._version = None
+
+
+catalog_objects = CatalogObjectCache()
+
+
+class CachedLookupMixin:
+    """
+    Resolve the object of read-only detail actions through `catalog_objects`.
+
+    Requests with query parameters (other than a pagination cursor) still go
+    through `get_object()` uncached, since the filter backends apply to detail
+    lookups as well.
+    """
+    cached_lookup_ignored_params = {'cursor'}
+
+    def get_object(self):
+        request = self.request
+        if (
+            not settings.CATALOG_CACHE_TIMEOUT
+            or request.method != 'GET'
+            or set(request.query_params) - self.cached_lookup_ignored_params
+        ):
+            return super().get_object()
+
+        # The queryset (and what it prefetches) differs between retrieve and other actions
+        profile = 'retrieve' if self.action == 'retrieve' else 'lookup'
+        key = f"{self.basename}:{profile}:{self.kwargs[self.lookup_field]}"
+        obj = catalog_objects.get(key, super().get_object)
+        self.check_object_permissions(request, obj)
+        return obj
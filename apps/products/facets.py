@@ -0,0 +1,125 @@
+"""
+Facet counts for the product list (`?facets=true`).
+
+Each dimension is counted over the products that match every *other* filter
+in the request, so with "Red" selected the client can still show how many
+products are Blue. Every dimension is a single grouped or conditional
+aggregate, so the number of queries depends on the dimensions, not on how
+many values they have: one each for category, availability and price, and
+for attributes one plus one per attribute the request filters on.
+"""
+from django.db.models import Count, Q
+
+from .filters import group_attribute_values
+from .models import Product, VariantAttributeValue
+from .search import ProductSearchFilter, build_search_query
+
+# (min, max) price buckets; min is inclusive, max exclusive, None is unbounded
+PRICE_RANGES = [(None, 25), (25, 50), (50, 100), (100, 250), (250, 500), (500, None)]
+
+
+class ProductFacets:
+    def __init__(self, view):
+        self.view = view
+        self.request = view.request
+
+    def counts(self):
+        return {
+            'category': self.categories(),
+            'is_available': self.availability(),
+            'price': self.price_ranges(),
+            'attributes': self.attributes(),
+        }
+
+    def filtered(self, drop=(), **params):
+        """Products matching the request's search and filters, without the `drop` parameters"""
+        data = self.request.query_params.copy()
+        for name in drop:
+            data.pop(name, None)
+        for name, value in params.items():
+            data[name] = value
+
+        queryset = Product.objects.all()
+        query = build_search_query(' '.join(ProductSearchFilter().get_search_terms(self.request)))
+        if query is not None:
+            queryset = queryset.filter(search_vector=query)
+        return self.view.filterset_class(data, queryset=queryset, request=self.request).qs.order_by()
+
+    def categories(self):
+        rows = self.filtered(drop=['category', 'category_tree']).filter(category__isnull=False).values(
+            'category', 'category__name', 'category__slug'
+        ).annotate(count=Count('id')).order_by('-count', 'category__name')
+        return [
+            {'id': row['category'], 'name': row['category__name'], 'slug': row['category__slug'], 'count': row['count']}
+            for row in rows
+        ]
+
+    def availability(self):
+        counts = self.filtered(drop=['is_available']).aggregate(
+            available=Count('id', filter=Q(is_available=True)),
+            unavailable=Count('id', filter=Q(is_available=False)),
+        )
+        return [
+            {'value': True, 'count': counts['available']},
+            {'value': False, 'count': counts['unavailable']},
+        ]
+
+    def price_ranges(self):
+        aggregates = {}
+        for index, (low, high) in enumerate(PRICE_RANGES):
+            condition = Q()
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            aggregates[f'range_{index}'] = Count('id', filter=condition)
+        counts = self.filtered(drop=['price__gte', 'price__lte']).aggregate(**aggregates)
+        return [
+            {'min': low, 'max': high, 'count': counts[f'range_{index}']}
+            for index, (low, high) in enumerate(PRICE_RANGES)
+        ]
+
+    def attributes(self):
+        filterset = self.view.filterset_class(
+            self.request.query_params, queryset=Product.objects.none(), request=self.request
+        )
+        selected_ids = filterset.form.cleaned_data.get('attribute_value') if filterset.is_valid() else None
+        selected = group_attribute_values(selected_ids) if selected_ids else {}
+
+        # Attributes the request doesn't filter on are counted under all filters
+        rows = list(self.count_attribute_values(self.filtered()).exclude(attribute_value__attribute__in=selected))
+        # A filtered attribute is counted under every filter except its own
+        for attribute_id in selected:
+            others = [
+                str(value_id)
+                for other_id, value_ids in selected.items() if other_id != attribute_id
+                for value_id in value_ids
+            ]
+            if others:
+                products = self.filtered(attribute_value=','.join(others))
+            else:
+                products = self.filtered(drop=['attribute_value'])
+            rows += self.count_attribute_values(products).filter(attribute_value__attribute=attribute_id)
+
+        attributes = {}
+        for row in rows:
+            attribute = attributes.setdefault(row['attribute_value__attribute'], {
+                'id': row['attribute_value__attribute'],
+                'name': row['attribute_value__attribute__name'],
+                'values': [],
+            })
+            attribute['values'].append(
+                {'id': row['attribute_value'], 'value': row['attribute_value__value'], 'count': row['count']}
+            )
+        for attribute in attributes.values():
+            attribute['values'].sort(key=lambda value: (-value['count'], value['value']))
+        return sorted(attributes.values(), key=lambda attribute: attribute['name'])
+
+    def count_attribute_values(self, products):
+        """Products per attribute value, counting a product once however many of its variants have it"""
+        return VariantAttributeValue.objects.filter(variant__product__in=products).values(
+            'attribute_value',
+            'attribute_value__value',
+            'attribute_value__attribute',
+            'attribute_value__attribute__name',
+        ).annotate(count=Count('variant__product', distinct=True)).order_by()
@@ -0,0 +1,58 @@
+import django_filters
+from django.db.models import Exists, OuterRef
+from .models import Category, Product, ProductAttributeValue, VariantAttributeValue
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+def group_attribute_values(value_ids):
+    """Map attribute id -> the given attribute value ids that belong to it"""
+    groups = {}
+    for attribute_id, value_id in ProductAttributeValue.objects.filter(id__in=value_ids).values_list(
+        'attribute_id', 'id'
+    ):
+        groups.setdefault(attribute_id, []).append(value_id)
+    return groups
+
+
+class ProductFilter(django_filters.FilterSet):
+    category_tree = django_filters.CharFilter(
+        method='filter_category_tree',
+        label='Category slug; matches products in that category and all of its subcategories'
+    )
+    attribute_value = NumberInFilter(
+        method='filter_attribute_value',
+        label='Comma-separated attribute value ids; a product matches if one of its variants has any '
+              'of the selected values of each attribute (e.g. Red or Blue, and Large)'
+    )
+
+    class Meta:
+        model = Product
+        fields = {
+            'category': ['exact'],
+            'is_available': ['exact'],
+            'is_featured': ['exact'],
+            'price': ['gte', 'lte'],
+            'average_rating': ['gte', 'lte'],
+        }
+
+    def filter_category_tree(self, queryset, name, value):
+        # Looked up first so the product query gets a constant `path LIKE '1/4/%'`
+        # prefix, which can use the path index
+        subtree_path = Category.objects.filter(slug=value).values_list('path', flat=True).first()
+        if subtree_path is None:
+            return queryset.none()
+        return queryset.filter(category__path__startswith=subtree_path)
+
+    def filter_attribute_value(self, queryset, name, value):
+        groups = group_attribute_values(value)
+        if not groups:
+            return queryset.none()
+        for value_ids in groups.values():
+            queryset = queryset.filter(Exists(VariantAttributeValue.objects.filter(
+                variant__product=OuterRef('pk'),
+                attribute_value__in=value_ids
+            )))
+        return queryset
@@ -0,0 +1,423 @@
+"""
+Bulk catalog import from CSV or JSON Lines, behind the `import_catalog`
+command and the product admin's upload page.
+
+The file is read and validated a row at a time and written in chunks of
+CATALOG_IMPORT_CHUNK_SIZE products, each chunk in its own transaction with
+one ``INSERT ... ON CONFLICT (sku) DO UPDATE`` for products and one for
+variants, and bulk inserts for images and variant attributes. Categories and
+attributes are resolved from maps loaded once up front (missing attributes
+and values are created), so memory use depends on the chunk size, not the
+file size.
+
+Model signals don't fire for bulk writes, so their effects are applied here
+instead: slugs for new products, `is_available` off when out of stock, a
+primary image per product, and a single catalog cache bump at the end.
+Existing products and variants keep their `is_available` unless the file
+has a value for it, so a price or stock update doesn't re-enable products
+staff switched off.
+
+JSON Lines: one product per line,
+    {"sku": "TS-1", "name": "T-shirt", "price": "19.90", "category": "Shirts",
+     "images": ["products/ts-1.jpg"],
+     "variants": [{"sku": "TS-1-M", "name": "M", "attributes": {"Size": "M"}}]}
+
+CSV: one product per row, or one variant per row (`variant_sku` set), with
+the rows of a product next to each other; the product columns are taken
+from its first row. `images` is separated by "|", `attributes` is
+"Size=M;Color=Red".
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.text import slugify
+
+from .cache import bump_catalog_version
+from .models import (
+    Category, Product, ProductAttribute, ProductAttributeValue, ProductImage, ProductVariant, VariantAttributeValue
+)
+
+FORMATS = ('csv', 'jsonl')
+# Errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# is_available is written separately, see set_availability()
+PRODUCT_UPDATE_FIELDS = [
+    'name', 'description', 'price', 'compare_price', 'category', 'inventory', 'is_featured', 'updated_at',
+]
+VARIANT_UPDATE_FIELDS = ['product', 'name', 'price_adjustment', 'inventory']
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ValueError(f"Can't tell the format of {filename}; expected one of {', '.join(FORMATS)}.")
+
+
+def read_jsonl(lines):
+    """Yield (line number, record or ImportRowError) for a JSON Lines stream"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield number, ImportRowError(f"Invalid JSON: {exc}")
+            continue
+        if not isinstance(record, dict):
+            yield number, ImportRowError("Expected a JSON object.")
+            continue
+        yield number, record
+
+
+def _split(value, separator):
+    return [part.strip() for part in (value or '').split(separator) if part.strip()]
+
+
+def _csv_variant(row):
+    attributes = {}
+    for pair in _split(row.get('attributes'), ';'):
+        name, _, value = pair.partition('=')
+        attributes[name.strip()] = value.strip()
+    return {
+        'sku': row.get('variant_sku'),
+        'name': row.get('variant_name'),
+        'price_adjustment': row.get('price_adjustment'),
+        'inventory': row.get('variant_inventory'),
+        'is_available': row.get('variant_is_available'),
+        'attributes': attributes,
+    }
+
+
+def read_csv(lines):
+    """Yield (line number, record) for a CSV stream, folding a product's variant rows into it"""
+    reader = csv.DictReader(lines)
+    record = None
+    number = None
+    for row in reader:
+        row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items() if key}
+        if record is None or row.get('sku') != record['sku']:
+            if record is not None:
+                yield number, record
+            number = reader.line_num
+            record = {key: value for key, value in row.items() if value != ''}
+            if 'images' in record:
+                record['images'] = _split(record['images'], '|')
+            record['variants'] = []
+        if row.get('variant_sku'):
+            record['variants'].append(_csv_variant(row))
+    if record is not None:
+        yield number, record
+
+
+def _required(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        raise ImportRowError(f"{field} is required.")
+    return str(value).strip()
+
+
+def _decimal(value, field, default=None):
+    if value in (None, ''):
+        return default
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ImportRowError(f"{field} must be a number.")
+    if not number.is_finite() or number.as_tuple().exponent < -2 or abs(number) >= 10 ** 8:
+        raise ImportRowError(f"{field} must be a number with at most 8 digits and 2 decimal places.")
+    return number
+
+
+def _count(value, field, default=0):
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f"{field} must be a whole number.")
+    if number < 0:
+        raise ImportRowError(f"{field} can't be negative.")
+    return number
+
+
+def _bool(value, field, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in TRUE_VALUES:
+        return True
+    if str(value).lower() in FALSE_VALUES:
+        return False
+    raise ImportRowError(f"{field} must be true or false.")
+
+
+def _max_length(value, field, model):
+    if len(value) > model._meta.get_field(field).max_length:
+        raise ImportRowError(f"{field} is too long.")
+    return value
+
+
+class CatalogImporter:
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or settings.CATALOG_IMPORT_CHUNK_SIZE
+        self.categories = {}
+        for category_id, name, slug in Category.objects.values_list('id', 'name', 'slug'):
+            self.categories[name.lower()] = category_id
+            self.categories[slug] = category_id
+        self.attributes = {
+            name.lower(): attribute_id for attribute_id, name in ProductAttribute.objects.values_list('id', 'name')
+        }
+        self.attribute_values = {
+            (attribute_id, value.lower()): value_id
+            for value_id, attribute_id, value in ProductAttributeValue.objects.values_list('id', 'attribute', 'value')
+        }
+        self.stats = {'created': 0, 'updated': 0, 'variants': 0, 'images': 0, 'errors': 0}
+        self.errors = []
+
+    def run(self, records):
+        """Import `records` ((line number, record) pairs, see read_csv/read_jsonl). Returns the stats."""
+        chunk = {}
+        for number, record in records:
+            try:
+                if isinstance(record, ImportRowError):
+                    raise record
+                product = self.clean(record)
+            except ImportRowError as exc:
+                self.error(number, exc)
+                continue
+            # Within a chunk the last row for a SKU wins; an upsert can't touch a row twice
+            chunk.pop(product['sku'], None)
+            chunk[product['sku']] = product
+            if len(chunk) >= self.chunk_size:
+                self.write(list(chunk.values()))
+                chunk = {}
+        if chunk:
+            self.write(list(chunk.values()))
+        if self.stats['created'] or self.stats['updated']:
+            bump_catalog_version()
+        return self.stats
+
+    def error(self, number, exc):
+        self.stats['errors'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((number, str(exc)))
+
+    def clean(self, record):
+        """Validate and convert one product record, resolving its category"""
+        category = record.get('category')
+        category_id = None
+        if category not in (None, ''):
+            # By name (case-insensitively) or slug
+            category_id = self.categories.get(str(category).strip().lower())
+            if category_id is None:
+                raise ImportRowError(f"Unknown category {category!r}.")
+        inventory = _count(record.get('inventory'), 'inventory')
+        images = record.get('images')
+        if images is not None and not isinstance(images, list):
+            raise ImportRowError("images must be a list.")
+        variants = record.get('variants') or []
+        if not isinstance(variants, list):
+            raise ImportRowError("variants must be a list.")
+        return {
+            'sku': _max_length(_required(record, 'sku'), 'sku', Product),
+            'name': _max_length(_required(record, 'name'), 'name', Product),
+            'description': str(record.get('description') or ''),
+            'price': _decimal(_required(record, 'price'), 'price'),
+            'compare_price': _decimal(record.get('compare_price'), 'compare_price'),
+            'category_id': category_id,
+            'inventory': inventory,
+            # None: not in the file
+            'is_available': _bool(record.get('is_available'), 'is_available', None),
+            'is_featured': _bool(record.get('is_featured'), 'is_featured', False),
+            'images': None if images is None else [str(image) for image in images if image],
+            'variants': [self.clean_variant(variant) for variant in variants],
+        }
+
+    def clean_variant(self, variant):
+        if not isinstance(variant, dict):
+            raise ImportRowError("Each variant must be an object.")
+        attributes = variant.get('attributes') or {}
+        if not isinstance(attributes, dict):
+            raise ImportRowError("Variant attributes must be an object.")
+        sku = _max_length(_required(variant, 'sku'), 'sku', ProductVariant)
+        return {
+            'sku': sku,
+            'name': _max_length(str(variant.get('name') or sku), 'name', ProductVariant),
+            'price_adjustment': _decimal(variant.get('price_adjustment'), 'price_adjustment', Decimal('0')),
+            'inventory': _count(variant.get('inventory'), 'variant inventory'),
+            'is_available': _bool(variant.get('is_available'), 'variant is_available', None),
+            'attributes': {
+                _max_length(str(name), 'name', ProductAttribute): _max_length(str(value), 'value', ProductAttributeValue)
+                for name, value in attributes.items() if str(name).strip() and str(value).strip()
+            },
+        }
+
+    def set_availability(self, model, availability):
+        """Write `availability` ({sku: True, False or None to keep the stored value}), one UPDATE per value"""
+        for value in (True, False):
+            skus = [sku for sku, available in availability.items() if available is value]
+            if skus:
+                model.objects.filter(sku__in=skus).update(is_available=value)
+
+    @transaction.atomic
+    def write(self, products):
+        product_ids = self.upsert_products(products)
+        self.upsert_variants(products, product_ids)
+        self.replace_images(products, product_ids)
+
+    def unique_slugs(self, products):
+        """
+        Slugs for products that don't exist yet, avoiding existing slugs and
+        each other: the name's slug, then with the SKU appended, then with a
+        counter after that. One query per round; clashes are rare.
+        """
+        bases = {product['sku']: slugify(product['name'])[:200] or slugify(product['sku']) or 'product'
+                 for product in products}
+        slugs = dict(bases)
+        attempts = dict.fromkeys(bases, 0)
+        while True:
+            taken = set(Product.objects.filter(slug__in=slugs.values()).values_list('slug', flat=True))
+            clashes = []
+            for sku, slug in slugs.items():
+                if slug in taken:
+                    clashes.append(sku)
+                taken.add(slug)
+            if not clashes:
+                return slugs
+            for sku in clashes:
+                attempts[sku] += 1
+                slug = f"{bases[sku]}-{slugify(sku)}"[:240]
+                slugs[sku] = slug if attempts[sku] == 1 else f"{slug}-{attempts[sku]}"
+
+    def upsert_products(self, products):
+        existing = set(Product.objects.filter(sku__in=[product['sku'] for product in products]).values_list(
+            'sku', flat=True
+        ))
+        slugs = self.unique_slugs([product for product in products if product['sku'] not in existing])
+        rows = [
+            Product(
+                sku=product['sku'],
+                # Only used when the product is new; existing products keep their URL
+                slug=slugs.get(product['sku'], ''),
+                name=product['name'],
+                description=product['description'],
+                price=product['price'],
+                compare_price=product['compare_price'],
+                category_id=product['category_id'],
+                inventory=product['inventory'],
+                # Only used when the product is new, see set_availability()
+                is_available=product['is_available'] is not False and product['inventory'] > 0,
+                is_featured=product['is_featured'],
+            )
+            for product in products
+        ]
+        Product.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['sku'], update_fields=PRODUCT_UPDATE_FIELDS
+        )
+        # Same rule as the check_product_availability signal: out of stock is
+        # never available, but back in stock doesn't switch a product on
+        self.set_availability(Product, {
+            product['sku']: False if product['inventory'] == 0 else product['is_available']
+            for product in products if product['sku'] in existing
+        })
+        self.stats['created'] += len(products) - len(existing)
+        self.stats['updated'] += len(existing)
+        return {row.sku: row.pk for row in rows}
+
+    def resolve_attribute_values(self, variants):
+        """Ids of the attribute values `variants` use, creating missing attributes and values"""
+        names = {name for variant in variants for name in variant['attributes']}
+        missing = {name.lower(): name for name in names if name.lower() not in self.attributes}
+        for attribute in ProductAttribute.objects.bulk_create([ProductAttribute(name=name) for name in missing.values()]):
+            self.attributes[attribute.name.lower()] = attribute.id
+
+        pairs = {
+            (self.attributes[name.lower()], value)
+            for variant in variants for name, value in variant['attributes'].items()
+        }
+        missing = {(attribute_id, value.lower()): value for attribute_id, value in pairs
+                   if (attribute_id, value.lower()) not in self.attribute_values}
+        created = ProductAttributeValue.objects.bulk_create([
+            ProductAttributeValue(attribute_id=attribute_id, value=value)
+            for (attribute_id, _), value in missing.items()
+        ])
+        for value in created:
+            self.attribute_values[(value.attribute_id, value.value.lower())] = value.id
+
+    def upsert_variants(self, products, product_ids):
+        variants = {}
+        for product in products:
+            for variant in product['variants']:
+                variants[variant['sku']] = (product_ids[product['sku']], variant)
+        if not variants:
+            return
+        existing = set(ProductVariant.objects.filter(sku__in=variants).values_list('sku', flat=True))
+        rows = [
+            ProductVariant(
+                product_id=product_id,
+                sku=variant['sku'],
+                name=variant['name'],
+                price_adjustment=variant['price_adjustment'],
+                inventory=variant['inventory'],
+                is_available=variant['is_available'] is not False,
+            )
+            for product_id, variant in variants.values()
+        ]
+        ProductVariant.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['sku'], update_fields=VARIANT_UPDATE_FIELDS
+        )
+        self.set_availability(ProductVariant, {
+            sku: variant['is_available'] for sku, (_, variant) in variants.items() if sku in existing
+        })
+        self.stats['variants'] += len(rows)
+
+        # A variant's attributes are replaced by the ones in the file
+        self.resolve_attribute_values([variant for _, variant in variants.values()])
+        variant_ids = {row.sku: row.pk for row in rows}
+        VariantAttributeValue.objects.filter(variant_id__in=variant_ids.values()).delete()
+        VariantAttributeValue.objects.bulk_create([
+            VariantAttributeValue(
+                variant_id=variant_ids[sku],
+                attribute_value_id=self.attribute_values[(self.attributes[name.lower()], value.lower())],
+            )
+            for sku, (_, variant) in variants.items()
+            for name, value in variant['attributes'].items()
+        ], ignore_conflicts=True)
+
+    def replace_images(self, products, product_ids):
+        """Replace the images of products whose record lists them; the first becomes the primary one"""
+        with_images = [product for product in products if product['images'] is not None]
+        if not with_images:
+            return
+        ProductImage.objects.filter(product_id__in=[product_ids[product['sku']] for product in with_images]).delete()
+        images = ProductImage.objects.bulk_create([
+            ProductImage(product_id=product_ids[product['sku']], image=image, is_primary=index == 0)
+            for product in with_images
+            for index, image in enumerate(product['images'])
+        ])
+        self.stats['images'] += len(images)
+
+
+def import_catalog(stream, file_format, chunk_size=None):
+    """Import a CSV or JSON Lines text stream. Returns the CatalogImporter, with its stats and errors."""
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format!r}; expected one of {', '.join(FORMATS)}.")
+    reader = read_csv if file_format == 'csv' else read_jsonl
+    importer = CatalogImporter(chunk_size)
+    importer.run(reader(stream))
+    return importer
@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from django.contrib.postgres.search import SearchRank
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, Q
+from apps.products.models import Product
+from apps.products.search import build_search_query
+
+VOCABULARY = [
+    'wireless', 'laptop', 'gaming', 'mouse', 'keyboard', 'monitor', 'ultra', 'slim', 'pro', 'max',
+    'portable', 'speaker', 'headphones', 'charger', 'cable', 'stand', 'backpack', 'camera', 'lens',
+    'tripod', 'phone', 'case', 'screen', 'protector', 'watch', 'band', 'tablet', 'stylus', 'router',
+    'adapter', 'drive', 'memory', 'card', 'printer', 'ink', 'desk', 'lamp', 'chair', 'ergonomic',
+    'mechanical', 'bluetooth', 'usb', 'hdmi', 'black', 'white', 'silver', 'compact', 'travel', 'smart',
+]
+
+# Names and descriptions are random picks from VOCABULARY; the `g > 0`
+# references make Postgres draw new words for every row
+GENERATE_SQL = """
+    INSERT INTO products_product (
+        name, slug, sku, description, price, inventory, is_available, is_featured,
+        rating_count, rating_sum, average_rating, created_at, updated_at
+    )
+    SELECT
+        name.text, 'search-bench-' || g, 'SB-' || g, description.text,
+        round((random() * 1000)::numeric, 2), 10, true, false, 0, 0, 0,
+        now() - g * interval '1 second', now()
+    FROM generate_series(1, %(products)s) AS g
+    CROSS JOIN LATERAL (
+        SELECT string_agg(word, ' ') AS text
+        FROM (SELECT word FROM unnest(%(words)s::text[]) AS word WHERE g > 0 ORDER BY random() LIMIT 3) AS picked
+    ) AS name
+    CROSS JOIN LATERAL (
+        SELECT string_agg(word, ' ') AS text
+        FROM (SELECT word FROM unnest(%(words)s::text[]) AS word WHERE g > 0 ORDER BY random() LIMIT 25) AS picked
+    ) AS description
+"""
+
+DEFAULT_TERMS = ['laptop', 'wireless mouse', 'ergo', 'sb-4242', 'bluetooth speaker black']
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the old icontains search with full-text search on a synthetic catalog. "
+        "The synthetic products are rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000, help="Synthetic products to generate")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per query; the median is reported")
+        parser.add_argument('--term', action='append', dest='terms', default=[], help="Search text (may be repeated)")
+        parser.add_argument('--keep', action='store_true', help="Commit the synthetic products")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['products']:
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute(GENERATE_SQL, {'products': options['products'], 'words': VOCABULARY})
+                    cursor.execute("ANALYZE products_product")
+                self.stdout.write(
+                    f"Generated {options['products']} products in {time.perf_counter() - started:.1f}s"
+                )
+
+            for term in options['terms'] or DEFAULT_TERMS:
+                old = self.measure(self.icontains_page, term, options['repeat'])
+                new = self.measure(self.full_text_page, term, options['repeat'])
+                self.stdout.write(
+                    f"{term!r}: icontains {old * 1000:.1f} ms, full-text {new * 1000:.1f} ms "
+                    f"({old / new if new else float('inf'):.1f}x)"
+                )
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def measure(self, page, term, repeat):
+        """Median wall time of what the paginated product list runs: a count and the first page"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = page(term)
+            queryset.count()
+            list(queryset[:20])
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+
+    def icontains_page(self, term):
+        # What DRF's SearchFilter with search_fields = ['name', 'description', 'sku'] generated
+        condition = Q()
+        for word in term.split():
+            condition &= Q(name__icontains=word) | Q(description__icontains=word) | Q(sku__icontains=word)
+        return Product.objects.filter(condition).order_by('-created_at')
+
+    def full_text_page(self, term):
+        query = build_search_query(term)
+        return Product.objects.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-created_at', '-id')
@@ -0,0 +1,48 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.products.importer import FORMATS, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products (matched on SKU), their variants, attribute values and "
+        "images from a CSV or JSON Lines file. See apps/products/importer.py for the format."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input")
+        parser.add_argument('--format', choices=FORMATS, help="File format (default: from the file extension)")
+        parser.add_argument('--chunk-size', type=int, help="Products written per transaction")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = options['format'] or detect_format(path)
+        except ValueError as exc:
+            raise CommandError(f"{exc} Pass --format.")
+
+        started = time.monotonic()
+        if path == '-':
+            importer = import_catalog(sys.stdin, file_format, options['chunk_size'])
+        else:
+            try:
+                stream = open(path, encoding='utf-8-sig', newline='')
+            except OSError as exc:
+                raise CommandError(exc)
+            with stream:
+                importer = import_catalog(stream, file_format, options['chunk_size'])
+        elapsed = time.monotonic() - started
+
+        for number, message in importer.errors:
+            self.stderr.write(f"Line {number}: {message}")
+        stats = importer.stats
+        if stats['errors'] > len(importer.errors):
+            self.stderr.write(f"... and {stats['errors'] - len(importer.errors)} more errors")
+        rows = stats['created'] + stats['updated']
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {rows} products ({stats['created']} new, {stats['updated']} updated), "
+            f"{stats['variants']} variants and {stats['images']} images in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else rows:.0f} products/s); {stats['errors']} rows skipped."
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from apps.products.cache import bump_catalog_version
+from apps.products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized product rating aggregates from approved reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', action='append', dest='products', default=[],
+                            help="Only rebuild the product with this slug (may be repeated)")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['products']:
+            products = products.filter(slug__in=options['products'])
+
+        updated = products.recalculate_ratings()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings for {updated} products."))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:29
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    ProductReview = apps.get_model("products", "ProductReview")
+    approved = (
+        ProductReview.objects.filter(product=OuterRef("pk"), is_approved=True)
+        .order_by()
+        .values("product")
+    )
+    Product.objects.update(
+        rating_count=Coalesce(
+            Subquery(approved.annotate(count=Count("id")).values("count")), 0
+        ),
+        rating_sum=Coalesce(
+            Subquery(approved.annotate(total=Sum("rating")).values("total")), 0
+        ),
+        average_rating=Coalesce(
+            Subquery(approved.annotate(average=Avg("rating")).values("average")),
+            Value(0),
+            output_field=models.DecimalField(max_digits=3, decimal_places=1),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="average_rating",
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
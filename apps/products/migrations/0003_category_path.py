@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model("products", "Category")
+    categories = {category.pk: category for category in Category.objects.all()}
+
+    def path_of(category, seen=()):
+        if category.parent_id is None or category.parent_id in seen:
+            return f"{category.pk}/"
+        parent = categories[category.parent_id]
+        return path_of(parent, seen + (category.pk,)) + f"{category.pk}/"
+
+    for category in categories.values():
+        category.path = path_of(category)
+        category.depth = category.path.count("/") - 1
+    Category.objects.bulk_update(categories.values(), ["path", "depth"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0002_product_rating_aggregates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:50
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, but it doesn't
+    # block writes to these tables while the indexes are built
+    atomic = False
+
+    dependencies = [
+        ("products", "0005_product_trigram_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="product",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="product_created_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="product",
+            index=models.Index(fields=["price", "id"], name="product_price_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_available", True)),
+                fields=["inventory"],
+                name="product_available_stock_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="productimage",
+            index=models.Index(
+                condition=models.Q(("is_primary", True)),
+                fields=["product"],
+                name="productimage_primary_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="productreview",
+            index=models.Index(
+                condition=models.Q(("is_approved", True)),
+                fields=["product", "-created_at", "-id"],
+                name="review_approved_feed_idx",
+            ),
+        ),
+    ]
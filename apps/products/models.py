@@ -1,6 +1,13 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import (
+    Avg, Case, Count, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Cast, Coalesce, Concat, Substr, Upper
 from django.utils.text import slugify
 from django.conf import settings
+from django.core.exceptions import ValidationError
 
 
 class Category(models.Model):
@@ -10,6 +17,10 @@ class Category(models.Model):
     parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='children')
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    # Materialized path of ancestor ids including this one, e.g. "1/4/9/", so a
+    # whole subtree is a single indexed `path LIKE '1/4/%'` lookup
+    path = models.CharField(max_length=255, db_index=True, editable=False, blank=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -17,14 +28,67 @@ class Category(models.Model):
         verbose_name_plural = 'Categories'
         ordering = ('name',)
 
+    MOVE_UNDER_SUBTREE_ERROR = "A category cannot be moved under itself or one of its subcategories."
+
     def __str__(self):
         return self.name
 
+    def contains(self, category):
+        """Whether `category` is this category or one of its subcategories"""
+        return bool(self.path) and category.path.startswith(self.path)
+
+    def clean(self):
+        if self.parent_id and self.contains(self.parent):
+            raise ValidationError({'parent': self.MOVE_UNDER_SUBTREE_ERROR})
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+            if self.path and parent_path.startswith(self.path):
+                raise ValueError(self.MOVE_UNDER_SUBTREE_ERROR)
+
         super().save(*args, **kwargs)
 
+        path = f"{parent_path}{self.pk}/"
+        if path != self.path:
+            old_path, old_depth = self.path, self.depth
+            self.path, self.depth = path, path.count('/') - 1
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            if old_path:
+                # Move the subtree along with this category
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth)
+                )
+
+    def get_descendants(self, include_self=True):
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+
+class ProductQuerySet(models.QuerySet):
+    def recalculate_ratings(self):
+        """Rebuild the denormalized rating aggregates from approved reviews in one UPDATE"""
+        approved = ProductReview.objects.filter(
+            product=OuterRef('pk'),
+            is_approved=True
+        ).order_by().values('product')
+        return self.update(
+            rating_count=Coalesce(Subquery(approved.annotate(count=Count('id')).values('count')), 0),
+            rating_sum=Coalesce(Subquery(approved.annotate(total=Sum('rating')).values('total')), 0),
+            average_rating=Coalesce(
+                Subquery(approved.annotate(average=Avg('rating')).values('average')),
+                Value(0),
+                output_field=DecimalField(max_digits=3, decimal_places=1)
+            ),
+        )
+
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
@@ -37,11 +101,31 @@ class Product(models.Model):
     inventory = models.PositiveIntegerField(default=0)
     is_available = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
+    # Denormalized from approved reviews, see ProductReview signals
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=1, default=0)
+    # Weighted name/sku/description tsvector, maintained by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            # Trigram indexes for autocomplete: fuzzy word matches on the name and
+            # case-insensitive prefix matches (`UPPER(sku) LIKE 'AB%'`) on the SKU
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='product_name_trgm'),
+            GinIndex(OpClass(Upper('sku'), name='gin_trgm_ops'), name='product_sku_upper_trgm'),
+            # Default and price orderings of the product list, with the keyset tiebreaker
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            # Low-stock reports only ever look at products on sale
+            models.Index(fields=['inventory'], condition=Q(is_available=True), name='product_available_stock_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -51,6 +135,29 @@ class Product(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def adjust_rating(cls, product_id, count_delta, sum_delta):
+        """Apply an incremental change to a product's rating aggregates in a single UPDATE"""
+        if not count_delta and not sum_delta:
+            return
+        new_count = F('rating_count') + count_delta
+        new_sum = F('rating_sum') + sum_delta
+        cls.objects.filter(pk=product_id).update(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            average_rating=Case(
+                When(
+                    rating_count__gt=-count_delta,
+                    then=ExpressionWrapper(
+                        Cast(new_sum, DecimalField(max_digits=12, decimal_places=2)) / new_count,
+                        output_field=DecimalField(max_digits=3, decimal_places=1)
+                    )
+                ),
+                default=Value(0),
+                output_field=DecimalField(max_digits=3, decimal_places=1)
+            ),
+        )
+
     @property
     def discount_percentage(self):
         if self.compare_price and self.compare_price > self.price:
@@ -67,6 +174,10 @@ class ProductImage(models.Model):
 
     class Meta:
         ordering = ('-is_primary', 'created_at')
+        indexes = [
+            # Primary image prefetches for product summaries
+            models.Index(fields=['product'], condition=Q(is_primary=True), name='productimage_primary_idx'),
+        ]
 
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -126,6 +237,14 @@ class ProductReview(models.Model):
     class Meta:
         unique_together = ('product', 'user')
         ordering = ('-created_at',)
+        indexes = [
+            # The approved-review feed (ReviewPagination ordering) and its preview
+            models.Index(
+                fields=['product', '-created_at', '-id'],
+                condition=Q(is_approved=True),
+                name='review_approved_feed_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Review by {self.user.username} for {self.product.name}"
\ No newline at end of file
@@ -0,0 +1,117 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, F, FloatField, Prefetch, Q, Value, When
+from django.db.models.functions import Greatest
+from rest_framework import filters
+
+from .cache import get_catalog_version
+from .models import Product, ProductImage
+
+# Must match the configuration used by the products_product_search_vector
+# trigger (see migration 0004_product_search_vector)
+SEARCH_CONFIG = 'english'
+
+
+def build_search_query(text, prefix=True):
+    """
+    Turn free text into a tsquery that requires every word, each matched as a
+    prefix (``lapt`` finds ``laptop``) so the same query serves typeahead.
+    Only word characters survive, so user input can't inject tsquery syntax.
+    """
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    suffix = ':*' if prefix else ''
+    return SearchQuery(' & '.join(f"{term}{suffix}" for term in terms), search_type='raw', config=SEARCH_CONFIG)
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    Full-text product search against the GIN-indexed `search_vector` column,
+    which weights name over SKU over description.
+
+    Results are ranked by relevance unless the client asked for an explicit
+    `ordering`, so this backend must come after OrderingFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = build_search_query(' '.join(self.get_search_terms(request)))
+        if query is None:
+            return queryset
+
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+        if not request.query_params.get(filters.OrderingFilter.ordering_param):
+            queryset = queryset.order_by('-search_rank', '-created_at', '-id')
+        return queryset
+
+
+AUTOCOMPLETE_MIN_LENGTH = 2
+AUTOCOMPLETE_MAX_LENGTH = 100
+AUTOCOMPLETE_LIMIT = 10
+
+
+def normalize_autocomplete_text(text):
+    """Lowercase and collapse whitespace so "Lap " and "lap" share a cache entry"""
+    return ' '.join(text.lower().split())[:AUTOCOMPLETE_MAX_LENGTH]
+
+
+def autocomplete_queryset(text):
+    """
+    Available products with a word in their name similar to `text` (pg_trgm's
+    `%>`, so "gamng" finds "Gaming Laptop") or a SKU starting with it. SKU
+    prefix hits rank first, then names by word similarity. Both conditions are
+    served by the trigram indexes from migration 0005_product_trigram_indexes.
+    """
+    similarity = Greatest(
+        TrigramWordSimilarity(text, 'name'),
+        Case(When(sku__istartswith=text, then=Value(1.0)), default=Value(0.0), output_field=FloatField()),
+    )
+    return Product.objects.filter(
+        Q(name__trigram_word_similar=text) | Q(sku__istartswith=text),
+        is_available=True,
+    ).annotate(similarity=similarity).order_by('-similarity', 'name', 'id').prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.filter(is_primary=True), to_attr='primary_images')
+    )[:AUTOCOMPLETE_LIMIT]
+
+
+def get_autocomplete_suggestions(text, serializer_class):
+    """
+    Serialized suggestions for normalized `text`, or None if the lookup ran
+    past PRODUCT_AUTOCOMPLETE_TIMEOUT_MS.
+
+    Popular prefixes are answered from the shared cache for
+    PRODUCT_AUTOCOMPLETE_CACHE_TIMEOUT seconds (0 disables). Entries are keyed
+    by the catalog version like every other catalog cache entry, so a catalog
+    change retires them immediately. Timed-out lookups are not cached.
+    """
+    timeout = settings.PRODUCT_AUTOCOMPLETE_CACHE_TIMEOUT
+    key = None
+    if timeout:
+        digest = hashlib.md5(text.encode('utf-8')).hexdigest()
+        key = f"catalog:v{get_catalog_version()}:autocomplete:{digest}"
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL statement_timeout = {int(settings.PRODUCT_AUTOCOMPLETE_TIMEOUT_MS)}")
+            data = serializer_class(autocomplete_queryset(text), many=True).data
+            # Nothing was written; rolling back also ends the SET LOCAL when
+            # this block is nested in an outer transaction
+            transaction.set_rollback(True)
+    except OperationalError:
+        # Cancelled by statement_timeout
+        return None
+
+    if key:
+        cache.set(key, data, timeout=timeout)
+    return data
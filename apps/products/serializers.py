@@ -19,6 +19,11 @@ class CategorySerializer(serializers.ModelSerializer):
             'slug': {'read_only': True},
         }
 
+    def validate_parent(self, value):
+        if value is not None and self.instance is not None and self.instance.contains(value):
+            raise serializers.ValidationError(Category.MOVE_UNDER_SUBTREE_ERROR)
+        return value
+
 
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -73,6 +78,7 @@ class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     primary_image = serializers.SerializerMethodField()
     discount_percentage = serializers.IntegerField(read_only=True)
+    average_rating = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Product
@@ -81,33 +87,76 @@ class ProductSerializer(serializers.ModelSerializer):
             'compare_price', 'discount_percentage', 'category',
             'category_name', 'inventory', 'is_available',
             'is_featured', 'primary_image', 'images',
+            'average_rating', 'rating_count',
             'created_at', 'updated_at'
         ]
         extra_kwargs = {
             'slug': {'read_only': True},
+            'rating_count': {'read_only': True},
         }
 
     def get_primary_image(self, obj):
-        primary_image = obj.images.filter(is_primary=True).first()
-        if primary_image:
-            return ProductImageSerializer(primary_image).data
+        # Derived from the (prefetched) image set rather than a separate query;
+        # images are ordered primary-first.
+        for image in obj.images.all():
+            if image.is_primary:
+                return ProductImageSerializer(image).data
         return None
 
 
+class ProductSummarySerializer(serializers.ModelSerializer):
+    """Compact read-only product representation for embedding in other payloads"""
+    primary_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'slug', 'sku', 'price', 'compare_price', 'is_available', 'primary_image']
+        read_only_fields = fields
+
+    def get_primary_image(self, obj):
+        # Callers may prefetch just the primary image into `primary_images`
+        images = getattr(obj, 'primary_images', None)
+        if images is None:
+            images = [image for image in obj.images.all() if image.is_primary]
+        if images:
+            return ProductImageSerializer(images[0]).data
+        return None
+
+
+class ProductAutocompleteSerializer(serializers.ModelSerializer):
+    """Just enough to render a typeahead suggestion"""
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'slug', 'thumbnail']
+        read_only_fields = fields
+
+    def get_thumbnail(self, obj):
+        # The primary image, prefetched into `primary_images` by autocomplete_queryset
+        images = obj.primary_images
+        return images[0].image.url if images else None
+
+
 class ProductDetailSerializer(ProductSerializer):
+    """
+    Only the newest approved reviews are embedded; `rating_count` holds the
+    total and the rest are served by the paginated `reviews` endpoint.
+    """
+    REVIEW_PREVIEW_SIZE = 5
+
     variants = ProductVariantSerializer(many=True, read_only=True)
     reviews = serializers.SerializerMethodField()
-    average_rating = serializers.SerializerMethodField()
 
     class Meta(ProductSerializer.Meta):
-        fields = ProductSerializer.Meta.fields + ['variants', 'reviews', 'average_rating']
+        fields = ProductSerializer.Meta.fields + ['variants', 'reviews']
 
     def get_reviews(self, obj):
-        reviews = obj.reviews.filter(is_approved=True)
-        return ProductReviewSerializer(reviews, many=True).data
-
-    def get_average_rating(self, obj):
-        reviews = obj.reviews.filter(is_approved=True)
-        if reviews.exists():
-            return round(sum(review.rating for review in reviews) / reviews.count(), 1)
-        return 0
\ No newline at end of file
+        # ProductViewSet prefetches the preview into `approved_reviews`
+        if hasattr(obj, 'approved_reviews'):
+            reviews = obj.approved_reviews
+        else:
+            reviews = obj.reviews.filter(is_approved=True).select_related('user').order_by(
+                '-created_at', '-id'
+            )[:self.REVIEW_PREVIEW_SIZE]
+        return ProductReviewSerializer(reviews, many=True).data
\ No newline at end of file
@@ -1,6 +1,42 @@
-from django.db.models.signals import post_save, pre_delete
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Length, Replace, StrIndex, Substr
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
-from .models import ProductImage, ProductReview, Product
+from .cache import bump_catalog_version
+from .models import (
+    Category,
+    Product,
+    ProductImage,
+    ProductVariant,
+    ProductAttribute,
+    ProductAttributeValue,
+    VariantAttributeValue,
+    ProductReview
+)
+
+# Everything that appears in a cached catalog response; reviews only do once
+# approved, see invalidate_for_review()
+CATALOG_MODELS = (
+    Category,
+    Product,
+    ProductImage,
+    ProductVariant,
+    ProductAttribute,
+    ProductAttributeValue,
+    VariantAttributeValue,
+)
+
+
+def invalidate_catalog_cache(sender, **kwargs):
+    """Retire every cached catalog response once the change is committed"""
+    transaction.on_commit(bump_catalog_version)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_catalog_cache, sender=model, dispatch_uid=f'catalog_cache_save_{model.__name__}')
+    post_delete.connect(invalidate_catalog_cache, sender=model, dispatch_uid=f'catalog_cache_delete_{model.__name__}')
+
 
 @receiver(post_save, sender=ProductImage)
 def set_primary_image(sender, instance, created, **kwargs):
@@ -16,12 +52,43 @@ def set_primary_image(sender, instance, created, **kwargs):
         instance.is_primary = True
         instance.save(update_fields=['is_primary'])
 
+def invalidate_for_review(review, previous=None):
+    """Only approved reviews are served, so pending ones leave the catalog cache alone"""
+    if review.is_approved or (previous and previous['is_approved']):
+        invalidate_catalog_cache(ProductReview)
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_review_rating(sender, instance, **kwargs):
+    """Remember what the review contributed to its product's rating before this save"""
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = ProductReview.objects.filter(pk=instance.pk).values(
+            'product_id', 'rating', 'is_approved'
+        ).first()
+
+
 @receiver(post_save, sender=ProductReview)
 def update_product_rating(sender, instance, **kwargs):
-    """Update product's average rating when a new review is added or a review is updated"""
-    # We'll actually implement this using a property in the Product model
-    # to calculate average rating on the fly, so this is a placeholder
-    pass
+    """Incrementally update the product's rating aggregates when a review is added, approved or edited"""
+    previous = getattr(instance, '_previous_rating', None)
+    invalidate_for_review(instance, previous)
+    if previous and previous['is_approved']:
+        if previous['product_id'] == instance.product_id and instance.is_approved:
+            # Still counted against the same product, only the score may have changed
+            Product.adjust_rating(instance.product_id, 0, instance.rating - previous['rating'])
+            return
+        Product.adjust_rating(previous['product_id'], -1, -previous['rating'])
+    if instance.is_approved:
+        Product.adjust_rating(instance.product_id, 1, instance.rating)
+
+
+@receiver(post_delete, sender=ProductReview)
+def remove_product_rating(sender, instance, **kwargs):
+    """Take a deleted review out of its product's rating aggregates"""
+    invalidate_for_review(instance)
+    if instance.is_approved:
+        Product.adjust_rating(instance.product_id, -1, -instance.rating)
 
 @receiver(post_save, sender=Product)
 def check_product_availability(sender, instance, **kwargs):
@@ -36,4 +103,21 @@ def check_product_availability(sender, instance, **kwargs):
         # Uncomment if this behavior is desired
         # instance.is_available = True
         # instance.save(update_fields=['is_available'])
-        pass
\ No newline at end of file
+        pass
+
+@receiver(post_delete, sender=Category)
+def reroot_subcategories(sender, instance, **kwargs):
+    """
+    Children of a deleted category become top-level (parent is SET_NULL), so
+    strip everything up to the deleted category's id from the paths below it.
+    Matched by id rather than by the deleted row's path, which is stale when
+    an ancestor was deleted in the same queryset delete.
+    """
+    segment = f"/{instance.pk}/"
+    # Paths with a leading "/", so the first id is delimited like the others
+    delimited = Concat(Value('/'), 'path')
+    path = Substr('path', StrIndex(delimited, Value(segment)) + len(segment) - 1)
+    Category.objects.alias(delimited=delimited).filter(delimited__contains=segment).update(
+        path=path,
+        depth=Length(path) - Length(Replace(path, Value('/'), Value(''))) - 1
+    )
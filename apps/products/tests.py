@@ -1,3 +1,823 @@
-from django.test import TestCase
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle
 
-# Create your tests here.
+from .admin import ProductReviewAdmin
+from .cache import LocalCache, bump_catalog_version, catalog_objects, get_catalog_version
+from .importer import import_catalog
+from .models import (
+    Category,
+    Product,
+    ProductImage,
+    ProductVariant,
+    ProductAttribute,
+    ProductAttributeValue,
+    VariantAttributeValue,
+    ProductReview
+)
+
+User = get_user_model()
+
+
+def create_product(category, index, images=2, variants=0):
+    product = Product.objects.create(
+        name=f"Product {index}",
+        sku=f"SKU-{index}",
+        description="Description",
+        price=10,
+        category=category,
+        inventory=10,
+    )
+    for image_index in range(images):
+        ProductImage.objects.create(
+            product=product,
+            image=f"products/{index}-{image_index}.jpg",
+            is_primary=image_index == 0,
+        )
+    for variant_index in range(variants):
+        ProductVariant.objects.create(
+            product=product,
+            name=f"Variant {variant_index}",
+            sku=f"SKU-{index}-{variant_index}",
+            inventory=5,
+        )
+    return product
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductQueryBudgetTests(APITestCase):
+    """
+    The catalog endpoints must run in a fixed number of queries, independent
+    of how many products, images, variants or reviews are returned.
+    """
+
+    LIST_QUERIES = 3      # count, products + category, images
+    RETRIEVE_QUERIES = 5  # product + category, images, variants, variant attributes, reviews + users
+    RELATED_QUERIES = 4   # product + category, its images, related products, their images
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Electronics")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_list_query_count_is_constant(self):
+        for index in range(3):
+            create_product(self.category, index)
+        small, _ = self.count_queries('/api/v1/products/')
+
+        for index in range(3, 20):
+            create_product(self.category, index)
+        large, response = self.count_queries('/api/v1/products/')
+
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.LIST_QUERIES)
+
+    def test_list_primary_image_derived_from_images(self):
+        create_product(self.category, 1, images=3)
+        _, response = self.count_queries('/api/v1/products/')
+
+        result = response.data['results'][0]
+        self.assertEqual(len(result['images']), 3)
+        self.assertTrue(result['primary_image']['is_primary'])
+        self.assertEqual(result['primary_image']['id'], result['images'][0]['id'])
+
+    def test_retrieve_query_count_is_constant(self):
+        attribute = ProductAttribute.objects.create(name="Color")
+        value = ProductAttributeValue.objects.create(attribute=attribute, value="Red")
+        product = create_product(self.category, 1, images=4, variants=3)
+        for variant in product.variants.all():
+            VariantAttributeValue.objects.create(variant=variant, attribute_value=value)
+        for index in range(5):
+            user = User.objects.create_user(email=f"user{index}@example.com", username=f"user{index}")
+            ProductReview.objects.create(
+                product=product, user=user, rating=4, title="Good", comment="Nice", is_approved=True
+            )
+
+        queries, response = self.count_queries(f'/api/v1/products/{product.slug}/')
+
+        self.assertLessEqual(queries, self.RETRIEVE_QUERIES)
+        self.assertEqual(len(response.data['variants']), 3)
+        self.assertEqual(len(response.data['reviews']), 5)
+        self.assertEqual(response.data['average_rating'], 4)
+
+    def test_related_query_count_is_constant(self):
+        product = create_product(self.category, 0)
+        for index in range(1, 10):
+            create_product(self.category, index)
+
+        queries, response = self.count_queries(f'/api/v1/products/{product.slug}/related/')
+
+        self.assertEqual(len(response.data), 4)
+        self.assertLessEqual(queries, self.RELATED_QUERIES)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class RatingAggregateTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Books")
+        self.product = create_product(self.category, 1, images=0)
+        self.users = [
+            User.objects.create_user(email=f"rater{index}@example.com", username=f"rater{index}")
+            for index in range(3)
+        ]
+
+    def review(self, user, rating, is_approved=True, product=None):
+        return ProductReview.objects.create(
+            product=product or self.product, user=user, rating=rating,
+            title="Title", comment="Comment", is_approved=is_approved
+        )
+
+    def assertRating(self, count, total, average, product=None):
+        product = product or self.product
+        product.refresh_from_db()
+        self.assertEqual(product.rating_count, count)
+        self.assertEqual(product.rating_sum, total)
+        self.assertEqual(product.average_rating, Decimal(average))
+
+    def test_approved_reviews_update_aggregates(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        self.review(self.users[2], 1, is_approved=False)
+        self.assertRating(2, 9, '4.5')
+
+    def test_approval_edit_and_delete(self):
+        review = self.review(self.users[0], 3, is_approved=False)
+        self.assertRating(0, 0, '0')
+
+        review.is_approved = True
+        review.save()
+        self.assertRating(1, 3, '3')
+
+        review.rating = 5
+        review.save()
+        self.assertRating(1, 5, '5')
+
+        review.is_approved = False
+        review.save()
+        self.assertRating(0, 0, '0')
+
+        review.is_approved = True
+        review.save()
+        review.delete()
+        self.assertRating(0, 0, '0')
+
+    def test_moving_review_between_products(self):
+        other = create_product(self.category, 2, images=0)
+        review = self.review(self.users[0], 4)
+        review.product = other
+        review.save()
+        self.assertRating(0, 0, '0')
+        self.assertRating(1, 4, '4', product=other)
+
+    def test_admin_bulk_approval(self):
+        for index, user in enumerate(self.users):
+            self.review(user, index + 2, is_approved=False)
+        self.review(User.objects.create_user(email="x@example.com", username="x"), 5)
+
+        review_admin = ProductReviewAdmin(ProductReview, AdminSite())
+        review_admin.approve_reviews(None, ProductReview.objects.all())
+
+        self.assertRating(4, 14, '3.5')
+
+    def test_rebuild_command(self):
+        self.review(self.users[0], 2)
+        self.review(self.users[1], 3)
+        Product.objects.update(rating_count=0, rating_sum=0, average_rating=0)
+
+        call_command('rebuild_product_ratings', stdout=StringIO())
+
+        self.assertRating(2, 5, '2.5')
+
+    def test_list_filter_and_ordering_by_rating(self):
+        other = create_product(self.category, 2, images=0)
+        self.review(self.users[0], 2)
+        self.review(self.users[1], 5, product=other)
+
+        response = self.client.get('/api/v1/products/', {'ordering': '-average_rating'})
+        self.assertEqual([item['sku'] for item in response.data['results']], ['SKU-2', 'SKU-1'])
+
+        response = self.client.get('/api/v1/products/', {'average_rating__gte': 4})
+        self.assertEqual([item['sku'] for item in response.data['results']], ['SKU-2'])
+        self.assertEqual(response.data['results'][0]['average_rating'], 5.0)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ReviewFeedTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = create_product(Category.objects.create(name="Games"), 1, images=0)
+        for index in range(25):
+            user = User.objects.create_user(email=f"feed{index}@example.com", username=f"feed{index}")
+            ProductReview.objects.create(
+                product=self.product, user=user, rating=3, title="Title", comment="Comment", is_approved=True
+            )
+        hidden = User.objects.create_user(email="hidden@example.com", username="hidden")
+        ProductReview.objects.create(product=self.product, user=hidden, rating=1, title="Hidden", comment="-")
+        # Identical timestamps force the cursor to rely on the id tiebreaker
+        first = ProductReview.objects.order_by('created_at').first()
+        ProductReview.objects.update(created_at=first.created_at)
+
+    def test_walks_every_review_once(self):
+        url = f'/api/v1/products/{self.product.slug}/reviews/'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(review['id'] for review in response.data['results'])
+            url = response.data['next']
+
+        expected = list(
+            ProductReview.objects.filter(is_approved=True).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_previous_link_returns_previous_page(self):
+        url = f'/api/v1/products/{self.product.slug}/reviews/'
+        first_page = self.client.get(url).data
+        second_page = self.client.get(first_page['next']).data
+        back = self.client.get(second_page['previous']).data
+
+        self.assertEqual(back['results'], first_page['results'])
+        self.assertIsNone(first_page['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'/api/v1/products/{self.product.slug}/reviews/', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail_embeds_preview_and_total(self):
+        response = self.client.get(f'/api/v1/products/{self.product.slug}/')
+        feed = self.client.get(f'/api/v1/products/{self.product.slug}/reviews/')
+
+        self.assertEqual(response.data['rating_count'], 25)
+        self.assertEqual(response.data['reviews'], feed.data['results'][:5])
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=60)
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_objects.clear()
+        self.category = Category.objects.create(name="Toys")
+        self.product = create_product(self.category, 1)
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_repeat_requests_skip_the_database(self):
+        for url in ['/api/v1/products/', f'/api/v1/products/{self.product.slug}/',
+                    f'/api/v1/products/{self.product.slug}/related/', '/api/v1/products/categories/']:
+            cold, first = self.get(url)
+            warm, second = self.get(url)
+            self.assertGreater(cold, 0)
+            self.assertEqual(warm, 0)
+            self.assertEqual(first.data, second.data)
+
+    def test_query_parameter_order_is_normalized(self):
+        self.get('/api/v1/products/?is_available=true&ordering=price')
+        queries, _ = self.get('/api/v1/products/?ordering=price&is_available=true&search=')
+        self.assertEqual(queries, 0)
+
+        queries, _ = self.get('/api/v1/products/?ordering=-price')
+        self.assertGreater(queries, 0)
+
+    def test_catalog_changes_invalidate(self):
+        _, response = self.get(f'/api/v1/products/{self.product.slug}/')
+        self.assertEqual(response.data['price'], '10.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 12
+            self.product.save()
+
+        _, response = self.get(f'/api/v1/products/{self.product.slug}/')
+        self.assertEqual(response.data['price'], '12.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.filter(product=self.product).delete()
+        _, response = self.get(f'/api/v1/products/{self.product.slug}/')
+        self.assertEqual(response.data['images'], [])
+
+    def test_only_approved_reviews_invalidate(self):
+        user = User.objects.create_user(email="reviewer@example.com", username="reviewer")
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            review = ProductReview.objects.create(product=self.product, user=user, rating=4, title="-", comment="-")
+            review.rating = 5
+            review.save()
+        self.assertEqual(get_catalog_version(), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review.is_approved = True
+            review.save()
+        self.assertNotEqual(get_catalog_version(), version)
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_stats_for_admins_only(self):
+        self.get('/api/v1/products/')
+        self.get('/api/v1/products/')
+
+        self.assertEqual(self.client.get('/api/v1/products/cache-stats/').status_code, 401)
+        admin = User.objects.create_user(email="admin@example.com", username="admin", is_admin=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/v1/products/cache-stats/')
+
+        self.assertEqual(response.data['hits'], 1)
+        self.assertEqual(response.data['misses'], 1)
+
+    @override_settings(CATALOG_VERSION_CHECK_MS=0)
+    def test_detail_lookups_served_from_local_tier(self):
+        url = f'/api/v1/products/{self.product.slug}/reviews/'
+        cold, _ = self.get(url)
+        # Drop the shared tier so only the process-local copy is left
+        cache.delete(f"catalog:v{get_catalog_version()}:object:product:lookup:{self.product.slug}")
+        warm, _ = self.get(url)
+        self.assertEqual(warm, cold - 2)  # product and its images come from process memory
+
+        bump_catalog_version()
+        self.assertEqual(self.get(url)[0], cold)
+
+
+class LocalCacheTests(APITestCase):
+    def test_evicts_least_recently_used(self):
+        local = LocalCache(max_size=2, timeout=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+
+        self.assertEqual(local.get('a'), 1)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(len(local), 2)
+
+    def test_entries_expire(self):
+        local = LocalCache(max_size=2, timeout=0)
+        local.set('a', 1)
+        self.assertIsNone(local.get('a'))
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class CategoryTreeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.electronics = Category.objects.create(name="Electronics")
+        self.computers = Category.objects.create(name="Computers", parent=self.electronics)
+        self.laptops = Category.objects.create(name="Laptops", parent=self.computers)
+        self.garden = Category.objects.create(name="Garden")
+
+    def assertPath(self, category, *ancestors):
+        category.refresh_from_db()
+        self.assertEqual(category.path, ''.join(f"{ancestor.pk}/" for ancestor in ancestors + (category,)))
+        self.assertEqual(category.depth, len(ancestors))
+
+    def test_paths_follow_moves_and_deletes(self):
+        self.assertPath(self.laptops, self.electronics, self.computers)
+
+        self.computers.parent = self.garden
+        self.computers.save()
+        self.assertPath(self.computers, self.garden)
+        self.assertPath(self.laptops, self.garden, self.computers)
+
+        self.garden.delete()
+        self.assertPath(self.computers)
+        self.assertPath(self.laptops, self.computers)
+
+    def test_deleting_a_parent_and_child_together(self):
+        # The collector deletes the highest pk first; moving Garden under a
+        # newer parent makes that parent go before its child
+        fences = Category.objects.create(name="Fences", parent=self.garden)
+        paint = Category.objects.create(name="Paint", parent=fences)
+        outdoor = Category.objects.create(name="Outdoor")
+        self.garden.parent = outdoor
+        self.garden.save()
+        Category.objects.filter(pk__in=[outdoor.pk, self.garden.pk]).delete()
+        self.assertPath(fences)
+        self.assertPath(paint, fences)
+
+    def test_cannot_move_under_own_subtree(self):
+        self.electronics.parent = self.laptops
+        with self.assertRaises(ValueError):
+            self.electronics.save()
+
+    def test_api_rejects_move_under_own_subtree(self):
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="secret")
+        self.client.force_authenticate(admin)
+        response = self.client.patch(
+            f'/api/v1/products/categories/{self.electronics.slug}/', {'parent': self.laptops.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.data)
+        self.assertPath(self.electronics)
+
+    def test_tree_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/products/categories/tree/')
+
+        self.assertEqual([node['name'] for node in response.data], ['Electronics', 'Garden'])
+        computers = response.data[0]['children'][0]
+        self.assertEqual(computers['name'], 'Computers')
+        self.assertEqual(computers['children'][0]['name'], 'Laptops')
+
+    def test_category_tree_filter(self):
+        create_product(self.electronics, 1, images=0)
+        create_product(self.laptops, 2, images=0)
+        create_product(self.garden, 3, images=0)
+
+        with CaptureQueriesContext(connection) as filtered:
+            response = self.client.get('/api/v1/products/', {'category_tree': 'electronics'})
+
+        self.assertEqual(sorted(item['sku'] for item in response.data['results']), ['SKU-1', 'SKU-2'])
+        # The product query filters on a constant prefix the path index can serve
+        self.assertTrue(any(f"LIKE '{self.electronics.path}%'" in query['sql'] for query in filtered))
+        response = self.client.get('/api/v1/products/', {'category_tree': 'missing'})
+        self.assertEqual(response.data['results'], [])
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Computers")
+        self.laptop = Product.objects.create(
+            name="Gaming Laptop", sku="GL-100", description="Fast machine", price=1000, category=category, inventory=1
+        )
+        self.bag = Product.objects.create(
+            name="Carry Bag", sku="BAG-7", description="Fits any laptop", price=50, category=category, inventory=1
+        )
+        self.mouse = Product.objects.create(
+            name="Mouse", sku="MS-1", description="Wireless", price=20, category=category, inventory=1
+        )
+
+    def search(self, text, **params):
+        response = self.client.get('/api/v1/products/', dict(params, search=text))
+        self.assertEqual(response.status_code, 200)
+        return [item['sku'] for item in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('laptop'), ['GL-100', 'BAG-7'])
+
+    def test_prefix_and_stemmed_matches(self):
+        self.assertEqual(self.search('lapt'), ['GL-100', 'BAG-7'])
+        self.assertEqual(self.search('gaming laptops'), ['GL-100'])
+
+    def test_sku_match(self):
+        self.assertEqual(self.search('ms-1'), ['MS-1'])
+
+    def test_explicit_ordering_wins(self):
+        self.assertEqual(self.search('laptop', ordering='price'), ['BAG-7', 'GL-100'])
+
+    def test_search_vector_follows_edits(self):
+        self.mouse.name = "Laptop Mouse"
+        self.mouse.save()
+        self.assertEqual(set(self.search('laptop')[:2]), {'GL-100', 'MS-1'})
+
+    def test_punctuation_only_query_is_ignored(self):
+        self.assertEqual(len(self.search('&|!')), 3)
+
+
+class ProductAutocompleteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Computers")
+        self.laptop = Product.objects.create(
+            name="Gaming Laptop", sku="GL-100", description="Fast machine", price=1000, category=category, inventory=1
+        )
+        ProductImage.objects.create(product=self.laptop, image="products/laptop.jpg", is_primary=True)
+        self.bag = Product.objects.create(
+            name="Laptop Bag", sku="BAG-7", description="Fits any laptop", price=50, category=category, inventory=1
+        )
+        self.hidden = Product.objects.create(
+            name="Laptop Stand", sku="LS-1", description="Aluminium", price=30, category=category,
+            inventory=0, is_available=False
+        )
+
+    def autocomplete(self, text):
+        response = self.client.get('/api/v1/products/autocomplete/', {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_returns_compact_suggestions(self):
+        data = self.autocomplete('gaming').data
+        self.assertEqual(len(data), 1)
+        self.assertEqual(set(data[0]), {'id', 'name', 'slug', 'thumbnail'})
+        self.assertEqual(data[0]['slug'], self.laptop.slug)
+        self.assertTrue(data[0]['thumbnail'].endswith('products/laptop.jpg'))
+
+    def test_prefix_typo_and_sku_matches(self):
+        self.assertEqual({item['name'] for item in self.autocomplete('Lapt').data}, {"Gaming Laptop", "Laptop Bag"})
+        self.assertEqual([item['name'] for item in self.autocomplete('gamng').data], ["Gaming Laptop"])
+        self.assertEqual([item['name'] for item in self.autocomplete('bag-').data], ["Laptop Bag"])
+
+    def test_short_queries_return_nothing(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete(' l ').data, [])
+
+    def test_popular_prefixes_are_cached_until_the_catalog_changes(self):
+        self.autocomplete('laptop')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.autocomplete('  LAPTOP').data), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bag.name = "Carry Bag"
+            self.bag.save()
+        self.assertEqual([item['name'] for item in self.autocomplete('laptop').data], ["Gaming Laptop"])
+
+    def test_own_per_minute_throttle(self):
+        rates = {'anon': '1/day', 'autocomplete': '3/minute'}
+        with mock.patch.dict(ScopedRateThrottle.THROTTLE_RATES, rates), \
+                mock.patch.dict(AnonRateThrottle.THROTTLE_RATES, rates):
+            statuses = [
+                self.client.get('/api/v1/products/autocomplete/', {'q': 'lap'}).status_code for _ in range(4)
+            ]
+        # The daily anonymous budget doesn't apply, the per-minute one does
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+    def test_latency_budget(self):
+        slow = Product.objects.annotate(delay=RawSQL("(SELECT 1 FROM pg_sleep(0.05))", []))
+        with override_settings(PRODUCT_AUTOCOMPLETE_TIMEOUT_MS=1):
+            with mock.patch('apps.products.search.autocomplete_queryset', return_value=slow):
+                response = self.autocomplete('laptop')
+        self.assertEqual(response.data, [])
+        self.assertEqual(response['X-Autocomplete-Timeout'], 'true')
+        # Timeouts aren't cached and the budget doesn't outlive the lookup
+        self.assertEqual(len(self.autocomplete('laptop').data), 2)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductFacetTests(APITestCase):
+    def setUp(self):
+        self.phones = Category.objects.create(name="Phones")
+        self.cases = Category.objects.create(name="Cases")
+        color = ProductAttribute.objects.create(name="Color")
+        size = ProductAttribute.objects.create(name="Size")
+        self.red = ProductAttributeValue.objects.create(attribute=color, value="Red")
+        self.blue = ProductAttributeValue.objects.create(attribute=color, value="Blue")
+        self.large = ProductAttributeValue.objects.create(attribute=size, value="Large")
+
+        self.phone = self.create("Phone", 400, self.phones, [[self.red, self.large], [self.blue]])
+        self.case = self.create("Case", 20, self.cases, [[self.red], [self.red, self.large]])
+        self.cover = self.create("Cover", 30, self.cases, [[self.blue, self.large]], is_available=False)
+
+    def create(self, name, price, category, variants, is_available=True):
+        product = Product.objects.create(
+            name=name, sku=name.upper(), description=name, price=price, category=category,
+            inventory=1, is_available=is_available
+        )
+        for index, values in enumerate(variants):
+            variant = ProductVariant.objects.create(product=product, name=str(index), sku=f"{name.upper()}-{index}")
+            for value in values:
+                VariantAttributeValue.objects.create(variant=variant, attribute_value=value)
+        return product
+
+    def get(self, **params):
+        response = self.client.get('/api/v1/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def names(self, **params):
+        return sorted(item['name'] for item in self.get(**params).data['results'])
+
+    def facet_counts(self, facets, dimension):
+        if dimension == 'attributes':
+            return {value['value']: value['count'] for attribute in facets['attributes'] for value in attribute['values']}
+        if dimension == 'category':
+            return {item['name']: item['count'] for item in facets['category']}
+        if dimension == 'price':
+            return {(item['min'], item['max']): item['count'] for item in facets['price'] if item['count']}
+        return {item['value']: item['count'] for item in facets['is_available']}
+
+    def test_filters(self):
+        self.assertEqual(self.names(price__gte=25, price__lte=400), ["Cover", "Phone"])
+        self.assertEqual(self.names(attribute_value=f"{self.red.id},{self.blue.id}"), ["Case", "Cover", "Phone"])
+        self.assertEqual(self.names(attribute_value=f"{self.blue.id},{self.large.id}"), ["Cover", "Phone"])
+        self.assertEqual(self.names(attribute_value="999999"), [])
+
+    def test_facets_are_opt_in(self):
+        self.assertNotIn('facets', self.get().data)
+
+    def test_facet_counts(self):
+        facets = self.get(facets='true').data['facets']
+        self.assertEqual(self.facet_counts(facets, 'category'), {"Cases": 2, "Phones": 1})
+        self.assertEqual(self.facet_counts(facets, 'is_available'), {True: 2, False: 1})
+        self.assertEqual(self.facet_counts(facets, 'price'), {(None, 25): 1, (25, 50): 1, (250, 500): 1})
+        # The case has Red on two variants but is counted once
+        self.assertEqual(self.facet_counts(facets, 'attributes'), {"Red": 2, "Blue": 2, "Large": 3})
+
+    def test_each_dimension_ignores_its_own_filter(self):
+        facets = self.get(facets='true', is_available='true', attribute_value=str(self.red.id)).data['facets']
+        self.assertEqual(self.facet_counts(facets, 'is_available'), {True: 2, False: 0})
+        self.assertEqual(self.facet_counts(facets, 'category'), {"Cases": 1, "Phones": 1})
+        # Blue is still offered next to the selected Red; Size is narrowed by it
+        self.assertEqual(self.facet_counts(facets, 'attributes'), {"Red": 2, "Blue": 1, "Large": 2})
+
+    def test_facet_query_count_does_not_grow_with_values(self):
+        def count():
+            with CaptureQueriesContext(connection) as context:
+                self.get(facets='true', attribute_value=str(self.red.id))
+            return len(context.captured_queries)
+
+        before = count()
+        for index in range(10):
+            value = ProductAttributeValue.objects.create(attribute=self.red.attribute, value=f"Color {index}")
+            category = Category.objects.create(name=f"Category {index}")
+            self.create(f"Extra{index}", index * 50, category, [[value]])
+        self.assertEqual(count(), before)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductPaginationTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Misc")
+        for index in range(30):
+            product = create_product(self.category, index, images=1)
+            # Plenty of equal prices, so pages have to split ties
+            Product.objects.filter(pk=product.pk).update(price=index % 3)
+
+    def walk(self, params):
+        names = []
+        url, params = '/api/v1/products/', dict(params, pagination='keyset')
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            names += [product['name'] for product in response.data['results']]
+            url, params = response.data['next'], None
+        return names
+
+    def test_keyset_pages_by_price_and_name(self):
+        self.assertEqual(
+            self.walk({'ordering': 'price'}),
+            list(Product.objects.order_by('price', 'id').values_list('name', flat=True))
+        )
+        self.assertEqual(
+            self.walk({'ordering': '-name', 'category': self.category.id}),
+            list(Product.objects.order_by('-name', '-id').values_list('name', flat=True))
+        )
+
+    def test_keyset_previous_link(self):
+        first = self.client.get('/api/v1/products/', {'pagination': 'keyset'}).data
+        second = self.client.get(first['next']).data
+        self.assertEqual(self.client.get(second['previous']).data['results'], first['results'])
+
+    def test_approximate_counts(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE products_product")
+        # Small counts are exact
+        self.assertEqual(self.client.get('/api/v1/products/', {'count': 'approximate'}).data['count'], 30)
+
+        with mock.patch('core.pagination.APPROXIMATE_COUNT_THRESHOLD', 0):
+            with CaptureQueriesContext(connection) as context:
+                data = self.client.get('/api/v1/products/', {'count': 'approximate', 'pagination': 'keyset'}).data
+            self.assertEqual(data['count'], 30)  # reltuples, exact right after ANALYZE
+            self.assertFalse(any('COUNT(' in query['sql'].upper() for query in context.captured_queries))
+
+            data = self.client.get('/api/v1/products/', {'count': 'approximate', 'price__gte': 1}).data
+            self.assertIsInstance(data['count'], int)
+            self.assertGreater(data['count'], 0)
+
+
+CATALOG_CSV = """sku,name,description,price,category,inventory,images,variant_sku,variant_name,price_adjustment,variant_inventory,attributes
+TS-1,T-shirt,Cotton,19.90,Shirts,10,products/ts-1.jpg|products/ts-1-back.jpg,TS-1-M,Medium,0,4,Size=M;Color=Red
+TS-1,,,,,,,TS-1-L,Large,2.00,3,Size=L;Color=Red
+HAT-1,Hat,,15,shirts,0,,,,,,
+BAD-1,Broken,,abc,Shirts,1,,,,,,
+"""
+
+
+class CatalogImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirts = Category.objects.create(name="Shirts")
+        ProductAttribute.objects.create(name="Size")
+
+    def import_csv(self, text=CATALOG_CSV, **kwargs):
+        return import_catalog(StringIO(text), 'csv', **kwargs)
+
+    def test_csv_import(self):
+        version = get_catalog_version()
+        importer = self.import_csv()
+        self.assertEqual(importer.stats, {'created': 2, 'updated': 0, 'variants': 2, 'images': 2, 'errors': 1})
+        self.assertEqual(importer.errors, [(5, "price must be a number.")])
+        self.assertGreater(get_catalog_version(), version)
+
+        shirt = Product.objects.get(sku='TS-1')
+        self.assertEqual((shirt.slug, shirt.price, shirt.category, shirt.inventory), ('t-shirt', Decimal('19.90'), self.shirts, 10))
+        self.assertEqual(shirt.images.get(is_primary=True).image.name, 'products/ts-1.jpg')
+        large = shirt.variants.get(sku='TS-1-L')
+        self.assertEqual((large.name, large.price_adjustment, large.inventory), ('Large', Decimal('2.00'), 3))
+        self.assertEqual(
+            sorted(str(value.attribute_value) for value in large.attribute_values.all()), ['Color: Red', 'Size: L']
+        )
+        # Existing attributes are reused, missing ones created once
+        self.assertEqual(ProductAttribute.objects.count(), 2)
+        self.assertEqual(ProductAttributeValue.objects.filter(value='Red').count(), 1)
+        # Out of stock products are never available, as with the availability signal
+        self.assertFalse(Product.objects.get(sku='HAT-1').is_available)
+        # The search vector trigger still runs for bulk inserts
+        self.assertEqual(list(Product.objects.filter(search_vector='cotton').values_list('sku', flat=True)), ['TS-1'])
+
+    def test_reimport_updates_by_sku(self):
+        self.import_csv()
+        shirt = Product.objects.get(sku='TS-1')
+        jsonl = "\n".join([
+            '{"sku": "TS-1", "name": "Renamed shirt", "price": 25, "inventory": 7, "images": [],'
+            ' "variants": [{"sku": "TS-1-M", "name": "M", "inventory": 9, "attributes": {"Size": "M"}}]}',
+            '',
+            '{"sku": "NEW-1", "name": "T-shirt", "price": "5.00", "inventory": 1}',
+            'not json',
+        ])
+        importer = import_catalog(StringIO(jsonl), 'jsonl')
+        self.assertEqual((importer.stats['created'], importer.stats['updated'], importer.stats['errors']), (1, 1, 1))
+
+        updated = Product.objects.get(sku='TS-1')
+        self.assertEqual((updated.pk, updated.slug, updated.created_at), (shirt.pk, shirt.slug, shirt.created_at))
+        self.assertEqual((updated.name, updated.price, updated.inventory), ('Renamed shirt', Decimal('25'), 7))
+        self.assertFalse(updated.images.exists())
+        medium = ProductVariant.objects.get(sku='TS-1-M')
+        self.assertEqual(medium.inventory, 9)
+        self.assertEqual([str(value.attribute_value) for value in medium.attribute_values.all()], ['Size: M'])
+        # A name clash gets a slug made unique with the SKU
+        self.assertEqual(Product.objects.get(sku='NEW-1').slug, 't-shirt-new-1')
+
+    def test_reimport_keeps_availability_set_by_staff(self):
+        self.import_csv()
+        Product.objects.filter(sku='TS-1').update(is_available=False)
+        ProductVariant.objects.filter(sku='TS-1-M').update(is_available=False)
+
+        import_catalog(StringIO(
+            "sku,name,price,inventory,variant_sku\nTS-1,T-shirt,21,8,TS-1-M\nHAT-1,Hat,5,0,\n"
+        ), 'csv')
+        self.assertFalse(Product.objects.get(sku='TS-1').is_available)
+        self.assertFalse(ProductVariant.objects.get(sku='TS-1-M').is_available)
+        self.assertEqual(Product.objects.get(sku='TS-1').price, Decimal('21'))
+
+        # An explicit value is written, still off when out of stock
+        import_catalog(StringIO(
+            "sku,name,price,inventory,is_available\nTS-1,T-shirt,21,8,true\nHAT-1,Hat,5,0,true\n"
+        ), 'csv')
+        self.assertTrue(Product.objects.get(sku='TS-1').is_available)
+        self.assertFalse(Product.objects.get(sku='HAT-1').is_available)
+
+    def test_slug_clashes_get_a_counter(self):
+        Product.objects.create(name="Mug", slug="mug", sku="OLD-1", description="-", price=1, inventory=1)
+        Product.objects.create(name="Other", slug="mug-mug-1", sku="OLD-2", description="-", price=1, inventory=1)
+        importer = import_catalog(StringIO("sku,name,price,inventory\nMUG-1,Mug,5,1\nmug-1,Mug,5,1\n"), 'csv')
+
+        self.assertEqual(importer.stats['errors'], 0)
+        self.assertEqual(
+            set(Product.objects.filter(sku__in=['MUG-1', 'mug-1']).values_list('slug', flat=True)),
+            {'mug-mug-1-2', 'mug-mug-1-3'}
+        )
+
+    def test_queries_per_chunk_not_per_row(self):
+        def rows(count, start=0):
+            return "sku,name,price,inventory,variant_sku,attributes\n" + "".join(
+                f"P-{index},Product {index},10,5,P-{index}-A,Size=S{index}\n" for index in range(start, start + count)
+            )
+
+        with CaptureQueriesContext(connection) as small:
+            self.import_csv(rows(10), chunk_size=1000)
+        with CaptureQueriesContext(connection) as large:
+            self.import_csv(rows(300, start=10), chunk_size=1000)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Product.objects.count(), 310)
+        self.assertEqual(VariantAttributeValue.objects.count(), 310)
+
+    def test_command(self):
+        out, err = StringIO(), StringIO()
+        with mock.patch('builtins.open', return_value=StringIO(CATALOG_CSV)):
+            call_command('import_catalog', 'catalog.csv', stdout=out, stderr=err)
+        self.assertIn("Imported 2 products (2 new, 0 updated), 2 variants and 2 images", out.getvalue())
+        self.assertIn("Line 5: price must be a number.", err.getvalue())
+
+    def test_admin_upload(self):
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="secret")
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get('/admin/products/product/import/').status_code, 200)
+        response = self.client.post('/admin/products/product/import/', {
+            'file': SimpleUploadedFile('catalog.csv', CATALOG_CSV.encode()),
+        })
+        self.assertRedirects(response, '/admin/products/product/', fetch_redirect_response=False)
+        self.assertEqual(Product.objects.count(), 2)
@@ -1,17 +1,35 @@
 from rest_framework import viewsets, filters, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
+from django.db.models import Prefetch
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Category, Product, ProductReview
+from .models import Category, Product, ProductReview, VariantAttributeValue
 from .serializers import (
     CategorySerializer,
     ProductSerializer,
     ProductDetailSerializer,
+    ProductAutocompleteSerializer,
     ProductReviewSerializer
 )
 from apps.users.permissions import IsAdmin
+from core.pagination import KeysetPagination, SelectablePaginationMixin
+from .facets import ProductFacets
+from .filters import ProductFilter
+from .search import (
+    AUTOCOMPLETE_MIN_LENGTH,
+    ProductSearchFilter,
+    get_autocomplete_suggestions,
+    normalize_autocomplete_text
+)
+from .cache import CachedLookupMixin, cache_response, get_cache_stats
+
+
+class ReviewPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 10
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedLookupMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
@@ -25,16 +43,64 @@ class CategoryViewSet(viewsets.ModelViewSet):
         else:
             permission_classes = [permissions.AllowAny]
         return [permission() for permission in permission_classes]
+    
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['get'])
+    @cache_response
+    def tree(self, request):
+        """The whole category hierarchy as nested `children` lists, loaded in one query"""
+        categories = list(self.filter_queryset(self.get_queryset()).order_by('depth', 'name'))
+        serialized = CategorySerializer(categories, many=True, context=self.get_serializer_context()).data
+        nodes = {}
+        roots = []
+        for category, data in zip(categories, serialized):
+            node = nodes[category.id] = dict(data, children=[])
+            # Parents come before their children when ordered by depth; categories
+            # whose parent was filtered out are shown at the top level
+            parent = nodes.get(category.parent_id)
+            (parent['children'] if parent else roots).append(node)
+        return Response(roots)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedLookupMixin, SelectablePaginationMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     lookup_field = 'slug'
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter]
-    search_fields = ['name', 'description', 'sku']
-    filterset_fields = ['category', 'is_available', 'is_featured']
-    ordering_fields = ['price', 'created_at', 'name']
+    # ProductSearchFilter goes last so its relevance ordering applies when no
+    # explicit ordering was requested
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
+    filterset_class = ProductFilter
+    ordering_fields = ['price', 'created_at', 'name', 'average_rating', 'rating_count']
     ordering = ['-created_at']
     
+    def get_queryset(self):
+        """
+        Load everything the product serializers touch up front so list and
+        detail responses cost a fixed number of queries regardless of page size.
+        """
+        queryset = Product.objects.select_related('category').prefetch_related('images')
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                'variants',
+                Prefetch(
+                    'variants__attribute_values',
+                    queryset=VariantAttributeValue.objects.select_related('attribute_value__attribute')
+                ),
+                Prefetch(
+                    'reviews',
+                    queryset=ProductReview.objects.filter(is_approved=True).select_related('user').order_by(
+                        *ReviewPagination.ordering
+                    )[:ProductDetailSerializer.REVIEW_PREVIEW_SIZE],
+                    to_attr='approved_reviews'
+                ),
+            )
+        return queryset
+    
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ProductDetailSerializer
@@ -43,20 +109,76 @@ class ProductViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             permission_classes = [IsAdmin]
+        elif self.action in ['review', 'cache_stats']:
+            # These declare their own permission_classes on the @action
+            return super().get_permissions()
         else:
             permission_classes = [permissions.AllowAny]
         return [permission() for permission in permission_classes]
     
+    def get_throttles(self):
+        if self.action == 'autocomplete':
+            # Fired on every keystroke, so it gets its own per-minute budget
+            # instead of the daily anon/user ones
+            self.throttle_scope = 'autocomplete'
+            return [ScopedRateThrottle()]
+        return super().get_throttles()
+    
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        """Add `?facets=true` to get counts per category, availability, price range and attribute value"""
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets', '').lower() in ('1', 'true'):
+            response.data['facets'] = ProductFacets(self).counts()
+        return response
+    
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['get'], url_path='cache-stats',
+            permission_classes=[permissions.IsAuthenticated, IsAdmin])
+    def cache_stats(self, request):
+        """Catalog response cache hit/miss counters for monitoring"""
+        return Response(get_cache_stats())
+    
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Typeahead suggestions for `?q=`: id, name, slug and thumbnail only.
+        Returns an empty list for short queries, and also when the lookup
+        exceeds its latency budget so the search box never waits on it.
+        """
+        text = normalize_autocomplete_text(request.query_params.get('q', ''))
+        if len(text) < AUTOCOMPLETE_MIN_LENGTH:
+            return Response([])
+        
+        suggestions = get_autocomplete_suggestions(text, ProductAutocompleteSerializer)
+        if suggestions is None:
+            return Response([], headers={'X-Autocomplete-Timeout': 'true'})
+        return Response(suggestions)
+    
     @action(detail=True, methods=['get'])
+    @cache_response
     def related(self, request, slug=None):
         """Get related products based on category"""
         product = self.get_object()
         related_products = Product.objects.filter(
             category=product.category
-        ).exclude(id=product.id)[:4]
+        ).exclude(id=product.id).select_related('category').prefetch_related('images')[:4]
         serializer = ProductSerializer(related_products, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def reviews(self, request, slug=None):
+        """Approved reviews of a product, newest first, paginated by cursor"""
+        product = self.get_object()
+        reviews = ProductReview.objects.filter(product=product, is_approved=True).select_related('user')
+        paginator = ReviewPagination()
+        page = paginator.paginate_queryset(reviews, request)
+        serializer = ProductReviewSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def review(self, request, slug=None):
         """Add a review to a product"""
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.reports.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the reporting rollups from orders, payments and users, repairing any "
+        "drift in the incrementally maintained counts. Celery beat runs it daily for the "
+        "last two days (see CELERY_BEAT_SCHEDULE); use it by hand for longer ranges."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help="Rebuild this many most recent days (default 2)")
+        parser.add_argument('--all', action='store_true', help="Rebuild the whole history")
+
+    def handle(self, *args, **options):
+        since = None if options['all'] else timezone.now() - timedelta(days=options['days'] - 1)
+        written = rebuild(since)
+        scope = "all history" if since is None else f"the last {options['days']} days"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {scope}: {written} rows"))
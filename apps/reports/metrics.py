@@ -0,0 +1,91 @@
+"""
+Business metrics shared by the admin dashboard and the monitoring endpoint.
+
+Every time window of a table is computed in the same pass with filtered
+aggregates (``SUM(...) FILTER (WHERE ...)``) over the rollup tables, and the
+result is cached for REPORTS_METRICS_CACHE_TIMEOUT seconds, so collecting
+all metrics costs three small queries at most and usually none.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import OrderStatusCount, SalesRollup, SignupRollup
+
+METRICS_CACHE_KEY = 'reports:metrics'
+
+
+def get_date_range_filters():
+    today = timezone.localdate()
+
+    def start_of(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    today_end = timezone.make_aware(datetime.combine(today, time.max))
+    return {
+        'today': {'start': start_of(today), 'end': today_end},
+        # This week, starting from Monday
+        'week': {'start': start_of(today - timedelta(days=today.weekday())), 'end': today_end},
+        'month': {'start': start_of(today.replace(day=1)), 'end': today_end},
+    }
+
+
+def _windowed_sums(queryset, fields, date_ranges):
+    """
+    Sum each of `fields` ({name: column}) over every window in `date_ranges`
+    and over all rows, in one aggregate query. Returns {window: {name: sum}}.
+    """
+    aggregates = {}
+    for field, column in fields.items():
+        aggregates[f'all_time__{field}'] = Sum(column)
+        for window, date_range in date_ranges.items():
+            aggregates[f'{window}__{field}'] = Sum(
+                column, filter=Q(period_start__range=[date_range['start'], date_range['end']])
+            )
+    sums = {}
+    for key, value in queryset.aggregate(**aggregates).items():
+        window, field = key.split('__')
+        sums.setdefault(window, {})[field] = value
+    return sums
+
+
+def compute_metrics():
+    date_ranges = get_date_range_filters()
+    daily_sales = SalesRollup.objects.filter(granularity='day')
+    sales = _windowed_sums(daily_sales, {
+        'count': 'order_count',
+        'total': 'revenue',
+        'payment_count': 'payment_count',
+        'payment_total': 'payment_amount',
+    }, date_ranges)
+    signups = _windowed_sums(SignupRollup.objects.filter(granularity='day'), {'count': 'signups'}, date_ranges)
+
+    windows = ['today', 'week', 'month', 'all_time']
+    return {
+        'generated_at': timezone.now(),
+        'sales': {
+            window: {'count': sales[window]['count'] or 0, 'total': sales[window]['total']}
+            for window in windows
+        },
+        'payments': {
+            window: {'count': sales[window]['payment_count'] or 0, 'total': sales[window]['payment_total']}
+            for window in windows
+        },
+        'customers': {
+            'total': signups['all_time']['count'] or 0,
+            **{f'new_{window}': signups[window]['count'] or 0 for window in date_ranges},
+        },
+        'order_status': dict(OrderStatusCount.objects.filter(count__gt=0).values_list('status', 'count')),
+    }
+
+
+def get_metrics():
+    """The current metrics, recomputed at most once per REPORTS_METRICS_CACHE_TIMEOUT seconds"""
+    metrics = cache.get(METRICS_CACHE_KEY)
+    if metrics is None:
+        metrics = compute_metrics()
+        cache.set(METRICS_CACHE_KEY, metrics, timeout=settings.REPORTS_METRICS_CACHE_TIMEOUT)
+    return metrics
@@ -0,0 +1,229 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    """Build the rollups from the existing orders, payments and users (a frozen copy of rollups.rebuild())"""
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    Payment = apps.get_model("orders", "Payment")
+    User = apps.get_model("users", "User")
+    SalesRollup = apps.get_model("reports", "SalesRollup")
+    SignupRollup = apps.get_model("reports", "SignupRollup")
+    ProductSalesRollup = apps.get_model("reports", "ProductSalesRollup")
+    OrderStatusCount = apps.get_model("reports", "OrderStatusCount")
+
+    sales = {}
+    signups = {}
+    for granularity, trunc in (("hour", TruncHour), ("day", TruncDay)):
+        for row in (
+            Order.objects.annotate(period=trunc("created_at"))
+            .values("period")
+            .annotate(order_count=Count("id"), revenue=Sum("total"))
+            .order_by()
+        ):
+            sales.setdefault((granularity, row["period"]), {}).update(
+                order_count=row["order_count"], revenue=row["revenue"]
+            )
+        for row in (
+            Payment.objects.filter(status="completed")
+            .annotate(period=trunc("created_at"))
+            .values("period")
+            .annotate(payment_count=Count("id"), payment_amount=Sum("amount"))
+            .order_by()
+        ):
+            sales.setdefault((granularity, row["period"]), {}).update(
+                payment_count=row["payment_count"],
+                payment_amount=row["payment_amount"],
+            )
+        for row in (
+            User.objects.annotate(period=trunc("date_joined"))
+            .values("period")
+            .annotate(signups=Count("id"))
+            .order_by()
+        ):
+            signups[(granularity, row["period"])] = row["signups"]
+
+    SalesRollup.objects.bulk_create(
+        [
+            SalesRollup(granularity=granularity, period_start=period_start, **values)
+            for (granularity, period_start), values in sales.items()
+        ]
+    )
+    SignupRollup.objects.bulk_create(
+        [
+            SignupRollup(
+                granularity=granularity, period_start=period_start, signups=count
+            )
+            for (granularity, period_start), count in signups.items()
+        ]
+    )
+    ProductSalesRollup.objects.bulk_create(
+        [
+            ProductSalesRollup(product_id=row.pop("product"), **row)
+            for row in OrderItem.objects.filter(product__isnull=False)
+            .annotate(day=TruncDate("order__created_at"))
+            .values("day", "product")
+            .annotate(
+                order_lines=Count("id"),
+                units=Sum("quantity"),
+                revenue=Sum("total_price"),
+            )
+            .order_by()
+        ]
+    )
+    OrderStatusCount.objects.bulk_create(
+        [
+            OrderStatusCount(status=row["status"], count=row["count"])
+            for row in Order.objects.values("status")
+            .annotate(count=Count("id"))
+            .order_by()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("orders", "0003_hot_path_indexes"),
+        ("products", "0006_hot_path_indexes"),
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderStatusCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("status", models.CharField(max_length=20, unique=True)),
+                ("count", models.IntegerField(db_default=0)),
+            ],
+            options={
+                "ordering": ("status",),
+            },
+        ),
+        migrations.CreateModel(
+            name="SalesRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")], max_length=10
+                    ),
+                ),
+                ("period_start", models.DateTimeField()),
+                ("order_count", models.IntegerField(db_default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(db_default=0, decimal_places=2, max_digits=14),
+                ),
+                ("payment_count", models.IntegerField(db_default=0)),
+                (
+                    "payment_amount",
+                    models.DecimalField(db_default=0, decimal_places=2, max_digits=14),
+                ),
+            ],
+            options={
+                "ordering": ("granularity", "period_start"),
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("granularity", "period_start"),
+                        name="sales_rollup_period_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="SignupRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")], max_length=10
+                    ),
+                ),
+                ("period_start", models.DateTimeField()),
+                ("signups", models.IntegerField(db_default=0)),
+            ],
+            options={
+                "ordering": ("granularity", "period_start"),
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("granularity", "period_start"),
+                        name="signup_rollup_period_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ProductSalesRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("order_lines", models.IntegerField(db_default=0)),
+                ("units", models.IntegerField(db_default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(db_default=0, decimal_places=2, max_digits=14),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sales_rollups",
+                        to="products.product",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("day",),
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("day", "product"),
+                        name="product_sales_rollup_day_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+from django.db import models
+
+
+class SalesRollup(models.Model):
+    """
+    Orders (by order date) and completed payments (by payment date) per hour
+    and per day, in the current time zone. Maintained by `reports.signals`
+    and rebuilt by the reconcile_rollups command.
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    period_start = models.DateTimeField()
+    order_count = models.IntegerField(db_default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, db_default=0)
+    payment_count = models.IntegerField(db_default=0)
+    payment_amount = models.DecimalField(max_digits=14, decimal_places=2, db_default=0)
+
+    class Meta:
+        ordering = ('granularity', 'period_start')
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'period_start'], name='sales_rollup_period_unique'),
+        ]
+
+    def __str__(self):
+        return f"Sales for {self.granularity} starting {self.period_start}"
+
+
+class ProductSalesRollup(models.Model):
+    """Order lines, units and revenue per product per day (by order date)"""
+    day = models.DateField()
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='sales_rollups')
+    order_lines = models.IntegerField(db_default=0)
+    units = models.IntegerField(db_default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, db_default=0)
+
+    class Meta:
+        ordering = ('day',)
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='product_sales_rollup_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"Sales of product {self.product_id} on {self.day}"
+
+
+class SignupRollup(models.Model):
+    """New user accounts per hour and per day (by date joined)"""
+    granularity = models.CharField(max_length=10, choices=SalesRollup.GRANULARITY_CHOICES)
+    period_start = models.DateTimeField()
+    signups = models.IntegerField(db_default=0)
+
+    class Meta:
+        ordering = ('granularity', 'period_start')
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'period_start'], name='signup_rollup_period_unique'),
+        ]
+
+    def __str__(self):
+        return f"Signups for {self.granularity} starting {self.period_start}"
+
+
+class OrderStatusCount(models.Model):
+    """How many orders are currently in each status"""
+    status = models.CharField(max_length=20, unique=True)
+    count = models.IntegerField(db_default=0)
+
+    class Meta:
+        ordering = ('status',)
+
+    def __str__(self):
+        return f"{self.status}: {self.count}"
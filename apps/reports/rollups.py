@@ -0,0 +1,183 @@
+"""
+Incremental maintenance and reconciliation of the reporting rollups.
+
+Writes to orders, payments and users are turned into deltas that are added
+to the rollup rows once the writing transaction has committed, each batch
+with a single ``INSERT ... ON CONFLICT DO UPDATE``. Running after commit
+keeps the hot rollup rows (every checkout touches the current hour and day)
+locked only for that one statement instead of for the whole checkout, at the
+price of missing an update if the process dies in between. `rebuild()`
+recomputes the rollups from the source tables and repairs any such drift.
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncHour
+from django.utils import timezone
+
+from apps.orders.models import Order, OrderItem, Payment
+from .models import OrderStatusCount, ProductSalesRollup, SalesRollup, SignupRollup
+
+User = get_user_model()
+
+
+def period_starts(moment):
+    """The start of the hour and of the day `moment` falls in, in the current time zone"""
+    local = timezone.localtime(moment)
+    return {
+        'hour': local.replace(minute=0, second=0, microsecond=0),
+        'day': local.replace(hour=0, minute=0, second=0, microsecond=0),
+    }
+
+
+def increment(model, key_fields, deltas):
+    """
+    Add `deltas` ({key tuple: {field: amount}}) to the rows of `model`
+    identified by `key_fields`, creating missing rows, in one statement.
+    """
+    deltas = {key: values for key, values in deltas.items() if any(values.values())}
+    if not deltas:
+        return
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    value_fields = sorted({field for values in deltas.values() for field in values})
+    key_columns = [quote(model._meta.get_field(field).column) for field in key_fields]
+    value_columns = [quote(model._meta.get_field(field).column) for field in value_fields]
+
+    row = f"({', '.join(['%s'] * (len(key_columns) + len(value_columns)))})"
+    params = []
+    for key, values in deltas.items():
+        params += [*key, *(values.get(field, 0) for field in value_fields)]
+    updates = ', '.join(f"{column} = {table}.{column} + EXCLUDED.{column}" for column in value_columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(key_columns + value_columns)}) "
+            f"VALUES {', '.join([row] * len(deltas))} "
+            f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}",
+            params
+        )
+
+
+def _add(deltas, key, sign, **values):
+    for field, value in values.items():
+        deltas[key][field] = deltas[key].get(field, 0) + sign * value
+
+
+def apply_order(order, sign=1, items=()):
+    """
+    Add (sign=1) or remove (sign=-1) an order's contribution: `order` is a
+    dict with created_at, total and status, `items` dicts with product_id,
+    quantity and total_price.
+    """
+    sales = defaultdict(dict)
+    for granularity, start in period_starts(order['created_at']).items():
+        _add(sales, (granularity, start), sign, order_count=1, revenue=order['total'])
+    increment(SalesRollup, ['granularity', 'period_start'], sales)
+    increment(OrderStatusCount, ['status'], {(order['status'],): {'count': sign}})
+
+    products = defaultdict(dict)
+    day = timezone.localdate(order['created_at'])
+    for item in items:
+        if item['product_id'] is not None:
+            _add(products, (day, item['product_id']), sign,
+                 order_lines=1, units=item['quantity'], revenue=item['total_price'])
+    increment(ProductSalesRollup, ['day', 'product'], products)
+
+
+def apply_order_change(previous, current):
+    """Move an edited order's contribution from its `previous` to its `current` total and status"""
+    if previous['total'] != current['total']:
+        sales = defaultdict(dict)
+        for granularity, start in period_starts(current['created_at']).items():
+            _add(sales, (granularity, start), 1, revenue=current['total'] - previous['total'])
+        increment(SalesRollup, ['granularity', 'period_start'], sales)
+    if previous['status'] != current['status']:
+        increment(OrderStatusCount, ['status'], {
+            (previous['status'],): {'count': -1},
+            (current['status'],): {'count': 1},
+        })
+
+
+def apply_payment(created_at, amount, sign=1):
+    sales = defaultdict(dict)
+    for granularity, start in period_starts(created_at).items():
+        _add(sales, (granularity, start), sign, payment_count=1, payment_amount=amount)
+    increment(SalesRollup, ['granularity', 'period_start'], sales)
+
+
+def apply_signup(date_joined, sign=1):
+    signups = {(granularity, start): {'signups': sign} for granularity, start in period_starts(date_joined).items()}
+    increment(SignupRollup, ['granularity', 'period_start'], signups)
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups for every period from the day of `since` onwards
+    (all of history if None) from the orders, payments and users tables, and
+    the status counts from scratch. Returns the number of rollup rows written.
+    """
+    start = None
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(timezone.localdate(since), time.min))
+
+    def window(queryset, field):
+        return queryset.filter(**{f'{field}__gte': start}) if start else queryset
+
+    def periods(model):
+        return window(model.objects.all(), 'period_start')
+
+    written = 0
+    with transaction.atomic():
+        sales = defaultdict(dict)
+        signups = defaultdict(dict)
+        for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+            for row in window(Order.objects.all(), 'created_at').annotate(period=trunc('created_at')).values(
+                'period'
+            ).annotate(order_count=Count('id'), revenue=Sum('total')).order_by():
+                sales[(granularity, row['period'])].update(order_count=row['order_count'], revenue=row['revenue'])
+            for row in window(Payment.objects.filter(status='completed'), 'created_at').annotate(
+                period=trunc('created_at')
+            ).values('period').annotate(payment_count=Count('id'), payment_amount=Sum('amount')).order_by():
+                sales[(granularity, row['period'])].update(
+                    payment_count=row['payment_count'], payment_amount=row['payment_amount']
+                )
+            for row in window(User.objects.all(), 'date_joined').annotate(period=trunc('date_joined')).values(
+                'period'
+            ).annotate(signups=Count('id')).order_by():
+                signups[(granularity, row['period'])]['signups'] = row['signups']
+
+        periods(SalesRollup).delete()
+        SalesRollup.objects.bulk_create([
+            SalesRollup(granularity=granularity, period_start=period_start, **values)
+            for (granularity, period_start), values in sales.items()
+        ])
+        periods(SignupRollup).delete()
+        SignupRollup.objects.bulk_create([
+            SignupRollup(granularity=granularity, period_start=period_start, **values)
+            for (granularity, period_start), values in signups.items()
+        ])
+        written += len(sales) + len(signups)
+
+        product_rollups = ProductSalesRollup.objects.all()
+        (product_rollups.filter(day__gte=start.date()) if start else product_rollups).delete()
+        items = OrderItem.objects.filter(product__isnull=False)
+        if start:
+            items = items.filter(order__created_at__gte=start)
+        rows = items.annotate(day=TruncDate('order__created_at')).values('day', 'product').annotate(
+            order_lines=Count('id'), units=Sum('quantity'), revenue=Sum('total_price')
+        ).order_by()
+        products = ProductSalesRollup.objects.bulk_create([
+            ProductSalesRollup(product_id=row.pop('product'), **row) for row in rows
+        ])
+        written += len(products)
+
+        OrderStatusCount.objects.all().delete()
+        statuses = OrderStatusCount.objects.bulk_create([
+            OrderStatusCount(status=row['status'], count=row['count'])
+            for row in Order.objects.values('status').annotate(count=Count('id')).order_by()
+        ])
+        written += len(statuses)
+    return written
@@ -0,0 +1,89 @@
+from functools import partial, update_wrapper
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from apps.orders.models import Order, OrderItem, Payment
+from apps.orders.signals import ORDER_SNAPSHOT_FIELDS, PAYMENT_SNAPSHOT_FIELDS
+from .rollups import apply_order, apply_order_change, apply_payment, apply_signup
+
+User = get_user_model()
+
+# What the rollups need to know about an order; the previous values come from
+# the snapshot apps.orders takes before each save
+ORDER_FIELDS = ORDER_SNAPSHOT_FIELDS
+ORDER_ITEM_FIELDS = ('product_id', 'quantity', 'total_price')
+
+
+def _after_commit(func, *args):
+    """
+    Run func(*args) once the transaction commits. Robust, so a failed rollup
+    update is logged instead of failing the request or the callbacks after
+    it; reconcile_rollups repairs the rollups later. update_wrapper() gives
+    the partial the __qualname__ Django logs such failures by.
+    """
+    transaction.on_commit(update_wrapper(partial(func, *args), func), robust=True)
+
+
+def _order_items(order_id):
+    return list(OrderItem.objects.filter(order_id=order_id).values(*ORDER_ITEM_FIELDS))
+
+
+def _record_new_order(order_id, order):
+    # Checkout adds the items after the order row, in the same transaction,
+    # so they are read once it has committed. The order itself is counted as
+    # created; later saves in the same transaction queue their own changes.
+    apply_order(order, items=_order_items(order_id))
+
+
+@receiver(post_save, sender=Order)
+def update_order_rollups(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    current = {field: getattr(instance, field) for field in ORDER_FIELDS}
+    if created or previous is None:
+        _after_commit(_record_new_order, instance.pk, current)
+        return
+    if previous['total'] != current['total'] or previous['status'] != current['status']:
+        _after_commit(apply_order_change, previous, current)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_rollups(sender, instance, **kwargs):
+    # The items are gone by post_delete
+    order = {field: getattr(instance, field) for field in ORDER_FIELDS}
+    _after_commit(apply_order, order, -1, _order_items(instance.pk))
+
+
+def _paid(payment):
+    return payment is not None and payment['status'] == 'completed'
+
+
+@receiver(post_save, sender=Payment)
+def update_payment_rollups(sender, instance, **kwargs):
+    """Count a payment once it is completed, and stop counting it if it no longer is"""
+    previous = getattr(instance, '_previous', None)
+    current = {field: getattr(instance, field) for field in PAYMENT_SNAPSHOT_FIELDS}
+    if _paid(previous) and _paid(current) and previous['amount'] == current['amount']:
+        return
+    if _paid(previous):
+        _after_commit(apply_payment, previous['created_at'], previous['amount'], -1)
+    if _paid(current):
+        _after_commit(apply_payment, current['created_at'], current['amount'])
+
+
+@receiver(post_delete, sender=Payment)
+def remove_payment_rollups(sender, instance, **kwargs):
+    if instance.status == 'completed':
+        _after_commit(apply_payment, instance.created_at, instance.amount, -1)
+
+
+@receiver(post_save, sender=User)
+def count_signup(sender, instance, created, **kwargs):
+    if created:
+        _after_commit(apply_signup, instance.date_joined)
+
+
+@receiver(post_delete, sender=User)
+def uncount_signup(sender, instance, **kwargs):
+    _after_commit(apply_signup, instance.date_joined, -1)
@@ -0,0 +1,11 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.utils import timezone
+from .rollups import rebuild
+
+
+@shared_task
+def reconcile_rollups(days=2):
+    """Rebuild the last `days` days of rollups, like ``manage.py reconcile_rollups``"""
+    return rebuild(timezone.now() - timedelta(days=days - 1))
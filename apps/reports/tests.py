@@ -0,0 +1,226 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from apps.orders.models import Cart, CartItem, Order, Payment
+from apps.products.models import Category, Product
+from core.dashboard import get_dashboard_context
+from .metrics import get_metrics
+from .models import OrderStatusCount, ProductSalesRollup, SalesRollup, SignupRollup
+from .rollups import rebuild
+from .tasks import reconcile_rollups
+
+User = get_user_model()
+
+CHECKOUT_DATA = {
+    'first_name': 'Jane',
+    'last_name': 'Doe',
+    'email': 'jane@example.com',
+    'phone': '555-0100',
+    'address': '1 Main St',
+    'city': 'Springfield',
+    'state': 'IL',
+    'postal_code': '62701',
+    'country': 'US',
+}
+
+
+def snapshot():
+    """Every rollup row, without ids, for comparing incremental maintenance with a rebuild"""
+    return {
+        'sales': sorted(
+            row for row in SalesRollup.objects.values_list(
+                'granularity', 'period_start', 'order_count', 'revenue', 'payment_count', 'payment_amount'
+            )
+            if any(row[2:])
+        ),
+        'products': sorted(
+            row for row in ProductSalesRollup.objects.values_list('day', 'product', 'order_lines', 'units', 'revenue')
+            if any(row[2:])
+        ),
+        'signups': sorted(
+            row for row in SignupRollup.objects.values_list('granularity', 'period_start', 'signups') if row[2]
+        ),
+        'statuses': sorted(row for row in OrderStatusCount.objects.values_list('status', 'count') if row[1]),
+    }
+
+
+class RollupTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(name="Misc")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user(email="shopper@example.com", username="shopper")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        self.shirt = Product.objects.create(name="Shirt", sku="SH-1", description="-", price=20, inventory=50)
+        self.hat = Product.objects.create(name="Hat", sku="HT-1", description="-", price=15, inventory=50)
+
+    def checkout(self, *lines):
+        for product, quantity in lines:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/orders/orders/', CHECKOUT_DATA, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data['id'])
+
+    def day_sales(self):
+        return SalesRollup.objects.get(granularity='day')
+
+    def test_checkout_updates_rollups(self):
+        self.checkout((self.shirt, 2), (self.hat, 1))
+        self.checkout((self.shirt, 1))
+
+        day = self.day_sales()
+        self.assertEqual((day.order_count, day.revenue), (2, Decimal('75.00')))
+        hour = SalesRollup.objects.get(granularity='hour')
+        self.assertEqual((hour.order_count, hour.revenue), (2, Decimal('75.00')))
+        shirt = ProductSalesRollup.objects.get(product=self.shirt)
+        self.assertEqual((shirt.order_lines, shirt.units, shirt.revenue), (2, 3, Decimal('60.00')))
+        self.assertEqual(OrderStatusCount.objects.get(status='pending').count, 2)
+
+    def test_status_changes_payments_and_deletes(self):
+        order = self.checkout((self.shirt, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = Payment.objects.create(order=order, payment_method='paypal', amount=order.total, status='completed')
+            order.status = 'processing'
+            order.save()
+        self.assertEqual(dict(OrderStatusCount.objects.values_list('status', 'count')), {'pending': 0, 'processing': 1})
+        self.assertEqual((self.day_sales().payment_count, self.day_sales().payment_amount), (1, Decimal('20.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.status = 'refunded'
+            payment.save()
+        self.assertEqual(self.day_sales().payment_count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual((self.day_sales().order_count, self.day_sales().revenue), (0, 0))
+        self.assertEqual(ProductSalesRollup.objects.get(product=self.shirt).units, 0)
+
+    def test_order_created_and_changed_in_one_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            order = Order.objects.create(user=self.user, subtotal=20, total=20, **CHECKOUT_DATA)
+            order.status = 'processing'
+            order.total = 25
+            order.save()
+        self.assertEqual(dict(OrderStatusCount.objects.values_list('status', 'count')), {'pending': 0, 'processing': 1})
+        self.assertEqual((self.day_sales().order_count, self.day_sales().revenue), (1, Decimal('25.00')))
+
+    def test_failed_rollup_update_does_not_fail_the_request(self):
+        order = self.checkout((self.shirt, 1))
+        with mock.patch('apps.reports.rollups.increment', side_effect=DatabaseError("lock timeout")):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/v1/orders/payments/', {
+                    'order': order.id, 'payment_method': 'paypal', 'amount': order.total, 'status': 'completed'
+                }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.day_sales().payment_count, 0)
+
+    def test_status_save_reads_the_previous_row_once(self):
+        order = self.checkout((self.shirt, 1))
+        order.status = 'processing'
+        with CaptureQueriesContext(connection) as context:
+            order.save(update_fields=['status'])
+        order_table = Order._meta.db_table
+        lookups = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM "{order_table}"' in query['sql']
+        ]
+        self.assertEqual(len(lookups), 1)
+
+    def test_signups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(email="other@example.com", username="other")
+        self.assertEqual(SignupRollup.objects.get(granularity='day').signups, 2)
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        order = self.checkout((self.shirt, 2), (self.hat, 3))
+        self.checkout((self.hat, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(order=order, payment_method='paypal', amount=order.total, status='completed')
+        incremental = snapshot()
+
+        SalesRollup.objects.update(order_count=99)
+        ProductSalesRollup.objects.all().delete()
+        call_command('reconcile_rollups', stdout=StringIO())
+        self.assertEqual(snapshot(), incremental)
+
+        rebuild()
+        self.assertEqual(snapshot(), incremental)
+
+        SalesRollup.objects.update(order_count=99)
+        reconcile_rollups()
+        self.assertEqual(snapshot(), incremental)
+
+    def test_dashboard_cost_is_independent_of_history(self):
+        def count_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                context_data = get_dashboard_context()
+                # Evaluate the lazy querysets like the template would
+                for value in context_data.values():
+                    if hasattr(value, '__iter__') and not isinstance(value, (str, dict)):
+                        list(value)
+            return len(context.captured_queries), context_data
+
+        self.checkout((self.shirt, 1))
+        before, _ = count_queries()
+        for _ in range(5):
+            self.checkout((self.shirt, 1), (self.hat, 2))
+        after, context_data = count_queries()
+
+        self.assertEqual(before, after)
+        self.assertEqual(context_data['sales_metrics']['today'], {'count': 6, 'total': Decimal('270.00')})
+        self.assertEqual(context_data['sales_metrics']['all_time']['count'], 6)
+        self.assertEqual(context_data['customer_metrics']['total'], 1)
+        self.assertEqual([product.units_sold for product in context_data['popular_products']], [6, 10])
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(email="admin@example.com", username="admin", is_admin=True)
+        today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        # Yesterday falls outside "today" but, unless today is the 1st, inside the month
+        for days_ago, count, revenue in [(0, 2, 30), (1, 1, 10), (400, 5, 100)]:
+            SalesRollup.objects.create(
+                granularity='day', period_start=today - timedelta(days=days_ago),
+                order_count=count, revenue=revenue, payment_count=count, payment_amount=revenue
+            )
+            SignupRollup.objects.create(granularity='day', period_start=today - timedelta(days=days_ago), signups=count)
+        OrderStatusCount.objects.create(status='pending', count=3)
+        OrderStatusCount.objects.create(status='shipped', count=0)
+
+    def test_one_query_per_table_then_cached(self):
+        with self.assertNumQueries(3):
+            metrics = get_metrics()
+        with self.assertNumQueries(0):
+            get_metrics()
+
+        self.assertEqual(metrics['sales']['today'], {'count': 2, 'total': Decimal('30.00')})
+        self.assertEqual(metrics['sales']['all_time'], {'count': 8, 'total': Decimal('140.00')})
+        self.assertEqual(metrics['payments']['all_time']['count'], 8)
+        self.assertEqual(metrics['customers']['new_today'], 2)
+        self.assertEqual(metrics['customers']['total'], 8)
+        self.assertEqual(metrics['order_status'], {'pending': 3})
+
+    def test_endpoint_is_admin_only(self):
+        self.assertEqual(self.client.get('/api/v1/reports/metrics/').status_code, 401)
+
+        customer = User.objects.create_user(email="customer@example.com", username="customer")
+        self.client.force_authenticate(customer)
+        self.assertEqual(self.client.get('/api/v1/reports/metrics/').status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/v1/reports/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sales']['today']['count'], 2)
@@ -0,0 +1,16 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from apps.users.permissions import IsAdmin
+from .metrics import get_metrics
+
+
+class MetricsView(APIView):
+    """
+    Sales, payment, customer and order status metrics as JSON, for the
+    dashboard and external monitoring. Served from a short-lived cache.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        return Response(get_metrics())
@@ -1,77 +1,47 @@
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Sum, Avg, Q
 from django.utils import timezone
 from datetime import timedelta
 from django.urls import reverse
 from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 from django.utils.html import format_html
-from apps.orders.models import Order, Payment
+from apps.orders.models import Order
 from apps.products.models import Product, ProductReview
-from apps.users.models import User
+from apps.reports.metrics import get_metrics
+from apps.reports.models import ProductSalesRollup
 
+POPULAR_PRODUCTS_DAYS = 30
 
-def get_date_range_filters():
-    today = timezone.now().date()
 
-    # Today
-    today_start = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.min.time()))
-    today_end = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.max.time()))
-
-    # This week (starting from Monday)
-    week_start = today - timedelta(days=today.weekday())
-    week_start = timezone.make_aware(timezone.datetime.combine(week_start, timezone.datetime.min.time()))
-    week_end = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.max.time()))
-
-    # This month
-    month_start = today.replace(day=1)
-    month_start = timezone.make_aware(timezone.datetime.combine(month_start, timezone.datetime.min.time()))
-    month_end = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.max.time()))
-
-    return {
-        'today': {'start': today_start, 'end': today_end},
-        'week': {'start': week_start, 'end': week_end},
-        'month': {'start': month_start, 'end': month_end},
-    }
-
-
-@staff_member_required
-def admin_dashboard(request):
-    """Custom admin dashboard with key e-commerce metrics"""
-    date_ranges = get_date_range_filters()
+def get_dashboard_context():
+    """
+    Key e-commerce metrics, read from the rollup tables in apps.reports so the
+    cost doesn't grow with the number of orders, order items or users.
+    """
+    metrics = get_metrics()
 
     # Sales metrics
-    sales_metrics = {
-        'today': Order.objects.filter(
-            created_at__range=[date_ranges['today']['start'], date_ranges['today']['end']]).aggregate(
-            count=Count('id'),
-            total=Sum('total'),
-        ),
-        'week': Order.objects.filter(
-            created_at__range=[date_ranges['week']['start'], date_ranges['week']['end']]).aggregate(
-            count=Count('id'),
-            total=Sum('total'),
-        ),
-        'month': Order.objects.filter(
-            created_at__range=[date_ranges['month']['start'], date_ranges['month']['end']]).aggregate(
-            count=Count('id'),
-            total=Sum('total'),
-        ),
-        'all_time': Order.objects.aggregate(
-            count=Count('id'),
-            total=Sum('total'),
-        ),
-    }
+    sales_metrics = metrics['sales']
 
     # Order status breakdown
-    order_status = Order.objects.values('status').annotate(count=Count('id')).order_by('status')
+    order_status = [{'status': status, 'count': count} for status, count in metrics['order_status'].items()]
 
     # Recent orders
     recent_orders = Order.objects.order_by('-created_at')[:5]
 
-    # Popular products
-    popular_products = Product.objects.annotate(
-        order_count=Count('orderitem')
+    # Popular products: most ordered over the last POPULAR_PRODUCTS_DAYS days
+    since = timezone.localdate() - timedelta(days=POPULAR_PRODUCTS_DAYS - 1)
+    top_sellers = ProductSalesRollup.objects.filter(day__gte=since).values('product').annotate(
+        order_count=Sum('order_lines'),
+        units_sold=Sum('units'),
     ).order_by('-order_count')[:5]
+    products = Product.objects.in_bulk([row['product'] for row in top_sellers])
+    popular_products = []
+    for row in top_sellers:
+        product = products[row['product']]
+        product.order_count = row['order_count']
+        product.units_sold = row['units_sold']
+        popular_products.append(product)
 
     # Low stock products
     low_stock_products = Product.objects.filter(
@@ -80,20 +50,12 @@ def admin_dashboard(request):
     ).order_by('inventory')[:5]
 
     # Customer metrics
-    customer_metrics = {
-        'total': User.objects.count(),
-        'new_today': User.objects.filter(
-            date_joined__range=[date_ranges['today']['start'], date_ranges['today']['end']]).count(),
-        'new_week': User.objects.filter(
-            date_joined__range=[date_ranges['week']['start'], date_ranges['week']['end']]).count(),
-        'new_month': User.objects.filter(
-            date_joined__range=[date_ranges['month']['start'], date_ranges['month']['end']]).count(),
-    }
+    customer_metrics = metrics['customers']
 
     # Recent reviews
     recent_reviews = ProductReview.objects.select_related('product', 'user').order_by('-created_at')[:5]
 
-    context = {
+    return {
         'title': 'E-Commerce Dashboard',
         'sales_metrics': sales_metrics,
         'order_status': order_status,
@@ -109,4 +71,8 @@ def admin_dashboard(request):
         'review_list_url': reverse('admin:products_productreview_changelist'),
     }
 
-    return render(request, 'admin/dashboard.html', context)
\ No newline at end of file
+
+@staff_member_required
+def admin_dashboard(request):
+    """Custom admin dashboard with key e-commerce metrics"""
+    return render(request, 'admin/dashboard.html', get_dashboard_context())
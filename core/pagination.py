@@ -0,0 +1,205 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor, PageNumberPagination
+from rest_framework.response import Response
+
+# Below this many (estimated) rows an exact COUNT(*) is cheap enough to run anyway
+APPROXIMATE_COUNT_THRESHOLD = 10000
+
+
+def wants_approximate_count(request):
+    return request.query_params.get('count') == 'approximate'
+
+
+def approximate_count(queryset):
+    """
+    The planner's estimate of how many rows `queryset` returns: the table's
+    pg_class.reltuples when it is unfiltered, the EXPLAIN row estimate when it
+    isn't. Small or never-analyzed tables get an exact count instead.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if queryset.query.where:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+        else:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+            estimate = cursor.fetchone()[0]
+    if estimate < APPROXIMATE_COUNT_THRESHOLD:
+        return queryset.count()
+    return int(estimate)
+
+
+class ApproximateCountPaginator(DjangoPaginator):
+    @cached_property
+    def count(self):
+        return approximate_count(self.object_list)
+
+
+class ApproximateCountPageNumberPagination(PageNumberPagination):
+    """PageNumberPagination that pages against `approximate_count` instead of COUNT(*) on `?count=approximate`"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if wants_approximate_count(request):
+            self.django_paginator_class = ApproximateCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination keyed on the complete ordering tuple.
+
+    DRF's CursorPagination only seeks on the first ordering field and falls
+    back to an OFFSET to step over ties. Here the cursor stores the value of
+    every ordering field (with the primary key always appended as a
+    tiebreaker), and each page is fetched with a keyset condition such as
+    ``created_at < x OR (created_at = x AND id < y)``, so every page costs the
+    same index range scan no matter how deep the client goes and no COUNT(*)
+    is issued. With `?count=approximate` the response carries the planner's
+    estimate of the total as `count`.
+    """
+    ordering = ('-created_at',)
+    tiebreaker = 'pk'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            descending = ordering[-1].startswith('-')
+            ordering.append(f"-{self.tiebreaker}" if descending else self.tiebreaker)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.count = approximate_count(queryset) if wants_approximate_count(request) else None
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor.reverse if self.cursor else False
+        position = self.decode_position(queryset.model) if self.cursor else None
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(_invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(_keyset_condition(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        came_from_cursor = position is not None
+        self.has_next = came_from_cursor if reverse else has_more
+        self.has_previous = has_more if reverse else came_from_cursor
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.count is None:
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def decode_position(self, model):
+        if self.cursor.position is None:
+            return None
+        try:
+            values = json.loads(self.cursor.position)
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                _get_field(model, field).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([
+            _get_field(type(instance), field).value_to_string(instance)
+            for field in ordering
+        ])
+
+
+class SelectablePaginationMixin:
+    """
+    Let clients pick the pagination of a list view per request: page numbers
+    by default, keyset pagination with `?pagination=keyset` (the `next` and
+    `previous` links carry it on, as does any request with a `cursor`).
+
+    Keyset pages follow the view's `?ordering=` or default ordering with the
+    primary key as tiebreaker; they never issue a COUNT(*) or an OFFSET, so
+    deep pages cost the same as the first.
+    """
+    pagination_class = ApproximateCountPageNumberPagination
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'keyset' or 'cursor' in params:
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
+def _invert(field):
+    return field[1:] if field.startswith('-') else f"-{field}"
+
+
+def _get_field(model, ordering_field):
+    name = ordering_field.lstrip('-')
+    if name == 'pk':
+        return model._meta.pk
+    return model._meta.get_field(name)
+
+
+def _keyset_condition(ordering, position):
+    """
+    Expand the row comparison ``(a, b, c) > (x, y, z)`` into the equivalent
+    OR of prefixes, which also supports mixed ASC/DESC orderings.
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f"{name}__{lookup}": position[index]})
+        for previous_field, previous_value in zip(ordering[:index], position[:index]):
+            clause &= Q(**{previous_field.lstrip('-'): previous_value})
+        condition |= clause
+    return condition
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     # Third-party apps
     'rest_framework',
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
     'apps.users',
     'apps.products',
     'apps.orders',
+    'apps.reports',
 ]
 
 MIDDLEWARE = [
@@ -160,9 +162,78 @@ CACHES = {
     }
 }
 
+# Celery (see core/celery.py)
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER", "redis://redis:6379/0")
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ALWAYS_EAGER = os.environ.get("CELERY_TASK_ALWAYS_EAGER", "0") == "1"
+
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "orders@example.com")
+
+# Status changes of an order within this many seconds are sent as one notification
+ORDER_NOTIFICATION_COALESCE_SECONDS = 60
+
+# Guest carts live in the cache (see apps/orders/carts.py): seconds they are
+# kept after their last change, and how many lines one may hold
+GUEST_CART_TIMEOUT = 60 * 60 * 24 * 7
+GUEST_CART_MAX_LINES = 100
+# Most operations one cart/batch/ request may carry
+CART_BATCH_MAX_OPERATIONS = 100
+# Carts untouched for this many days are deleted by sweep_abandoned_carts,
+# this many per transaction
+ABANDONED_CART_DAYS = 30
+CART_SWEEP_BATCH_SIZE = 1000
+
+# Order/payment event outbox, see apps/orders/outbox.py. Events are published
+# to a Redis stream by default; OUTBOX_PUBLISHER names any class with publish(events)
+OUTBOX_PUBLISHER = "apps.orders.outbox.RedisStreamPublisher"
+OUTBOX_STREAM = "orders:events"
+OUTBOX_STREAM_MAXLEN = 100000
+OUTBOX_BATCH_SIZE = 100
+# Seconds between relay runs that catch events whose on-commit trigger was lost
+OUTBOX_RELAY_INTERVAL = 30
+# Days published events are kept before purge_outbox deletes them
+OUTBOX_RETENTION_DAYS = 7
+
+# Seconds a stored Idempotency-Key response is replayed, see apps/orders/idempotency.py
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+CELERY_BEAT_SCHEDULE = {
+    "relay-outbox": {"task": "apps.orders.tasks.relay_outbox", "schedule": OUTBOX_RELAY_INTERVAL},
+    "purge-outbox": {"task": "apps.orders.tasks.purge_outbox", "schedule": 60 * 60},
+    "purge-idempotency-keys": {"task": "apps.orders.tasks.purge_idempotency_keys", "schedule": 60 * 60},
+    "sweep-abandoned-carts": {"task": "apps.orders.tasks.sweep_abandoned_carts", "schedule": 60 * 60 * 6},
+    "reconcile-rollups": {"task": "apps.reports.tasks.reconcile_rollups", "schedule": 60 * 60 * 24},
+}
+
+# Products written per transaction by the catalog import, see apps/products/importer.py
+CATALOG_IMPORT_CHUNK_SIZE = 1000
+
+# Seconds catalog API responses stay cached (0 disables), see apps/products/cache.py
+CATALOG_CACHE_TIMEOUT = int(os.environ.get("CATALOG_CACHE_TIMEOUT", 300))
+# Per-process LRU in front of Redis for product/category lookups: max entries,
+# seconds an entry lives, and how often (ms) each process checks the catalog version
+CATALOG_LOCAL_CACHE_SIZE = 500
+CATALOG_LOCAL_CACHE_TIMEOUT = 60
+CATALOG_VERSION_CHECK_MS = 500
+# Product typeahead: seconds a prefix's suggestions stay cached, and the
+# statement timeout (ms) after which the endpoint gives up and returns nothing
+PRODUCT_AUTOCOMPLETE_CACHE_TIMEOUT = 30
+PRODUCT_AUTOCOMPLETE_TIMEOUT_MS = 150
+
+# Seconds the dashboard/monitoring metrics stay cached, see apps/reports/metrics.py
+REPORTS_METRICS_CACHE_TIMEOUT = 30
+
 # Custom user model
 AUTH_USER_MODEL = 'users.User'
 
+# Order numbers (see apps/orders/numbering.py). Each process needs a distinct
+# node id; when unset, one is leased from the database for
+# ORDER_NUMBER_NODE_LEASE seconds and renewed while the process keeps running.
+ORDER_NUMBER_GENERATOR = 'apps.orders.numbering.TimeOrderedOrderNumberGenerator'
+ORDER_NUMBER_NODE_ID = os.environ.get('ORDER_NUMBER_NODE_ID')
+ORDER_NUMBER_NODE_LEASE = 600
+
 # Rest framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -185,7 +256,9 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
+        'user': '1000/day',
+        # Product typeahead, per user or IP
+        'autocomplete': '120/minute',
     }
 }
 
@@ -29,6 +29,7 @@ urlpatterns = [
         path('users/', include('apps.users.urls')),
         path('products/', include('apps.products.urls')),
         path('orders/', include('apps.orders.urls')),
+        path('reports/', include('apps.reports.urls')),
 
         # JWT Authentication
         path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),